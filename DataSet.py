@@ -1,5 +1,6 @@
 import disease_label_table
 import numpy as np
+import scipy.sparse
 from diagnosis.utils import group_by, flatten
 from pymongo import MongoClient
 import datetime
@@ -8,6 +9,8 @@ import requests
 import config
 from dateutil import parser
 
+label_table = disease_label_table.get_label_table()
+
 label_overrides = {
     'http://healthmap.org/ai.php?1097880' : ['Gastroenteritis'],
     'http://healthmap.org/ai.php?1220150' : ['Tuberculosis'],
@@ -50,7 +53,7 @@ class DataSet(object):
                 if disease is not None
             ]
             if any([
-                not disease_label_table.is_in_table(disease)
+                not label_table.is_in_table(disease)
                 for event in item['meta']['events']
                 for disease in event['diseases']
             ]):
@@ -91,36 +94,38 @@ class DataSet(object):
     def get_feature_vectors(self):
         """
         Vectorize feature_dicts, filter some out, and add parent labels.
+        When the dict_vectorizer is sparse the vectors are returned as a
+        CSR matrix, otherwise they are a dense numpy array.
         """
         if hasattr(self, '_feature_vectors'):
             return self._feature_vectors
-        features = []
-        for feature_vector in self.dict_vectorizer.transform(self.get_feature_dicts()):
-            features.append(feature_vector)
-        self._feature_vectors = np.array(features)
+        feature_vectors = self.dict_vectorizer.transform(self.get_feature_dicts())
+        if scipy.sparse.issparse(feature_vectors):
+            self._feature_vectors = feature_vectors.tocsr()
+        else:
+            self._feature_vectors = np.array(feature_vectors)
         return self._feature_vectors
     def get_labels(self, add_parents=False):
         def get_item_labels(item):
             if add_parents:
                 all_labels = set(item['labels'])
                 for label in item['labels']:
-                    for l2 in disease_label_table.get_inferred_labels(label):
+                    for l2 in label_table.get_inferred_labels(label):
                         all_labels.add(l2)
                 return list(all_labels)
             else:
                 return item['labels']
         return map(get_item_labels, self.items)
     def remove_zero_feature_vectors(self):
-        props = zip(self.items, self.get_feature_dicts(), self.get_feature_vectors())
+        feature_vectors = self.get_feature_vectors()
+        feature_dicts = self.get_feature_dicts()
+        # Row sums work the same way for dense arrays and sparse matrices.
+        nonzero_rows = np.flatnonzero(
+            np.asarray(feature_vectors.sum(axis=1)).ravel() > 0)
         original_items = self.items
-        self.items = []
-        self._feature_dicts = []
-        self._feature_vectors = []
-        for item, f_dict, f_vec in props:
-            if f_vec.sum() > 0:
-                self.items.append(item)
-                self._feature_dicts.append(f_dict)
-                self._feature_vectors.append(f_vec)
+        self.items = [original_items[i] for i in nonzero_rows]
+        self._feature_dicts = [feature_dicts[i] for i in nonzero_rows]
+        self._feature_vectors = feature_vectors[nonzero_rows]
         print "Articles removed because of zero feature vectors:"
         print len(original_items) - len(self.items), '/', len(original_items)
 
@@ -165,7 +170,7 @@ def fetch_promed_datasets():
             article["plantDisease"] = [diseaseName]
         return post_list
     # this could be updated to be a dictionary containing the display name and the search regex
-    diseases = disease_label_table.get_promed_labels()
+    diseases = label_table.promed_labels
     training_set = []
     time_offset_test_set = []
     for disease in diseases:
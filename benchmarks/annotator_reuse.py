@@ -0,0 +1,65 @@
+"""
+Measure the per document cost of constructing the structured incident and
+incident annotators compared to reusing one instance of each, and the
+latency of the first diagnosis with and without Diagnoser.warm_up.
+
+    python benchmarks/annotator_reuse.py -pickle_dir current_classifier -repeat 5 test/test_article.txt
+"""
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import argparse
+import codecs
+import time
+from epitator.annotator import AnnoDoc
+from epitator.structured_incident_annotator import StructuredIncidentAnnotator
+from epitator.incident_annotator import IncidentAnnotator
+from feature_selection import load_diagnoser
+
+def annotate_incidents(diagnoser, content, structured_incident_annotator, incident_annotator):
+    anno_doc = AnnoDoc(content)
+    for tier_name in ['resolved_keywords', 'dates', 'counts', 'geonames']:
+        diagnoser.add_tier(anno_doc, tier_name)
+    anno_doc.add_tier(structured_incident_annotator)
+    anno_doc.add_tier(incident_annotator)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-pickle_dir', default='current_classifier')
+    parser.add_argument('-repeat', type=int, default=5)
+    parser.add_argument('documents', nargs='+')
+    args = parser.parse_args()
+    contents = []
+    for path in args.documents:
+        with codecs.open(path, encoding='utf-8') as f:
+            contents.append(f.read())
+
+    start = time.time()
+    diagnoser = load_diagnoser(args.pickle_dir)
+    print "Diagnoser construction: %.3fs" % (time.time() - start)
+    start = time.time()
+    diagnoser.diagnose(contents[0], include_incidents=True)
+    print "First diagnosis without warm up: %.3fs" % (time.time() - start)
+
+    diagnoser = load_diagnoser(args.pickle_dir)
+    start = time.time()
+    diagnoser.warm_up()
+    print "Warm up: %.3fs" % (time.time() - start)
+    start = time.time()
+    diagnoser.diagnose(contents[0], include_incidents=True)
+    print "First diagnosis after warm up: %.3fs" % (time.time() - start)
+
+    for label, reuse in [("New annotators per document", False),
+                         ("Reused annotators", True)]:
+        durations = []
+        for i in range(args.repeat):
+            for content in contents:
+                start = time.time()
+                if reuse:
+                    annotate_incidents(diagnoser, content,
+                        diagnoser.structured_incident_annotator,
+                        diagnoser.incident_annotator)
+                else:
+                    annotate_incidents(diagnoser, content,
+                        StructuredIncidentAnnotator(), IncidentAnnotator())
+                durations.append(time.time() - start)
+        print "%s: mean %.3fs, max %.3fs" % (
+            label, sum(durations) / len(durations), max(durations))
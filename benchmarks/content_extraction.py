@@ -0,0 +1,72 @@
+"""
+Time extracting the article text from a directory of saved article html
+with a new Goose instance per document (the previous behavior), a reused
+ContentExtractor, and a ContentExtractor with the readability fast path.
+The similarity of the fast path output to the Goose output is also reported.
+
+    python benchmarks/content_extraction.py -dir path/to/html/files
+"""
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scraper"))
+import argparse
+import codecs
+import difflib
+import time
+import goose
+import process_resources
+
+fixture_dir = os.path.join(
+    os.path.dirname(__file__), "..", "scraper", "test_data", "articles")
+
+class NewGooseExtractor(process_resources.ContentExtractor):
+    """
+    Creates a Goose instance for every document and doesn't cache results
+    like extract_clean_content did before ContentExtractor was added.
+    """
+    def extract(self, content):
+        self.goose = goose.Goose({
+            'parser_class':'soup',
+            'enable_image_fetching' : False,
+        })
+        return self.extract_uncached(content)
+
+def time_extractor(extractor, documents):
+    start = time.time()
+    results = [extractor.extract(document) for document in documents]
+    return results, time.time() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-dir', default=fixture_dir)
+    parser.add_argument('-repeat', type=int, default=1,
+        help='Process the corpus this many times to measure cache hits.')
+    args = parser.parse_args()
+    documents = []
+    for name in sorted(os.listdir(args.dir)):
+        if name.endswith(".html") or name.endswith(".htm"):
+            with codecs.open(os.path.join(args.dir, name),
+                encoding="utf-8", errors="replace") as f:
+                documents.append(f.read())
+    documents = documents * args.repeat
+    print "%d documents" % len(documents)
+    goose_results, new_goose_time = time_extractor(
+        NewGooseExtractor(), documents)
+    print "New Goose per document: %.3fs" % new_goose_time
+    reused_results, reused_time = time_extractor(
+        process_resources.ContentExtractor(), documents)
+    print "Reused extractor: %.3fs, identical: %s" % (
+        reused_time,
+        [r['content'] for r in goose_results] ==
+        [r['content'] for r in reused_results])
+    fast_results, fast_time = time_extractor(
+        process_resources.ContentExtractor(fast_path=True), documents)
+    fast_path_similarities = [
+        difflib.SequenceMatcher(
+            None, goose_result['content'], fast_result['content']).ratio()
+        for goose_result, fast_result in zip(goose_results, fast_results)
+        if fast_result['method'] == 'readability']
+    print "Fast path: %.3fs, used for %d documents" % (
+        fast_time, len(fast_path_similarities))
+    if fast_path_similarities:
+        print "Mean similarity of fast path output to Goose output: %.3f" % (
+            sum(fast_path_similarities) / len(fast_path_similarities))
@@ -0,0 +1,64 @@
+"""
+Compare the diagnosis latency for different selections of output features.
+The classifier pickles are loaded from the given directory and each
+selection is run over the same documents.
+
+    python benchmarks/feature_selection.py -pickle_dir current_classifier -repeat 3 test/test_article.txt
+"""
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import argparse
+import codecs
+import pickle
+import time
+from diagnosis.Diagnoser import Diagnoser, required_tiers, default_features
+
+selections = [
+    ['diseases'],
+    ['keywords'],
+    ['geonames'],
+    ['dates'],
+    ['counts'],
+    ['geonames', 'dates'],
+    ['structuredIncidents'],
+    sorted(default_features),
+    sorted(default_features) + ['incidents'],
+]
+
+def load_diagnoser(pickle_dir):
+    with open(os.path.join(pickle_dir, 'classifier.p')) as f:
+        classifier = pickle.load(f)
+    with open(os.path.join(pickle_dir, 'dict_vectorizer.p')) as f:
+        dict_vectorizer = pickle.load(f)
+    with open(os.path.join(pickle_dir, 'keyword_array.p')) as f:
+        keyword_array = pickle.load(f)
+    return Diagnoser(
+        classifier,
+        dict_vectorizer,
+        keyword_array=keyword_array,
+        cutoff_ratio=.7)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-pickle_dir', default='current_classifier')
+    parser.add_argument('-repeat', type=int, default=3)
+    parser.add_argument('documents', nargs='+')
+    args = parser.parse_args()
+    diagnoser = load_diagnoser(args.pickle_dir)
+    contents = []
+    for path in args.documents:
+        with codecs.open(path, encoding='utf-8') as f:
+            contents.append(f.read())
+    # The first diagnosis loads the annotators' data,
+    # so it is not included in the timings.
+    diagnoser.diagnose(contents[0], include_incidents=True)
+    print "%-60s %10s %10s" % ("features", "mean (s)", "max (s)")
+    for features in selections:
+        durations = []
+        for i in range(args.repeat):
+            for content in contents:
+                start = time.time()
+                diagnoser.diagnose(content, features=features)
+                durations.append(time.time() - start)
+        print "%-60s %10.3f %10.3f" % (
+            ','.join(features), sum(durations) / len(durations), max(durations))
+        print "    tiers: " + ', '.join(required_tiers(features))
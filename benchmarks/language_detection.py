@@ -0,0 +1,81 @@
+"""
+Compare the accuracy and speed of translation.detect_language with the
+common English word regex that is_english used before it.
+The sample is an NDJSON file with "language" and "text" fields.
+Long documents are simulated by repeating the sample texts.
+
+    python benchmarks/language_detection.py -repeat 1 100 1000
+"""
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scraper"))
+import argparse
+import codecs
+import json
+import re
+import time
+import translation
+
+sample_path = os.path.join(os.path.dirname(__file__),
+    "..", "scraper", "test_data", "language_sample.ndjson")
+
+common_english_re = re.compile(
+    '\\b(' + '|'.join(translation.most_common_english_words) + ')\\b', re.I)
+
+def regex_is_english(text):
+    """
+    The implementation of is_english before detect_language was added.
+    """
+    unique_matches = set()
+    total_matches = 0
+    required_unique_matches = min(5, len(text) / 100)
+    required_matches = len(text) / 100
+    for match in common_english_re.finditer(text):
+        total_matches += 1
+        if match.group(0) in unique_matches:
+            continue
+        else:
+            unique_matches.add(match.group(0))
+        if len(unique_matches) > required_unique_matches and total_matches > required_matches:
+            return True
+    return False
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-file', default=sample_path)
+    parser.add_argument('-repeat', type=int, nargs='+', default=[1, 100, 1000])
+    args = parser.parse_args()
+    with codecs.open(args.file, encoding='utf-8') as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+    print "%d labeled texts" % len(samples)
+    regex_correct = 0
+    detector_english_correct = 0
+    detector_correct = 0
+    translator = translation.Translator()
+    for sample in samples:
+        is_english = sample['language'] == 'en'
+        language, confidence = translation.detect_language(sample['text'])
+        regex_correct += regex_is_english(sample['text']) == is_english
+        detector_english_correct += translator.is_english(sample['text']) == is_english
+        if language == sample['language']:
+            detector_correct += 1
+        else:
+            print (u"Misclassified %s text as %s (%.2f): %s" % (
+                sample['language'], language, confidence,
+                sample['text'][:60])).encode('utf-8')
+    print "English/non-English accuracy: regex %.3f, is_english %.3f" % (
+        float(regex_correct) / len(samples),
+        float(detector_english_correct) / len(samples))
+    print "Language code accuracy of detect_language: %.3f" % (
+        float(detector_correct) / len(samples))
+    for repeat in args.repeat:
+        texts = [u" ".join([sample['text']] * repeat) for sample in samples]
+        start = time.time()
+        for text in texts:
+            regex_is_english(text)
+        regex_time = time.time() - start
+        start = time.time()
+        for text in texts:
+            translation.detect_language(text)
+        detector_time = time.time() - start
+        print "%d chars per text: regex %.3fs, detect_language %.3fs" % (
+            len(texts[0]), regex_time, detector_time)
@@ -0,0 +1,124 @@
+"""
+Compare the load time and resident memory of the classifier pickles with
+the model bundle, with and without memory mapping. Each load is done in a
+new process so the measurements are independent.
+Without a model directory a synthetic model is created in a temporary
+directory.
+
+    python benchmarks/model_bundle.py -model_dir current_classifier
+    python benchmarks/model_bundle.py -classes 300 -keywords 40000
+"""
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import argparse
+import json
+import pickle
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import numpy as np
+from diagnosis import model_bundle
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024.0
+
+def measure(model_dir, mode):
+    """
+    Load the model and classify a batch of documents, returning the
+    load time, the classification time and the RSS growth.
+    """
+    start_rss = rss_mb()
+    start = time.time()
+    if mode == 'pickles':
+        classifier, dict_vectorizer, keyword_array = model_bundle.load_pickles(model_dir)
+    else:
+        bundle = model_bundle.load_bundle(
+            os.path.join(model_dir, model_bundle.bundle_name),
+            mmap=(mode == 'bundle (mmap)'))
+        classifier, dict_vectorizer = bundle.classifier, bundle.dict_vectorizer
+    load_seconds = time.time() - start
+    load_rss = rss_mb() - start_rss
+    random.seed(1)
+    features = dict_vectorizer.get_feature_names()
+    X = dict_vectorizer.transform([
+        { kw: 1 for kw in random.sample(features, 20) } for i in range(100)])
+    start = time.time()
+    classifier.predict_proba(X)
+    return {
+        'load_seconds': load_seconds,
+        'load_rss_mb': load_rss,
+        'classify_seconds': time.time() - start,
+        'rss_mb': rss_mb() - start_rss
+    }
+
+def make_synthetic_model(model_dir, num_classes, num_keywords):
+    from sklearn.feature_extraction import DictVectorizer
+    from sklearn.multiclass import OneVsRestClassifier
+    from sklearn.linear_model import LogisticRegression
+    random.seed(1)
+    keyword_array = [{
+        'keyword': u'keyword %d' % i,
+        'case_sensitive': False,
+        'category': 'doid/diseases',
+        'linked_keywords': [u'keyword %d' % random.randrange(num_keywords)],
+        # The pickled keywords include the unused synset objects.
+        'synset_object': { 'synonyms': [u'synonym %d' % i] * 5 }
+    } for i in range(num_keywords)]
+    keywords = [kw['keyword'] for kw in keyword_array]
+    feature_dicts = []
+    labels = []
+    for doc_idx in range(num_classes * 4):
+        feature_dicts.append({ kw: 1 for kw in random.sample(keywords, 20) })
+        labels.append('class %d' % (doc_idx % num_classes))
+    # Every keyword is included in the vocabulary.
+    dict_vectorizer = DictVectorizer().fit(feature_dicts + [{ kw: 1 for kw in keywords }])
+    classifier = OneVsRestClassifier(LogisticRegression()).fit(
+        dict_vectorizer.transform(feature_dicts), labels)
+    for name, artifact in zip(model_bundle.pickle_names,
+            [classifier, dict_vectorizer, keyword_array]):
+        with open(os.path.join(model_dir, name), 'wb') as f:
+            pickle.dump(artifact, f)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-model_dir')
+    parser.add_argument('-classes', type=int, default=300)
+    parser.add_argument('-keywords', type=int, default=40000)
+    parser.add_argument('-measure', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        print json.dumps(measure(args.model_dir, args.measure))
+        sys.exit()
+    temp_dir = None
+    model_dir = args.model_dir
+    if not model_dir:
+        model_dir = temp_dir = tempfile.mkdtemp()
+        print "Creating a synthetic model with %d classes and %d keywords" % (
+            args.classes, args.keywords)
+        make_synthetic_model(model_dir, args.classes, args.keywords)
+    try:
+        bundle_path = os.path.join(model_dir, model_bundle.bundle_name)
+        if not os.path.exists(bundle_path):
+            model_bundle.write_bundle(
+                bundle_path, *model_bundle.load_pickles(model_dir))
+        for name in model_bundle.pickle_names:
+            path = os.path.join(model_dir, name)
+            print "%-20s %8.1f MB" % (name, os.path.getsize(path) / 1e6)
+        print "%-20s %8.1f MB" % (
+            model_bundle.bundle_name, os.path.getsize(bundle_path) / 1e6)
+        print "%-16s %10s %12s %14s %12s" % (
+            "", "load (s)", "load RSS MB", "classify (s)", "total RSS MB")
+        for mode in ['pickles', 'bundle', 'bundle (mmap)']:
+            result = json.loads(subprocess.check_output([
+                sys.executable, __file__,
+                '-model_dir', model_dir, '-measure', mode]))
+            print "%-16s %10.3f %12.1f %14.3f %12.1f" % (
+                mode, result['load_seconds'], result['load_rss_mb'],
+                result['classify_seconds'], result['rss_mb'])
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir)
@@ -0,0 +1,59 @@
+"""
+Time formatting large ProMED posts with the list buffered formatter and
+with the previous string concatenation based formatter.
+Large summary posts are simulated by repeating the saved post fixtures.
+
+    python benchmarks/promed_formatting.py -repeat 1 10 100 400
+"""
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scraper"))
+import argparse
+import codecs
+import re
+import time
+from bs4 import BeautifulSoup
+import scrape_promed
+
+fixture_dir = os.path.join(
+    os.path.dirname(__file__), "..", "scraper", "test_data", "promed")
+
+def dom_tree_to_formatted_text_concat(el):
+    """
+    The formatter that was used before the list buffered version.
+    """
+    result = ""
+    if not hasattr(el, "children"):
+        return scrape_promed.format_text_node(el)
+    for child in el.children:
+        if child.name and (re.match(r"h\d|p", child.name)):
+            result = re.sub("( )+$", "", result)
+            result += "\n" + dom_tree_to_formatted_text_concat(child).strip() + "\n\n"
+        elif str(child.name) == "br":
+            result = re.sub("( )+$", "", result)
+            result += "\n"
+        else:
+            if len(result) > 0 and re.match(r"\s", result[-1:]):
+                result += dom_tree_to_formatted_text_concat(child).lstrip()
+            else:
+                result += dom_tree_to_formatted_text_concat(child)
+    return result.strip()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-repeat', type=int, nargs='+', default=[1, 10, 100])
+    args = parser.parse_args()
+    html = u""
+    for name in sorted(os.listdir(fixture_dir)):
+        if name.endswith(".html"):
+            with codecs.open(os.path.join(fixture_dir, name), encoding="utf-8") as f:
+                html += f.read()
+    for repeat in args.repeat:
+        soup = BeautifulSoup(html * repeat)
+        start = time.time()
+        buffered = scrape_promed.dom_tree_to_formatted_text(soup)
+        buffered_time = time.time() - start
+        start = time.time()
+        concatenated = dom_tree_to_formatted_text_concat(soup)
+        concat_time = time.time() - start
+        print "%d chars: buffered %.3fs, concatenated %.3fs, identical: %s" % (
+            len(buffered), buffered_time, concat_time, buffered == concatenated)
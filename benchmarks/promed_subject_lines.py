@@ -0,0 +1,71 @@
+"""
+Time parsing ProMED subject lines with the compiled disease label matcher
+and with the previous approach of searching for each label with its own
+regex. The disease labels found by both approaches are compared.
+Subject lines are read from the promed posts collection in mongo, or from
+a text file with one subject line per line.
+
+    python benchmarks/promed_subject_lines.py -limit 5000
+    python benchmarks/promed_subject_lines.py -file subject_lines.txt
+"""
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scraper"))
+import argparse
+import re
+import time
+import disease_label_table
+import scrape_promed
+
+def find_labels_by_regex(description):
+    """
+    The label search that was used before the LabelMatcher.
+    """
+    labels = []
+    for row in disease_label_table.get_table():
+        for syn in row.get("synonyms", []) + [row["label"]]:
+            if re.search(r"\b" + re.escape(scrape_promed.simplify_text(syn)) + r"\b",
+                         scrape_promed.simplify_text(description), re.I):
+                labels.append(row["label"])
+                break
+    return labels
+
+def load_subject_lines(args):
+    if args.file:
+        with open(args.file) as f:
+            return [line.strip().decode('utf-8') for line in f if line.strip()]
+    import config
+    from pymongo import MongoClient
+    posts = MongoClient(config.mongo_url).promed.posts
+    return [
+        post['subject']['raw']
+        for post in posts.find({}, {'subject.raw': 1}).limit(args.limit)
+        if post.get('subject', {}).get('raw')]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-file', default=None)
+    parser.add_argument('-limit', type=int, default=5000)
+    args = parser.parse_args()
+    subject_lines = load_subject_lines(args)
+    print "Subject lines:", len(subject_lines)
+    # Build the matcher before timing.
+    scrape_promed.get_label_matcher()
+
+    start = time.time()
+    parsed = map(scrape_promed.parse_subject_line, subject_lines)
+    matcher_time = time.time() - start
+
+    start = time.time()
+    regex_labels = [
+        find_labels_by_regex(subject['description']) for subject in parsed]
+    regex_time = time.time() - start
+
+    mismatches = [
+        (line, subject['diseaseLabels'], labels)
+        for line, subject, labels in zip(subject_lines, parsed, regex_labels)
+        if subject['diseaseLabels'] != labels]
+    print "Compiled matcher (full subject parse): %.3fs" % matcher_time
+    print "Per-label regexes (label search only): %.3fs" % regex_time
+    print "Mismatched labels:", len(mismatches)
+    for mismatch in mismatches[:10]:
+        print mismatch
@@ -0,0 +1,160 @@
+"""
+Measure the bytes sent through the broker and result backend for a
+scrape -> process_text -> diagnose chain and the time to serialize them
+with each celery serializer, with and without the scraped html in the
+process_text result. The messages are built from the html files in a
+directory, or from a synthetic page of the given size, with a synthetic
+diagnosis.
+
+    python benchmarks/serialization.py -html_kb 150
+    python benchmarks/serialization.py -dir path/to/html/files
+"""
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import argparse
+import codecs
+import datetime
+import itertools
+import random
+import re
+import time
+from kombu.serialization import dumps, loads
+import serializers
+from tasks_preprocess import make_json_compat, without_html
+
+fixture_dir = os.path.join(
+    os.path.dirname(__file__), "..", "scraper", "test_data", "articles")
+
+def synthetic_page(size_kb):
+    """
+    Build an html page from the words of the fixture articles with markup,
+    scripts and links like the boilerplate of real news pages.
+    """
+    random.seed(1)
+    words = []
+    for file_name in sorted(os.listdir(fixture_dir)):
+        with codecs.open(os.path.join(fixture_dir, file_name), encoding='utf-8') as f:
+            words += re.findall(r'\w+', re.sub(r'<[^>]+>', ' ', f.read()), re.UNICODE)
+    chunks = [u'<html><head><title>Outbreak news</title></head><body>']
+    size = 0
+    while size < size_kb * 1024:
+        if random.random() < 0.3:
+            chunk = u'<script>var config_%d = {"id": %d, "track": true};</script>\n' % (
+                random.randrange(1000), random.randrange(10 ** 6))
+        elif random.random() < 0.5:
+            chunk = u'<li><a href="/news/%d">%s</a></li>\n' % (
+                random.randrange(10 ** 6), u' '.join(random.sample(words, 6)))
+        else:
+            chunk = u'<p>%s.</p>\n' % u' '.join(
+                random.choice(words) for i in range(60))
+        chunks.append(chunk)
+        size += len(chunk)
+    chunks.append(u'</body></html>')
+    return u''.join(chunks)
+
+def synthetic_diagnosis(content):
+    random.seed(2)
+    offsets = lambda: [[random.randrange(len(content)), random.randrange(len(content))]]
+    features = [{
+        'type': 'count', 'text': u'12 cases', 'label': u'12 cases', 'count': 12,
+        'attributes': ['case'], 'textOffsets': offsets()
+    } for i in range(10)] + [{
+        'type': 'location', 'name': u'Conakry',
+        'geoname': {
+            'geonameid': str(2422465 + i), 'name': u'Conakry', 'latitude': 9.53795,
+            'longitude': -13.67729, 'country_code': 'GN', 'feature_code': 'PPLC',
+            'population': 1767200, 'admin1_code': '04', 'score': 0.9
+        },
+        'textOffsets': offsets() * 3
+    } for i in range(8)] + [{
+        'type': 'datetime', 'name': u'March 1', 'value': u'March 1',
+        'textOffsets': offsets(),
+        'timeRange': {
+            'beginISO': '2016-03-01', 'begin': { 'year': 2016, 'month': 3, 'date': 1 },
+            'endISO': '2016-03-02', 'end': { 'year': 2016, 'month': 3, 'date': 2 }
+        }
+    } for i in range(10)] + [{
+        'type': keyword_type, 'value': u'keyword %d' % i, 'textOffsets': offsets() * 2
+    } for keyword_type in ['diseases', 'hosts', 'modes', 'pathogens', 'symptoms']
+        for i in range(6)]
+    return make_json_compat({
+        'diagnoserVersion': '0.4.0',
+        'dateOfDiagnosis': datetime.datetime.now(),
+        'diseases': [{
+            'name': u'Disease %d' % i, 'probability': random.random(),
+            'keywords': [{ 'name': u'keyword %d' % j, 'score': random.random() }
+                for j in range(5)],
+            'inferred_keywords': []
+        } for i in range(5)],
+        'features': features
+    })
+
+def chain_payloads(url, html, keep_html):
+    """
+    Return the task arguments and results of a url diagnosis chain. Each
+    result is stored in the result backend and the results of the first two
+    tasks are also published as the arguments of the next task.
+    """
+    scrape_result = make_json_compat({
+        'url': url, 'code': 200, 'msg': 'OK', 'encoding': 'utf-8',
+        'encodingSource': 'header', 'htmlContent': html
+    })
+    content = re.sub(r'<[^>]+>', ' ', html)
+    process_text_result = make_json_compat({
+        'scrapedData': scrape_result if keep_html else without_html(scrape_result),
+        'cleanContent': { 'content': content, 'title': u'Outbreak news' }
+    })
+    extra_args = { 'content_date': datetime.datetime(2016, 3, 1) }
+    return [
+        ('scrape message', ([url], {})),
+        ('scrape result', scrape_result),
+        ('process_text message', ([scrape_result], {})),
+        ('process_text result', process_text_result),
+        ('diagnose message', ([process_text_result, extra_args], {})),
+        ('diagnose result', synthetic_diagnosis(content))
+    ]
+
+def measure(payloads, serializer, repeat):
+    total_bytes = 0
+    encode_seconds = 0
+    decode_seconds = 0
+    for name, payload in payloads:
+        start = time.time()
+        for i in range(repeat):
+            content_type, content_encoding, data = dumps(payload, serializer=serializer)
+        encode_seconds += (time.time() - start) / repeat
+        start = time.time()
+        for i in range(repeat):
+            loads(data, content_type, content_encoding, accept=[content_type])
+        decode_seconds += (time.time() - start) / repeat
+        total_bytes += len(data)
+    return total_bytes, encode_seconds, decode_seconds
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-dir', help='A directory of html files')
+    parser.add_argument('-html_kb', type=int, default=150,
+        help='The size of the synthetic page to use when no directory is given')
+    parser.add_argument('-repeat', type=int, default=20)
+    args = parser.parse_args()
+    if args.dir:
+        pages = []
+        for file_name in sorted(os.listdir(args.dir)):
+            with codecs.open(os.path.join(args.dir, file_name), encoding='utf-8', errors='replace') as f:
+                pages.append(f.read())
+    else:
+        pages = [synthetic_page(args.html_kb)]
+    print "%d pages, average html size: %.1f KB" % (
+        len(pages), sum(len(page.encode('utf-8')) for page in pages) / 1024.0 / len(pages))
+    print "%-14s %-10s %16s %14s %14s" % (
+        "serializer", "html", "KB per request", "encode (ms)", "decode (ms)")
+    for serializer, keep_html in itertools.product(
+        ['pickle', 'json-zlib', 'msgpack-zlib'], [True, False]):
+        serializers.register(serializer)
+        results = [measure(
+            chain_payloads(u'http://example.com/%d' % idx, page, keep_html),
+            serializer, args.repeat) for idx, page in enumerate(pages)]
+        print "%-14s %-10s %16.1f %14.2f %14.2f" % (
+            serializer, "kept" if keep_html else "removed",
+            sum(r[0] for r in results) / 1024.0 / len(pages),
+            1000 * sum(r[1] for r in results) / len(pages),
+            1000 * sum(r[2] for r in results) / len(pages))
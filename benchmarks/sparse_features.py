@@ -0,0 +1,75 @@
+"""
+Compare the memory and time used by dense and sparse (CSR) feature vectors
+for training the classifier and scoring keywords when diagnosing.
+Synthetic keyword count dicts are used so the comparison can be run without
+the girder database.
+
+    python benchmarks/sparse_features.py -keywords 40000 -docs 4000
+"""
+import argparse
+import random
+import time
+import numpy as np
+import scipy.sparse
+from sklearn.feature_extraction import DictVectorizer
+from sklearn.multiclass import OneVsRestClassifier
+from sklearn.linear_model import LogisticRegression
+
+def matrix_nbytes(X):
+    if scipy.sparse.issparse(X):
+        return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    return X.nbytes
+
+def make_feature_dicts(num_docs, num_keywords, keywords_per_doc, num_classes):
+    random.seed(1)
+    keywords = ['keyword%d' % i for i in range(num_keywords)]
+    # Each class has a set of indicative keywords so the classifier
+    # has something to learn.
+    class_keywords = [
+        random.sample(keywords, 50) for i in range(num_classes)]
+    feature_dicts = []
+    labels = []
+    for doc_idx in range(num_docs):
+        label = doc_idx % num_classes
+        doc_keywords = random.sample(keywords, keywords_per_doc / 2) +\
+            random.sample(class_keywords[label], keywords_per_doc / 2)
+        feature_dicts.append({ kw : 1 for kw in doc_keywords })
+        labels.append(label)
+    return feature_dicts, labels
+
+def run(sparse, feature_dicts, labels):
+    print "Sparse:" if sparse else "Dense:"
+    start = time.time()
+    dict_vectorizer = DictVectorizer(sparse=sparse).fit(feature_dicts)
+    X = dict_vectorizer.transform(feature_dicts)
+    print "    vectorize: %.3fs" % (time.time() - start)
+    print "    feature matrix: %.1f MB" % (matrix_nbytes(X) / 1e6)
+    classifier = OneVsRestClassifier(LogisticRegression())
+    start = time.time()
+    classifier.fit(X, labels)
+    print "    fit: %.3fs" % (time.time() - start)
+    coef = classifier.coef_
+    rows = [X[i:i + 1] for i in range(200)]
+    start = time.time()
+    for row in rows:
+        probs = classifier.predict_proba(row)[0]
+        for i in np.flatnonzero(probs >= probs.max() * .7):
+            if sparse:
+                scores = coef[i, row.indices] * row.data
+            else:
+                scores = coef[i] * row[0]
+            np.linalg.norm(scores)
+    print "    classify and score: %.2fms/doc" % (
+        (time.time() - start) / len(rows) * 1e3)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-keywords', type=int, default=40000)
+    parser.add_argument('-docs', type=int, default=4000)
+    parser.add_argument('-keywords_per_doc', type=int, default=40)
+    parser.add_argument('-classes', type=int, default=20)
+    args = parser.parse_args()
+    feature_dicts, labels = make_feature_dicts(
+        args.docs, args.keywords, args.keywords_per_doc, args.classes)
+    run(True, feature_dicts, labels)
+    run(False, feature_dicts, labels)
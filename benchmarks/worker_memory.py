@@ -0,0 +1,146 @@
+"""
+Report the memory used by each celery worker process. The PSS
+(proportional set size) of a process counts each of its shared pages
+divided by the number of processes sharing it, so the sum of the PSS of a
+worker's processes is the memory the worker really uses.
+
+Measure the running workers on this machine:
+
+    python benchmarks/worker_memory.py
+
+Simulate a worker with the model bundle or pickles in a directory loaded
+before or after forking the given number of processes:
+
+    python benchmarks/worker_memory.py -simulate 4 -model_dir current_classifier
+
+The simulation only loads the classifier artifacts, not the annotators,
+unless -diagnoser is given. Then a warmed up Diagnoser is loaded like the
+worker preloads it, and each process forked from the parent reopens its
+database connections before diagnosing documents, as the worker processes do:
+
+    python benchmarks/worker_memory.py -simulate 4 -diagnoser
+"""
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import argparse
+import random
+import signal
+
+def memory_stats(pid):
+    """
+    Return the RSS, PSS, shared and private memory of a process in MB.
+    """
+    totals = { 'Rss': 0, 'Pss': 0, 'Shared': 0, 'Private': 0 }
+    with open('/proc/%s/smaps' % pid) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 3 or parts[2] != 'kB':
+                continue
+            key = parts[0].rstrip(':')
+            if key in ('Rss', 'Pss'):
+                totals[key] += int(parts[1])
+            elif key in ('Shared_Clean', 'Shared_Dirty'):
+                totals['Shared'] += int(parts[1])
+            elif key in ('Private_Clean', 'Private_Dirty'):
+                totals['Private'] += int(parts[1])
+    return { key: value / 1024.0 for key, value in totals.items() }
+
+def command_line(pid):
+    with open('/proc/%s/cmdline' % pid) as f:
+        return f.read().replace('\0', ' ').strip()
+
+def find_processes(pattern):
+    pids = []
+    for name in os.listdir('/proc'):
+        if name.isdigit() and int(name) != os.getpid():
+            try:
+                if pattern in command_line(name):
+                    pids.append(int(name))
+            except IOError:
+                pass
+    return sorted(pids)
+
+def report(pids, labels=None):
+    print "%8s %10s %10s %10s %10s  %s" % (
+        "pid", "RSS MB", "PSS MB", "shared MB", "private MB", "process")
+    total_pss = 0
+    for pid in pids:
+        stats = memory_stats(pid)
+        total_pss += stats['Pss']
+        print "%8d %10.1f %10.1f %10.1f %10.1f  %s" % (
+            pid, stats['Rss'], stats['Pss'], stats['Shared'], stats['Private'],
+            labels[pid] if labels else command_line(pid)[:60])
+    print "Total PSS: %.1f MB" % total_pss
+
+diagnoser_documents = [
+    "An outbreak of cholera in Nairobi sickened 87 people and killed 3.",
+    "Health officials in Conakry reported 12 new cases of Ebola on March 1.",
+    "Avian influenza H5N1 was found in poultry farms near Hanoi, Vietnam.",
+]
+
+def simulate(num_processes, model_dir, load_before_fork, mmap, diagnoser=False):
+    """
+    Fork processes that each classify documents with the model, loading it
+    in the parent before forking or in each process, and report their memory.
+    When diagnoser is True the processes diagnose documents with a Diagnoser.
+    """
+    from diagnosis import model_bundle
+    def load():
+        return model_bundle.load_model(model_dir, mmap=mmap)
+    def work(model):
+        classifier, dict_vectorizer, keyword_array = model
+        random.seed(os.getpid())
+        features = dict_vectorizer.get_feature_names()
+        for i in range(20):
+            X = dict_vectorizer.transform([
+                { kw: 1 for kw in random.sample(features, 20) }
+                for j in range(50)])
+            classifier.predict_proba(X)
+    if diagnoser:
+        from tasks_diagnose import load_diagnoser
+        def load():
+            return load_diagnoser(model_dir)[0]
+        def work(loaded_diagnoser):
+            if load_before_fork:
+                loaded_diagnoser.reopen_database_connections()
+            for content in diagnoser_documents * 5:
+                loaded_diagnoser.diagnose(content)
+    model = load() if load_before_fork else None
+    read_fd, write_fd = os.pipe()
+    children = []
+    for i in range(num_processes):
+        pid = os.fork()
+        if pid == 0:
+            work(model or load())
+            os.write(write_fd, 'x')
+            # Wait to be measured.
+            signal.pause()
+            os._exit(0)
+        children.append(pid)
+    # Wait for the children to load the model and classify.
+    for pid in children:
+        os.read(read_fd, 1)
+    labels = { os.getpid(): 'parent' }
+    labels.update({ pid: 'child' for pid in children })
+    report([os.getpid()] + children, labels)
+    for pid in children:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-pattern', default='celery worker',
+        help='Measure the processes with command lines that include this')
+    parser.add_argument('-simulate', type=int,
+        help='The number of worker processes to simulate')
+    parser.add_argument('-model_dir', default='current_classifier')
+    parser.add_argument('-no_mmap', action='store_true')
+    parser.add_argument('-diagnoser', action='store_true',
+        help='Simulate processes that diagnose documents with a Diagnoser')
+    args = parser.parse_args()
+    if args.simulate:
+        for load_before_fork in [False, True]:
+            print "Model loaded", "before forking:" if load_before_fork else "in each process:"
+            simulate(args.simulate, args.model_dir, load_before_fork,
+                not args.no_mmap, args.diagnoser)
+    else:
+        report(find_processes(args.pattern))
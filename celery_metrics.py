@@ -0,0 +1,162 @@
+"""
+Metrics recorded by the celery workers: the outcome of every task,
+how long tasks wait in each queue before a worker starts them,
+and the worker processes that have loaded the diagnoser.
+
+The time a task is published is added to its message headers, and the
+wait is measured when a worker starts the task. Since the workers are
+separate processes the metrics are kept in a mongo collection, which the
+server reads when /metrics is requested. Clocks on the server and worker
+hosts need to be in sync for the wait times to be accurate.
+"""
+import time
+import datetime
+import logging
+import celery.signals
+from celery.exceptions import SoftTimeLimitExceeded
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Tasks catch SoftTimeLimitExceeded and return this error.
+time_limit_error = 'Timelimit exceeded.'
+
+# Queue waits range from milliseconds to minutes when the workers are busy.
+queue_wait_buckets = (
+    0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def metrics_collection(metrics_config):
+    """
+    Return the mongo collection configured by a dict like:
+    { 'url': 'mongodb://localhost:27017', 'db': 'grits', 'collection': 'celeryMetrics' }
+    None is returned if the config is None.
+    """
+    if metrics_config is None:
+        return None
+    from pymongo import MongoClient
+    # A short timeout keeps an unavailable database from stalling tasks.
+    client = MongoClient(metrics_config.get('url', 'localhost'),
+        serverSelectionTimeoutMS=1000)
+    return client[metrics_config.get('db', 'grits')][
+        metrics_config.get('collection', 'celeryMetrics')]
+
+collection = metrics_collection(getattr(config, 'celery_metrics', {
+    'url': config.mongo_url
+}))
+
+if collection is not None:
+    task_outcomes = metrics.MongoCounter(
+        collection,
+        'grits_celery_task_outcomes_total',
+        'Celery tasks by outcome (success, failure, expired, revoked or soft_time_limit)',
+        ['task', 'outcome'])
+    queue_wait_seconds = metrics.MongoHistogram(
+        collection,
+        'grits_celery_queue_wait_seconds',
+        'Time between publishing a task and a worker starting it',
+        ['queue', 'task'],
+        buckets=queue_wait_buckets)
+    all_metrics = [task_outcomes, queue_wait_seconds]
+else:
+    all_metrics = []
+
+
+def record(metric, *args):
+    # Metrics should never cause a task to fail.
+    try:
+        metric(*args)
+    except Exception:
+        logger.exception("Could not record celery metric")
+
+
+@celery.signals.before_task_publish.connect
+def add_publish_time(headers=None, **kwargs):
+    # The headers are sent with the message, so this also covers the
+    # tasks of a chain that are published by the workers.
+    if headers is not None:
+        headers['grits_published'] = time.time()
+
+
+@celery.signals.task_prerun.connect
+def record_queue_wait(task=None, **kwargs):
+    if collection is None:
+        return
+    published = (task.request.headers or {}).get('grits_published')
+    if published is None:
+        return
+    delivery_info = task.request.delivery_info or {}
+    queue = delivery_info.get('routing_key') or delivery_info.get('exchange') or 'celery'
+    record(queue_wait_seconds.observe,
+        max(0.0, time.time() - published), queue, task.name)
+
+
+@celery.signals.task_postrun.connect
+def record_task_outcome(task=None, retval=None, state=None, **kwargs):
+    if collection is None:
+        return
+    if state == 'SUCCESS':
+        if isinstance(retval, dict) and retval.get('error') == time_limit_error:
+            outcome = 'soft_time_limit'
+        else:
+            outcome = 'success'
+    elif state == 'FAILURE':
+        if isinstance(retval, SoftTimeLimitExceeded):
+            outcome = 'soft_time_limit'
+        else:
+            outcome = 'failure'
+    else:
+        # Retried tasks are counted when they finish.
+        return
+    record(task_outcomes.inc, task.name, outcome)
+
+
+@celery.signals.task_revoked.connect
+def record_task_revoked(request=None, expired=False, **kwargs):
+    # Tasks that expire while they are waiting in a queue are revoked
+    # without running.
+    if collection is None:
+        return
+    record(task_outcomes.inc,
+        getattr(request, 'name', None) or 'unknown',
+        'expired' if expired else 'revoked')
+
+
+def set_process_ready(hostname, pid, load_seconds):
+    """
+    Record that a worker process has loaded the diagnoser.
+    """
+    if collection is None:
+        return
+    record(collection.replace_one, {
+        '_id': 'diagnoser_process:%s:%s' % (hostname, pid)
+    }, {
+        'name': 'diagnoser_process',
+        'hostname': hostname,
+        'pid': pid,
+        'readyAt': datetime.datetime.utcnow(),
+        'loadSeconds': load_seconds
+    }, True)
+
+
+def remove_ready_processes(hostname, pid=None):
+    """
+    Remove the ready records of a worker process, or of every process
+    on the worker when no pid is given.
+    """
+    if collection is None:
+        return
+    query = { 'name': 'diagnoser_process', 'hostname': hostname }
+    if pid is not None:
+        query['pid'] = pid
+    record(collection.delete_many, query)
+
+
+def ready_processes():
+    """
+    Return the records of the worker processes that have loaded the diagnoser.
+    """
+    if collection is None:
+        return []
+    return list(collection.find({ 'name': 'diagnoser_process' }, { '_id': 0 }))
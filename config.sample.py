@@ -12,3 +12,54 @@ bsve_endpoint = "http://search.bsvecosystem.net"
 
 grits_curator_email = "a@b.c"
 grits_curator_password = "123"
+
+# Diagnosis results are cached by content/url. The backend may be
+# 'lru' (in-process), 'mongo', 'redis', or None to disable caching.
+# See diagnosis_cache.cache_from_config for the available options.
+diagnosis_cache = {
+    'backend': 'lru',
+    'max_size': 1000,
+    'ttl': 60 * 60 * 24
+}
+
+# Successful translations are cached by a hash of the source text and the
+# translation service. The options are the same as for diagnosis_cache.
+translation_cache = {
+    'backend': 'mongo',
+    'url': 'mongodb://localhost:27017',
+    'collection': 'translationCache',
+    'ttl': 60 * 60 * 24 * 30
+}
+
+# When True, the text of the readability summary is used without running
+# Goose when it is mostly long paragraphs with little link text.
+fast_content_extraction = False
+
+# The outcomes and queue wait times of celery tasks are recorded by the
+# workers in this mongo collection and exported by the server's /metrics
+# endpoint. Set to None to disable them.
+celery_metrics = {
+    'url': 'mongodb://localhost:27017',
+    'db': 'grits',
+    'collection': 'celeryMetrics'
+}
+
+# Workers that consume from the priority or diagnose queues load and warm up
+# the diagnoser when they start rather than on their first task.
+# With 'parent' it is loaded once before the pool processes are forked so
+# they share its memory. With 'process' each pool process loads its own.
+# Set to False to load it on the first task.
+# Processes are restarted if loading takes more than diagnoser_load_timeout
+# seconds.
+preload_diagnoser = 'parent'
+diagnoser_load_timeout = 300
+
+# When True, diagnose requests get a 503 response while no worker process
+# has loaded the diagnoser. This requires celery_metrics to be configured.
+require_ready_diagnoser = False
+
+# The serializer for celery task arguments and results. 'json-zlib' and
+# 'msgpack-zlib' are smaller and faster than 'pickle' and compress large
+# payloads like scraped html. Stop the server and all the workers before
+# changing it since they must all use the same serializer.
+celery_serializer = 'json-zlib'
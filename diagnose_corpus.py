@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+"""
+Diagnose a corpus of documents offline with a pool of processes that clean,
+translate and diagnose them the way the celery tasks do. The documents are
+read from an NDJSON file or a mongo collection and a line with the id and
+diagnosis of each document is written to an NDJSON file in the order the
+documents were read.
+
+    python diagnose_corpus.py -input corpus.ndjson -output results.ndjson
+    python diagnose_corpus.py -mongo_url localhost -db girder -collection item \\
+        -content_field private.cleanContent.content -output results.ndjson
+
+Each document should have a content or htmlContent field unless a
+content_field is given. Only a limited number of documents are read ahead
+of the results being written, so memory use doesn't grow with the corpus.
+The number of documents done and the length of the output are saved to the
+checkpoint file periodically, and the corpus is resumed from there when
+the command is run again with the same arguments.
+"""
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+# Set in each pool process by init_process.
+diagnoser = None
+diagnose_args = None
+
+# The arguments the server diagnoses documents with unless told otherwise.
+default_diagnose_args = { 'use_infection_annotator': True }
+
+
+class Checkpoint(object):
+    """
+    The number of documents with results in the output and the length of
+    the output after their results. Results written after the last save
+    are discarded when resuming since their documents will be redone.
+    The corpus is started over if the output is missing or shorter than
+    the checkpoint says.
+    """
+    def __init__(self, path, output_path=None):
+        self.path = path
+        self.documents = 0
+        self.output_bytes = 0
+        if path and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if output_path and (not os.path.exists(output_path) or
+                os.path.getsize(output_path) < saved['outputBytes']):
+                print "The output doesn't have the checkpointed results, starting over"
+                return
+            self.documents = saved['documents']
+            self.output_bytes = saved['outputBytes']
+
+    def save(self, documents, output_bytes):
+        self.documents = documents
+        self.output_bytes = output_bytes
+        if not self.path:
+            return
+        # The checkpoint is replaced atomically so an interrupted save
+        # doesn't leave a partial file.
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({
+                'documents': documents,
+                'outputBytes': output_bytes
+            }, f)
+        os.rename(temp_path, self.path)
+
+
+class Throughput(object):
+    """
+    Prints the documents per second since the last report and overall.
+    """
+    def __init__(self, report_seconds):
+        self.report_seconds = report_seconds
+        self.start = self.last_report = time.time()
+        self.count = self.last_count = 0
+
+    def add(self, count=1):
+        self.count += count
+        now = time.time()
+        if now - self.last_report >= self.report_seconds:
+            self.report(now)
+
+    def report(self, now=None):
+        now = now or time.time()
+        print "%d documents, %.1f docs/sec (%.1f docs/sec overall)" % (
+            self.count,
+            (self.count - self.last_count) / max(now - self.last_report, 1e-9),
+            self.count / max(now - self.start, 1e-9))
+        sys.stdout.flush()
+        self.last_report = now
+        self.last_count = self.count
+
+
+def text_object(document, content_field=None):
+    """
+    Return the part of a document process_text uses. When content_field is
+    given it is a dotted path to the document's text. Text that isn't a
+    string is treated as missing.
+    """
+    def text(value):
+        return value if isinstance(value, basestring) else ''
+    if content_field:
+        value = document
+        for key in content_field.split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+        return { 'content': text(value) }
+    elif 'htmlContent' in document:
+        return { 'htmlContent': text(document['htmlContent']) }
+    else:
+        return { 'content': text(document.get('content')) }
+
+
+def read_ndjson(path, skip=0, content_field=None):
+    """
+    Yield the id and text object of each document in an NDJSON file,
+    or stdin if the path is -, after skipping the given number of documents.
+    Documents without an _id or id are identified by their line number.
+    """
+    f = sys.stdin if path == '-' else open(path)
+    try:
+        idx = 0
+        for line_number, line in enumerate(f):
+            if not line.strip():
+                continue
+            idx += 1
+            if idx <= skip:
+                continue
+            document = json.loads(line)
+            yield (document.get('_id', document.get('id', line_number)),
+                text_object(document, content_field))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def read_mongo(mongo_url, db, collection, query=None, skip=0, content_field=None):
+    """
+    Yield the id and text object of each document matching the query in
+    a mongo collection. The documents are sorted by _id so the same
+    documents are skipped when resuming. Only the _id and the text are
+    converted, so other fields can have any BSON type.
+    """
+    from pymongo import MongoClient
+    from tasks_preprocess import make_json_compat
+    cursor = MongoClient(mongo_url)[db][collection].find(
+        query or {}, no_cursor_timeout=True).sort('_id', 1).skip(skip)
+    try:
+        for document in cursor:
+            try:
+                doc_id = make_json_compat(document['_id'])
+            except TypeError:
+                doc_id = unicode(document['_id'])
+            yield doc_id, text_object(document, content_field)
+    finally:
+        cursor.close()
+
+
+def init_process(model_dir, args):
+    """
+    Runs in each pool process. A diagnoser inherited from the parent only
+    needs new database connections, otherwise one is loaded.
+    The given arguments override the default_diagnose_args.
+    """
+    global diagnoser, diagnose_args
+    diagnose_args = dict(default_diagnose_args, **args)
+    if diagnoser:
+        diagnoser.reopen_database_connections()
+    else:
+        from tasks_diagnose import load_diagnoser
+        diagnoser = load_diagnoser(model_dir)[0]
+
+
+def diagnose_document(item):
+    """
+    Clean, translate and diagnose a document. Errors are returned in the
+    result so one bad document doesn't stop the corpus. The timings of
+    each stage are left out like they are in the server's responses.
+    """
+    import tasks_preprocess
+    from tasks_diagnose import get_clean_english_content
+    doc_id, text_obj = item
+    try:
+        processed = tasks_preprocess.process_text(text_obj)
+        if processed.get('error'):
+            result = { 'error': processed['error'] }
+        elif get_clean_english_content(processed):
+            diagnosis = diagnoser.diagnose(
+                get_clean_english_content(processed), **diagnose_args)
+            diagnosis.pop('timings', None)
+            result = tasks_preprocess.make_json_compat(diagnosis)
+        else:
+            result = { 'error': 'No content available to diagnose.' }
+    except Exception as e:
+        result = { 'error': repr(e) }
+    return { 'id': doc_id, 'diagnosis': result }
+
+
+def bounded_imap(pool, func, items, max_pending):
+    """
+    Like pool.imap, but no more than max_pending items are read ahead of
+    the results being consumed, where imap would read all of them.
+    The results are yielded in the order of the items.
+    """
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def write_results(results, output_path, checkpoint, checkpoint_every=100,
+    throughput=None):
+    """
+    Write each result as a line of the output, resuming from the checkpoint.
+    Returns the total number of documents with results in the output.
+    """
+    if checkpoint.documents and os.path.exists(output_path):
+        output = open(output_path, 'r+b')
+        output.truncate(checkpoint.output_bytes)
+        output.seek(0, os.SEEK_END)
+    else:
+        output = open(output_path, 'wb')
+    documents = checkpoint.documents
+    try:
+        for result in results:
+            output.write(json.dumps(result) + '\n')
+            documents += 1
+            if throughput:
+                throughput.add()
+            if documents % checkpoint_every == 0:
+                output.flush()
+                os.fsync(output.fileno())
+                checkpoint.save(documents, output.tell())
+        output.flush()
+        os.fsync(output.fileno())
+        checkpoint.save(documents, output.tell())
+    finally:
+        output.close()
+    return documents
+
+
+def diagnose_corpus(items, output_path, checkpoint, processes=None,
+    model_dir='current_classifier', diagnose_args=None, preload=True,
+    max_pending=None, checkpoint_every=100, report_seconds=10):
+    """
+    Diagnose the (id, text object) items with a pool of processes and write
+    the results to the output. When preload is True the diagnoser is loaded
+    once before the pool is forked so the processes share its memory.
+    """
+    global diagnoser
+    processes = processes or multiprocessing.cpu_count()
+    if preload and not diagnoser:
+        from tasks_diagnose import load_diagnoser
+        diagnoser = load_diagnoser(model_dir)[0]
+    pool = multiprocessing.Pool(processes, init_process,
+        (model_dir, diagnose_args or {}))
+    throughput = Throughput(report_seconds)
+    try:
+        documents = write_results(
+            bounded_imap(pool, diagnose_document, items,
+                max_pending or processes * 4),
+            output_path, checkpoint, checkpoint_every, throughput)
+    finally:
+        pool.terminate()
+        pool.join()
+    throughput.report()
+    return documents
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Diagnose a corpus of documents.')
+    parser.add_argument('-input', help='An NDJSON file of documents, or - for stdin')
+    parser.add_argument('-mongo_url', help='Read the documents from mongo instead')
+    parser.add_argument('-db', default='girder')
+    parser.add_argument('-collection')
+    parser.add_argument('-query', type=json.loads,
+        help='A JSON mongo query selecting the documents')
+    parser.add_argument('-content_field',
+        help='The dotted path to the text of each document')
+    parser.add_argument('-output', required=True, help='The NDJSON output file')
+    parser.add_argument('-checkpoint',
+        help='Defaults to the output path with a .checkpoint extension')
+    parser.add_argument('-processes', type=int)
+    parser.add_argument('-model_dir', default='current_classifier')
+    parser.add_argument('-no_preload', action='store_true',
+        help='Load the diagnoser in each process instead of before forking')
+    parser.add_argument('-features',
+        help='A comma separated list of the features to include')
+    parser.add_argument('-include_incidents', action='store_true')
+    parser.add_argument('-no_infection_annotator', action='store_true',
+        help='Count cases with the count annotator instead of the infection annotator')
+    parser.add_argument('-max_pending', type=int,
+        help='The number of documents read ahead (default: 4 per process)')
+    parser.add_argument('-checkpoint_every', type=int, default=100)
+    parser.add_argument('-report_seconds', type=float, default=10)
+    args = parser.parse_args()
+    if bool(args.input) == bool(args.mongo_url):
+        parser.error('Either -input or -mongo_url is required')
+    if args.mongo_url and not args.collection:
+        parser.error('-collection is required with -mongo_url')
+    extra_args = {
+        'include_incidents': args.include_incidents,
+        'use_infection_annotator': not args.no_infection_annotator
+    }
+    if args.features:
+        from diagnosis.Diagnoser import required_tiers
+        extra_args['features'] = sorted(set(
+            feature.strip() for feature in args.features.split(',')))
+        try:
+            required_tiers(extra_args['features'])
+        except ValueError as e:
+            parser.error(str(e))
+    checkpoint = Checkpoint(args.checkpoint or args.output + '.checkpoint',
+        args.output)
+    if checkpoint.documents:
+        print "Resuming after %d documents" % checkpoint.documents
+    if args.input:
+        items = read_ndjson(args.input, checkpoint.documents, args.content_field)
+    else:
+        items = read_mongo(args.mongo_url, args.db, args.collection,
+            args.query, checkpoint.documents, args.content_field)
+    documents = diagnose_corpus(items, args.output, checkpoint,
+        processes=args.processes,
+        model_dir=args.model_dir,
+        diagnose_args=extra_args,
+        preload=not args.no_preload,
+        max_pending=args.max_pending,
+        checkpoint_every=args.checkpoint_every,
+        report_seconds=args.report_seconds)
+    print "Wrote the results of %d documents to %s" % (documents, args.output)
@@ -1,10 +1,16 @@
 import argparse
 import pickle
 import numpy as np
+import scipy.sparse
 from KeywordExtractor import *
 from sklearn.feature_extraction import DictVectorizer
 from sklearn.pipeline import Pipeline
 import datetime
+import time
+import contextlib
+import collections
+import sqlite3
+import types
 from epitator.annotator import AnnoDoc
 from epitator.geoname_annotator import GeonameAnnotator
 from epitator.count_annotator import CountAnnotator
@@ -14,18 +20,130 @@ import disease_label_table
 from keyword_annotator import KeywordAnnotator
 from epitator.resolved_keyword_annotator import ResolvedKeywordAnnotator
 from epitator.structured_incident_annotator import StructuredIncidentAnnotator
+from epitator.structured_data_annotator import StructuredDataAnnotator
 from epitator.incident_annotator import IncidentAnnotator
 
 import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def time_sofar_gen(start_time):
+class StageTimer(object):
     """
-    A generator that returns the time elapsed since the passed in start_time.
+    Records the duration in seconds of each stage of a diagnosis.
+    Stages are timed with:
+        with timer.stage('name'):
+            ...
     """
-    while True:
-        yield '[' + str(datetime.datetime.now() - start_time) + ']'
+    def __init__(self):
+        self.start_time = time.time()
+        self.durations = collections.OrderedDict()
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            end = time.time()
+            self.durations[name] = self.durations.get(name, 0) + end - start
+            logger.info('[%.3fs] %s done' % (end - self.start_time, name))
+    def to_dict(self):
+        result = dict(self.durations)
+        result['total'] = time.time() - self.start_time
+        return result
+
+@contextlib.contextmanager
+def null_stage(name):
+    yield
+
+class NullTimer(object):
+    """
+    A StageTimer replacement for when timings aren't recorded.
+    """
+    stage = staticmethod(null_stage)
+
+# The tiers each output feature is created from.
+feature_tiers = {
+    'diseases': [],
+    'keywords': ['keywords'],
+    'dates': ['dates'],
+    'geonames': ['geonames'],
+    # Counts in tables are removed since they are in the structured incidents.
+    'counts': ['counts', 'structured_data'],
+    # Resolved keywords that overlap geonames are removed.
+    'resolvedKeywords': ['resolved_keywords', 'geonames'],
+    'structuredIncidents': ['structured_incidents'],
+    'incidents': ['incidents'],
+}
+
+# The features returned when none are requested.
+default_features = frozenset(feature_tiers.keys()) - set(['incidents'])
+
+# The tiers that must be added to a document before each tier.
+tier_dependencies = {
+    'keywords': [],
+    'resolved_keywords': [],
+    'dates': [],
+    'counts': [],
+    'geonames': [],
+    'structured_data': [],
+    'structured_incidents': ['dates', 'geonames', 'resolved_keywords', 'counts'],
+    'incidents': ['dates', 'geonames', 'resolved_keywords', 'counts', 'structured_incidents'],
+}
+
+# Tiers are added in this order, which satisfies the dependencies above.
+# The structured incident annotator adds the structured_data tier itself,
+# so it is only added separately when structured incidents aren't needed.
+tier_order = [
+    'keywords', 'resolved_keywords', 'dates', 'counts', 'geonames',
+    'structured_incidents', 'structured_data', 'incidents']
+
+# A document that produces spans in every tier.
+warm_up_content = u"""
+As of March 3, 2017 the Ministry of Health of Kenya reported 87 cases of
+cholera, including 2 deaths, in Nairobi. Ten patients were hospitalized
+with severe diarrhea and vomiting. The outbreak of Vibrio cholerae was
+linked to contaminated water from a well used by 300 households.
+
+Location | Cases | Deaths
+Nairobi | 80 | 2
+Mombasa | 7 | 0
+"""
+
+def required_tiers(features):
+    """
+    Return the tiers needed to create the given output features,
+    including the tiers they depend on, in the order they should be added.
+    A ValueError is raised for unknown features.
+    """
+    unknown = set(features) - set(feature_tiers)
+    if unknown:
+        raise ValueError("Unknown features: " + ", ".join(sorted(unknown)))
+    required = set()
+    pending = [tier for feature in features for tier in feature_tiers[feature]]
+    while pending:
+        tier = pending.pop()
+        if tier not in required:
+            required.add(tier)
+            pending.extend(tier_dependencies[tier])
+    return [tier for tier in tier_order if tier in required]
+
+def nonzero_features(X):
+    """
+    Return the column indices and values of the nonzero features in the
+    first row of X. X may be a dense array or a scipy sparse matrix.
+    """
+    if scipy.sparse.issparse(X):
+        row = X[0].tocsr()
+        row.sort_indices()
+        indices, values = row.indices, row.data
+    else:
+        row = np.asarray(X)
+        if row.ndim > 1:
+            row = row[0]
+        indices = np.flatnonzero(row)
+        values = row[indices]
+    mask = values != 0
+    return indices[mask], values[mask].astype(float)
 
 class Diagnoser():
 
@@ -41,8 +159,11 @@ class Diagnoser():
         self.count_annotator = CountAnnotator()
         self.infection_annotator = InfectionAnnotator()
         self.date_annotator = DateAnnotator()
-        self.keyword_annotator = KeywordAnnotator()
+        self.keyword_annotator = KeywordAnnotator(keyword_array=keyword_array)
         self.resolved_keyword_annotator = ResolvedKeywordAnnotator()
+        self.structured_data_annotator = StructuredDataAnnotator()
+        self.structured_incident_annotator = StructuredIncidentAnnotator()
+        self.incident_annotator = IncidentAnnotator()
         processing_pipeline = []
         processing_pipeline.append(('link', LinkedKeywordAdder(keyword_array)))
         processing_pipeline.append(('limit', LimitCounts(1)))
@@ -51,34 +172,73 @@ class Diagnoser():
         self.keywords = dict_vectorizer.get_feature_names()
         self.keyword_extractor = KeywordExtractor(keyword_array)
         self.cutoff_ratio = cutoff_ratio
+        # The label hierarchy is precomputed as a matrix aligned with the
+        # classifier's classes so best_guess can use vectorized operations.
+        self.label_table = disease_label_table.get_label_table()
+        self.ancestor_matrix = self.label_table.get_ancestor_matrix(
+            self.classifier.classes_)
+        # Set by find_database_connections.
+        self._connection_locations = None
+    def class_coefficients(self, i, columns):
+        """
+        Return the classifier coefficients of the given columns for class i.
+        The OneVsRestClassifier coef_ property concatenates the coefficients
+        of every estimator each time it is accessed, so the per class
+        estimator is used when possible.
+        """
+        if hasattr(self.classifier, 'estimators_'):
+            coef = self.classifier.estimators_[i].coef_[0]
+        else:
+            coef = self.classifier.coef_[i]
+        return coef[columns]
     def best_guess(self, X):
-        probs = self.classifier.predict_proba(X)[0]
-        p_max = max(probs)
-        result = {}
-        for i,p in enumerate(probs):
-            cutoff_ratio = self.cutoff_ratio
-            parents = disease_label_table.get_inferred_labels(self.classifier.classes_[i])
-            if p >= p_max * self.cutoff_ratio:
-                result[i] = max(p, result.get(i, 0))
-                for i2, label in enumerate(self.classifier.classes_):
-                    if label in parents:
-                        result[i2] = max(p, probs[i2], result.get(i2, 0))
-        return result.items()
-    def diagnose(
-        self,
-        content,
-        diseases_only=False,
-        content_date=None,
-        use_infection_annotator=False,
-        include_incidents=False):
-        time_sofar = time_sofar_gen(datetime.datetime.now())
-        base_keyword_dict = self.keyword_extractor.transform([content])[0]
-        feature_dict = self.keyword_processor.transform([base_keyword_dict])
-        X = self.dict_vectorizer.transform(feature_dict)[0]
-
-        logger.info(time_sofar.next() + 'Computed feature vector')
+        probs = self.classifier.predict_proba(X)
+        return self.best_guess_batch(probs)[0]
+    def best_guess_batch(self, probs):
+        """
+        Find the likely classes for each row of a class probability matrix.
+        Classes with a probability within the cutoff ratio of the row's
+        maximum are selected along with their ancestor labels.
+        The ancestors are given the max of their own probability
+        and the probabilities of their selected descendants.
+        Returns a list of (class index, probability) lists.
+        """
+        probs = np.atleast_2d(probs)
+        passing = probs >= probs.max(axis=1)[:, np.newaxis] * self.cutoff_ratio
+        selected = passing | (passing.dot(self.ancestor_matrix) > 0)
+        results = []
+        for row_probs, row_passing, row_selected in zip(probs, passing, selected):
+            values = row_probs.copy()
+            passing_indices = np.flatnonzero(row_passing)
+            if len(passing_indices) > 0:
+                propagated = (
+                    self.ancestor_matrix[passing_indices] *
+                    row_probs[passing_indices][:, np.newaxis]).max(axis=0)
+                values = np.maximum(values, propagated)
+            results.append([
+                (i, values[i]) for i in np.flatnonzero(row_selected)])
+        return results
+    def vectorize(self, contents, timer=NullTimer()):
+        """
+        Extract keywords from the given documents and return the base keyword
+        dicts along with a feature matrix that has a row for each document.
+        """
+        with timer.stage('keyword_extraction'):
+            base_keyword_dicts = self.keyword_extractor.transform(contents)
+        with timer.stage('vectorization'):
+            feature_dicts = self.keyword_processor.transform(base_keyword_dicts)
+            X = self.dict_vectorizer.transform(feature_dicts)
+        return base_keyword_dicts, X
+    def diagnose_diseases(self, base_keyword_dict, X, guesses):
+        """
+        Create the disease diagnoses for a document from its feature vector
+        row X and the (class index, probability) pairs from best_guess.
+        """
+        # Keyword scores are only computed for the nonzero features,
+        # so the vectorizer can produce either dense or sparse (CSR) rows.
+        feature_indices, feature_values = nonzero_features(X)
         def diagnosis(i, p):
-            scores = self.classifier.coef_[i] * X
+            scores = self.class_coefficients(i, feature_indices) * feature_values
             # Scores are normalized so they can be compared across different
             # classifications.
             norm = np.linalg.norm(scores)
@@ -88,11 +248,9 @@ class Diagnoser():
             # These might be numpy types. I coerce them to native python
             # types so we can easily serialize the output as json.
 
-            scored_keywords = zip(self.keywords, scores)
-            keyword_scores = {}
-            for keyword, score in scored_keywords:
-                if score > 0 and keyword in base_keyword_dict:
-                    keyword_scores[keyword] = float(score)
+            scored_keywords = [
+                (self.keywords[c], score)
+                for c, score in zip(feature_indices, scores)]
 
             return {
                 'name': unicode(self.classifier.classes_[i]),
@@ -110,45 +268,246 @@ class Diagnoser():
                     for kwd, score in scored_keywords
                     if score > 0 and kwd not in base_keyword_dict]
             }
-        diseases = [diagnosis(i,p) for i,p in self.best_guess(X)]
+        return [diagnosis(i,p) for i,p in guesses]
+    def selected_features(
+        self,
+        features=None,
+        diseases_only=False,
+        include_incidents=False):
+        """
+        Return the set of output features for the diagnose arguments.
+        The diseases are always included.
+        """
         if diseases_only:
+            return frozenset(['diseases'])
+        if features is None:
+            features = default_features
+        features = set(features) | set(['diseases'])
+        if include_incidents:
+            features.add('incidents')
+        # Unknown features are rejected before any work is done.
+        required_tiers(features)
+        return frozenset(features)
+    def diagnose_batch(
+        self,
+        contents,
+        diseases_only=False,
+        include_incidents=False,
+        features=None,
+        **kwargs):
+        """
+        Diagnose several documents at once. Keyword extraction, vectorization
+        and classification are done for the whole batch with a single
+        feature matrix. The remaining annotation is done per document.
+        Results are yielded in the same order as the contents so callers can
+        keep the completed results if they run out of time.
+        """
+        features = self.selected_features(
+            features, diseases_only, include_incidents)
+        if len(contents) == 0:
+            return
+        base_keyword_dicts, X = self.vectorize(contents)
+        guesses = self.best_guess_batch(self.classifier.predict_proba(X))
+        for idx, content in enumerate(contents):
+            diseases = self.diagnose_diseases(
+                base_keyword_dicts[idx], X[idx], guesses[idx])
+            if features == set(['diseases']):
+                yield {
+                    'diseases': diseases
+                }
+            else:
+                yield self.annotate(
+                    content, diseases, features=features, **kwargs)
+    def diagnose(
+        self,
+        content,
+        diseases_only=False,
+        content_date=None,
+        use_infection_annotator=False,
+        include_incidents=False,
+        features=None):
+        """
+        features is a list of the output features to create, e.g.
+        ['geonames', 'dates']. Only the tiers those features need are
+        annotated. The keys of feature_tiers are the available features.
+
+        The result includes a timings dict with the duration in seconds of
+        each stage of the diagnosis.
+        """
+        features = self.selected_features(
+            features, diseases_only, include_incidents)
+        timer = StageTimer()
+        base_keyword_dicts, X = self.vectorize([content], timer)
+        with timer.stage('classification'):
+            guesses = self.best_guess(X)
+            diseases = self.diagnose_diseases(base_keyword_dicts[0], X, guesses)
+        if features == set(['diseases']):
             return {
-                'diseases': diseases
+                'diseases': diseases,
+                'timings': timer.to_dict()
             }
-        logger.info(time_sofar.next() + 'Diagnosed diseases')
-
+        result = self.annotate(
+            content,
+            diseases,
+            content_date=content_date,
+            use_infection_annotator=use_infection_annotator,
+            features=features,
+            timer=timer)
+        result['timings'] = timer.to_dict()
+        return result
+    def warm_up(self):
+        """
+        Diagnose a short document with every tier so the annotators load
+        their models and resources before the first real request.
+        Both count annotators are used. Returns the timings of each run.
+        """
+        timings = []
+        for use_infection_annotator in [False, True]:
+            timings.append(self.diagnose(
+                warm_up_content,
+                use_infection_annotator=use_infection_annotator,
+                include_incidents=True)['timings'])
+        return timings
+    def find_database_connections(self):
+        """
+        Record where the annotators hold sqlite connections so
+        reopen_database_connections can replace them without searching.
+        The annotators are searched recursively, through their attributes,
+        lists and dicts, so connections held by nested annotators are found
+        too. This is called before forking, after the diagnoser is warmed
+        up and the annotators have opened their connections, because
+        searching the diagnoser in every forked process would touch, and so
+        copy, all of the memory it shares with the parent.
+        Returns the (container, key, is_attribute) locations.
+        """
+        locations = []
+        visited = set()
+        pending = [self]
+        while pending:
+            obj = pending.pop()
+            if id(obj) in visited:
+                continue
+            visited.add(id(obj))
+            if isinstance(obj, dict):
+                items = obj.items()
+            elif isinstance(obj, list):
+                items = enumerate(obj)
+            else:
+                items = vars(obj).items()
+            is_attribute = not isinstance(obj, (dict, list))
+            for key, value in items:
+                if isinstance(value, sqlite3.Connection):
+                    locations.append((obj, key, is_attribute))
+                elif isinstance(value, (dict, list)) or (
+                    hasattr(value, '__dict__') and
+                    not isinstance(value, (type, types.ModuleType,
+                        types.FunctionType, types.MethodType))):
+                    pending.append(value)
+        self._connection_locations = locations
+        return locations
+    def reopen_database_connections(self):
+        """
+        Replace the sqlite connections held by the annotators with new
+        connections to the same databases. SQLite connections must not be
+        used in both processes after a fork, so this is called in worker
+        processes that inherit a Diagnoser created before they were forked.
+        Only the locations recorded by find_database_connections are
+        replaced. They are found here if they weren't recorded before
+        forking. The new connections are returned.
+        """
+        if getattr(self, '_connection_locations', None) is None:
+            self.find_database_connections()
+        reopened = {}
+        for obj, key, is_attribute in self._connection_locations:
+            connection = getattr(obj, key) if is_attribute else obj[key]
+            if not isinstance(connection, sqlite3.Connection):
+                continue
+            if id(connection) not in reopened:
+                path = [row[2] for row in connection.execute('PRAGMA database_list')
+                        if row[1] == 'main'][0]
+                reopened[id(connection)] = sqlite3.connect(path)
+                reopened[id(connection)].row_factory = connection.row_factory
+            if is_attribute:
+                setattr(obj, key, reopened[id(connection)])
+            else:
+                obj[key] = reopened[id(connection)]
+        return reopened.values()
+    def add_tier(self, anno_doc, tier_name, use_infection_annotator=False):
+        if tier_name == 'keywords':
+            anno_doc.add_tier(self.keyword_annotator)
+        elif tier_name == 'resolved_keywords':
+            anno_doc.add_tier(self.resolved_keyword_annotator)
+        elif tier_name == 'dates':
+            anno_doc.add_tier(self.date_annotator)
+        elif tier_name == 'counts':
+            if use_infection_annotator:
+                anno_doc.add_tier(self.infection_annotator)
+                anno_doc.tiers['counts'] = anno_doc.tiers.pop('infections')
+                attribute_remappings = {
+                    'infection': 'case'
+                }
+                for span in anno_doc.tiers['counts']:
+                    span.metadata['attributes'] = [
+                        attribute_remappings.get(attribute, attribute)
+                        for attribute in span.metadata['attributes']]
+            else:
+                anno_doc.add_tier(self.count_annotator)
+        elif tier_name == 'geonames':
+            anno_doc.add_tier(self.geoname_annotator)
+        elif tier_name == 'structured_incidents':
+            anno_doc.add_tier(self.structured_incident_annotator)
+        elif tier_name == 'structured_data':
+            if 'structured_data' not in anno_doc.tiers:
+                anno_doc.add_tier(self.structured_data_annotator)
+        elif tier_name == 'incidents':
+            anno_doc.add_tier(self.incident_annotator)
+    def annotate(
+        self,
+        content,
+        diseases,
+        content_date=None,
+        use_infection_annotator=False,
+        include_incidents=False,
+        features=None,
+        timer=NullTimer()):
+        """
+        Run the EpiTator annotators the requested features need over the
+        content and combine their output with the disease diagnoses into
+        the diagnosis result.
+        """
+        features = self.selected_features(
+            features, include_incidents=include_incidents)
         anno_doc = AnnoDoc(content, date=content_date)
-        anno_doc.add_tier(self.keyword_annotator)
-        logger.info('keywords annotated')
-        anno_doc.add_tier(self.resolved_keyword_annotator)
-        logger.info('resolved keywords annotated')
-        anno_doc.add_tier(self.date_annotator)
-        logger.info('dates annotated')
-        if use_infection_annotator:
-            anno_doc.add_tier(self.infection_annotator)
-            anno_doc.tiers['counts'] = anno_doc.tiers.pop('infections')
-            attribute_remappings = {
-                'infection': 'case'
-            }
-            for span in anno_doc.tiers['counts']:
-                span.metadata['attributes'] = [
-                    attribute_remappings.get(attribute, attribute)
-                    for attribute in span.metadata['attributes']]
-        else:
-            anno_doc.add_tier(self.count_annotator)
-        logger.info('counts annotated')
-        anno_doc.add_tier(self.geoname_annotator)
-        logger.info('geonames annotated')
-        anno_doc.add_tier(StructuredIncidentAnnotator())
-        logger.info('structured incidents annotated')
-        anno_doc.filter_overlapping_spans(
-            tier_names=[ 'dates', 'geonames', 'diseases', 'hosts', 'modes',
-                         'pathogens', 'symptoms' ]
-        )
-        logger.info('filtering overlapping spans done')
-
+        tiers = required_tiers(features)
+        # Incidents are annotated after the spans of the other tiers are
+        # filtered, as they were before tiers could be selected.
+        for tier_name in tiers:
+            if tier_name != 'incidents':
+                with timer.stage('tier.' + tier_name):
+                    self.add_tier(anno_doc, tier_name, use_infection_annotator)
+        filtered_tiers = [tier_name for tier_name in [
+            'dates', 'geonames', 'diseases', 'hosts', 'modes',
+            'pathogens', 'symptoms'] if tier_name in anno_doc.tiers]
+        # EpiTator filters every tier when tier_names is empty, which
+        # would change the spans of the other tiers.
+        if filtered_tiers:
+            with timer.stage('span_filtering'):
+                anno_doc.filter_overlapping_spans(tier_names=filtered_tiers)
+        with timer.stage('output_assembly'):
+            result = self.assemble_result(anno_doc, diseases, features)
+        if 'incidents' in tiers:
+            with timer.stage('tier.incidents'):
+                self.add_tier(anno_doc, 'incidents')
+            with timer.stage('output_assembly'):
+                result['incidents'] = self.assemble_incidents(anno_doc)
+        return result
+    def assemble_result(self, anno_doc, diseases, features=default_features):
+        """
+        Create the diagnosis result from the annotated document.
+        Only the given features are included.
+        """
         dates = []
-        for span in anno_doc.tiers['dates']:
+        for span in anno_doc.tiers['dates'] if 'dates' in features else []:
             range_start, range_end = span.datetime_range
             dates.append({
                 'type': 'datetime',
@@ -175,7 +534,7 @@ class Diagnoser():
             })
 
         geonames_grouped = {}
-        for span in anno_doc.tiers['geonames']:
+        for span in anno_doc.tiers['geonames'] if 'geonames' in features else []:
             if not span.geoname['geonameid'] in geonames_grouped:
                 geonames_grouped[span.geoname['geonameid']] = {
                     'type': 'location',
@@ -191,10 +550,14 @@ class Diagnoser():
                 ]['textOffsets'].append(
                     [span.start, span.end]
                 )
-        logger.info(time_sofar.next() + 'Annotated geonames')
 
         counts = []
-        for span in anno_doc.tiers['counts'].without_overlaps(anno_doc.tiers['structured_data']):
+        if 'counts' in features:
+            count_spans = anno_doc.tiers['counts'].without_overlaps(
+                anno_doc.tiers['structured_data'])
+        else:
+            count_spans = []
+        for span in count_spans:
             count_dict = dict(span.metadata)
             count_dict['type'] = 'count'
             count_dict['text'] = span.text
@@ -216,6 +579,8 @@ class Diagnoser():
         keyword_groups = {}
         for keyword_type in keyword_types:
             keyword_groups[keyword_type] = {}
+            if 'keywords' not in features:
+                continue
             for span in anno_doc.tiers['keyword.' + keyword_type]:
                 if span.label not in keyword_groups[keyword_type]:
                     keyword_groups[keyword_type][span.label] = {
@@ -228,7 +593,12 @@ class Diagnoser():
                         [span.start, span.end]
                     )
         resolved_keywords = []
-        for span in anno_doc.tiers['resolved_keywords'].without_overlaps(anno_doc.tiers['geonames']):
+        if 'resolvedKeywords' in features:
+            resolved_keyword_spans = anno_doc.tiers['resolved_keywords']\
+                .without_overlaps(anno_doc.tiers['geonames'])
+        else:
+            resolved_keyword_spans = []
+        for span in resolved_keyword_spans:
             resolved_keywords.append({
                 'type': 'resolvedKeyword',
                 'resolutions': span.metadata['resolutions'],
@@ -238,9 +608,6 @@ class Diagnoser():
             'diagnoserVersion': self.__version__,
             'dateOfDiagnosis': datetime.datetime.now(),
             'diseases': diseases,
-            'structuredIncidents': [
-                dict(span.metadata, textOffsets=[[span.start, span.end]])
-                for span in anno_doc.tiers['structured_incidents']],
             'features': counts +\
                         geonames_grouped.values() +\
                         dates +\
@@ -250,43 +617,50 @@ class Diagnoser():
                         keyword_groups['pathogens'].values() +\
                         keyword_groups['symptoms'].values() +\
                         resolved_keywords}
-        if include_incidents:
-            result['incidents'] = []
-            anno_doc.add_tier(IncidentAnnotator())
-            for incident_span in anno_doc.tiers['incidents']:
-                metadata = incident_span.metadata
-                incident_data = {
-                    'offsets': [span.start, span.end],
-                    'type': metadata['type'],
-                    'value': metadata['value'],
-                    'dateRange': [d.isoformat().split('T')[0] for d in metadata['dateRange']],
-                    'locations': metadata['locations'],
-                    'species': metadata['species'],
-                    'status': metadata.get('status'),
-                    'resolvedDisease': metadata.get('resolvedDisease'),
-                    'annotations': {
-                        'case': [{ 'offsets': [incident_span.start, incident_span.end] }]
-                    }
-                }
-                if 'count_annotation' in metadata:
-                    count_annotation = metadata['count_annotation']
-                    incident_data['annotations'] = {
-                        'case': [{ 'offsets': [count_annotation.start, count_annotation.end] }],
-                        'date': [
-                            { 'offsets': [anno.start, anno.end] }
-                            for anno in metadata['date_territory'].metadata
-                        ],
-                        'location': [
-                            { 'offsets': [anno.start, anno.end] }
-                            for anno in metadata['geoname_territory'].metadata
-                        ],
-                        'disease': [
-                            { 'offsets': [anno.start, anno.end] }
-                            for anno in metadata['disease_territory'].metadata
-                        ]
-                    }
-                result['incidents'].append(incident_data)
+        if 'structuredIncidents' in features:
+            result['structuredIncidents'] = [
+                dict(span.metadata, textOffsets=[[span.start, span.end]])
+                for span in anno_doc.tiers['structured_incidents']]
         return result
+    def assemble_incidents(self, anno_doc):
+        """
+        Create the incidents output from the document's incidents tier.
+        """
+        incidents = []
+        for incident_span in anno_doc.tiers['incidents']:
+            metadata = incident_span.metadata
+            incident_data = {
+                'offsets': [incident_span.start, incident_span.end],
+                'type': metadata['type'],
+                'value': metadata['value'],
+                'dateRange': [d.isoformat().split('T')[0] for d in metadata['dateRange']],
+                'locations': metadata['locations'],
+                'species': metadata['species'],
+                'status': metadata.get('status'),
+                'resolvedDisease': metadata.get('resolvedDisease'),
+                'annotations': {
+                    'case': [{ 'offsets': [incident_span.start, incident_span.end] }]
+                }
+            }
+            if 'count_annotation' in metadata:
+                count_annotation = metadata['count_annotation']
+                incident_data['annotations'] = {
+                    'case': [{ 'offsets': [count_annotation.start, count_annotation.end] }],
+                    'date': [
+                        { 'offsets': [anno.start, anno.end] }
+                        for anno in metadata['date_territory'].metadata
+                    ],
+                    'location': [
+                        { 'offsets': [anno.start, anno.end] }
+                        for anno in metadata['geoname_territory'].metadata
+                    ],
+                    'disease': [
+                        { 'offsets': [anno.start, anno.end] }
+                        for anno in metadata['disease_territory'].metadata
+                    ]
+                }
+            incidents.append(incident_data)
+        return incidents
 
 if __name__ == '__main__':
     import Diagnoser
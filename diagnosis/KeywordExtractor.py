@@ -8,9 +8,45 @@ class LowerKeyDict(dict):
     def __getitem__(self, key):
         return self.store[key.lower()]
 
+class TokenTrie():
+    """
+    A trie over token sequences. It is built once from a keyword vocabulary
+    so documents can be scanned for every keyword in a single pass over
+    their tokens, rather than generating and looking up every n-gram.
+    """
+    def __init__(self, keywords, max_length):
+        self.max_length = max_length
+        self.root = {}
+        for keyword in keywords:
+            tokens = keyword.split(' ')
+            # Keywords with more tokens than the max n-gram length could
+            # never be matched by the CountVectorizer this replaces.
+            if len(tokens) > max_length:
+                continue
+            node = self.root
+            for token in tokens:
+                node = node.setdefault(token, {})
+            # None is used as the terminal key since it can't be a token.
+            node[None] = keyword
+    def count_matches(self, tokens):
+        counts = {}
+        root = self.root
+        num_tokens = len(tokens)
+        for start in xrange(num_tokens):
+            node = root
+            for idx in xrange(start, min(start + self.max_length, num_tokens)):
+                node = node.get(tokens[idx])
+                if node is None:
+                    break
+                keyword = node.get(None)
+                if keyword is not None:
+                    counts[keyword] = counts.get(keyword, 0) + 1
+        return counts
+
 class KeywordExtractor():
     def __init__(self, keyword_array):
-        # The CountVectorizer will pick up overlapping keywords, so for example
+        # Like the CountVectorizer this replaced, the matcher will pick up
+        # overlapping keywords, so for example
         # we will pickup "Foot and Mouth", "Hand, Foot and Mouth"
         # If we had a way to rule out matches like this we might see better perf.
         
@@ -19,11 +55,11 @@ class KeywordExtractor():
         # The http pattern is used to tokenize URLs.
         # It might be better to remove them during preprocessing.
         token_pattern = r'(?u)\b(?:(?:http\S+)|\w+)\b'
-        case_sensitive_analyser = CountVectorizer(
+        self.case_sensitive_analyser = CountVectorizer(
             token_pattern=token_pattern,
             lowercase=False
         ).build_analyzer()
-        case_insensitive_analyser = CountVectorizer(
+        self.case_insensitive_analyser = CountVectorizer(
             token_pattern=token_pattern,
         ).build_analyzer()
         case_sensitive = set()
@@ -31,45 +67,25 @@ class KeywordExtractor():
         for kw_obj in keyword_array:
             keyword = kw_obj['keyword']
             if kw_obj['case_sensitive']:
-                case_sensitive.add(' '.join(case_sensitive_analyser(keyword)))
+                case_sensitive.add(' '.join(self.case_sensitive_analyser(keyword)))
             else:
-                not_case_sensitive.add(' '.join(case_insensitive_analyser(keyword)))
-        self.case_sensitive_vectorizer = CountVectorizer(
-            vocabulary=case_sensitive,
-            ngram_range=(1, 1),
-            token_pattern=token_pattern,
-            lowercase=False
-        )
-        self.case_insensitive_vectorizer = CountVectorizer(
-            vocabulary=not_case_sensitive,
-            token_pattern=token_pattern,
-            ngram_range=(1, 5)
-        )
+                not_case_sensitive.add(' '.join(self.case_insensitive_analyser(keyword)))
+        # The vocabularies are compiled into tries once so no per-document
+        # vocabulary work is needed.
+        # Only single token case sensitive keywords are matched.
+        self.case_sensitive_matcher = TokenTrie(case_sensitive, 1)
+        self.case_insensitive_matcher = TokenTrie(not_case_sensitive, 5)
 
     def fit(self, X, y):
         pass
-    def transform_with_vectorizer(self, vectorizer, texts):
-        mat = vectorizer.fit_transform(texts)
-        vocab = vectorizer.get_feature_names()
-        out_dicts = []
-        for r in range(mat.shape[0]):
-            out_dict = {}
-            for c in mat[r].nonzero()[1]:
-                out_dict[vocab[c]] = mat[r,c]
-            out_dicts.append(out_dict)
-        return out_dicts
+    def transform_one(self, text):
+        out_dict = self.case_insensitive_matcher.count_matches(
+            self.case_insensitive_analyser(text))
+        out_dict.update(self.case_sensitive_matcher.count_matches(
+            self.case_sensitive_analyser(text)))
+        return out_dict
     def transform(self, texts):
-        out_dicts = self.transform_with_vectorizer(
-            self.case_insensitive_vectorizer,
-            texts
-        )
-        out_dict_updates = self.transform_with_vectorizer(
-            self.case_sensitive_vectorizer,
-            texts
-        )
-        for d, upd in zip(out_dicts, out_dict_updates):
-            d.update(upd)
-        return out_dicts
+        return map(self.transform_one, texts)
 
 class LinkedKeywordAdder():
     def __init__(self, keyword_array, weight=1):
@@ -0,0 +1,339 @@
+"""
+A single file format for everything the diagnoser needs from training:
+the classifier, the dict vectorizer and the keywords.
+
+The file starts with a JSON header followed by the raw data of NumPy
+arrays, each aligned to 64 bytes so it can be memory mapped. The header has
+the format version, the metadata needed to rebuild the dict vectorizer and
+classifier, the keywords and the dtype, shape and offset of each array.
+When the arrays are memory mapped, the worker processes loading the same
+bundle share their pages through the OS page cache.
+
+Arrays:
+    coef_by_feature: The classifier coefficients with a row for each
+        feature, so classifying a sparse document only reads the rows of
+        the features it has.
+    intercept: The classifier intercepts
+    vocabulary.data/vocabulary.offsets: The vectorizer's feature names as
+        utf-8 strings concatenated into a single byte array, and the offset
+        where each string ends.
+
+Convert the pickles in a directory into a bundle with:
+
+    python -m diagnosis.model_bundle current_classifier
+
+The header also records the size, modification time and sha1 of the
+pickles the bundle was made from. A bundle is only loaded in place of the
+pickles next to it when they are the ones it was made from, so a bundle
+left behind when new pickles are downloaded isn't used.
+"""
+import collections
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import struct
+import numpy as np
+import scipy.sparse
+from sklearn.feature_extraction import DictVectorizer
+
+FORMAT_VERSION = 1
+MAGIC = 'GRITSMDL'
+ALIGNMENT = 64
+bundle_name = 'model.bundle'
+pickle_names = ['classifier.p', 'dict_vectorizer.p', 'keyword_array.p']
+
+
+class BundleClassifier(object):
+    """
+    A replacement for the trained OneVsRestClassifier of LogisticRegression
+    estimators that predicts from the coefficient and intercept arrays.
+    """
+    def __init__(self, coef_by_feature, intercept, classes, multilabel):
+        self.coef_by_feature = coef_by_feature
+        self.intercept_ = intercept
+        self.classes_ = classes
+        self.multilabel_ = multilabel
+
+    @property
+    def coef_(self):
+        # A view with a row for each class like the sklearn classifiers have.
+        return self.coef_by_feature.T
+
+    def decision_function(self, X):
+        if scipy.sparse.issparse(X):
+            scores = np.asarray(X.dot(self.coef_by_feature))
+        else:
+            scores = np.dot(X, self.coef_by_feature)
+        return scores + self.intercept_
+
+    def predict_proba(self, X):
+        # The logistic function is computed in place as LogisticRegression does.
+        Y = self.decision_function(X)
+        Y *= -1
+        np.exp(Y, Y)
+        Y += 1
+        np.reciprocal(Y, Y)
+        if len(self.classes_) == 1:
+            Y = np.concatenate(((1 - Y), Y), axis=1)
+        if not self.multilabel_:
+            # The probabilities of single label classifications sum to 1.
+            Y /= np.sum(Y, axis=1)[:, np.newaxis]
+        return Y
+
+
+def classifier_arrays(classifier):
+    """
+    Return the coefficient and intercept arrays of a OneVsRestClassifier.
+    Estimators for labels that are always or never present predict a
+    constant, which is represented with an infinite intercept.
+    """
+    coef = []
+    intercept = []
+    num_features = None
+    for estimator in classifier.estimators_:
+        if hasattr(estimator, 'coef_'):
+            coef.append(np.ravel(estimator.coef_))
+            intercept.append(np.ravel(estimator.intercept_)[0])
+            num_features = len(coef[-1])
+        else:
+            coef.append(None)
+            intercept.append(np.inf if np.ravel(estimator.y_)[0] else -np.inf)
+    coef = np.vstack([
+        np.zeros(num_features) if row is None else row for row in coef])
+    return coef.astype(np.float64), np.array(intercept, dtype=np.float64)
+
+
+def string_table(strings):
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.cumsum([len(s) for s in encoded], dtype=np.int64)
+    return np.frombuffer(''.join(encoded), dtype=np.uint8), offsets
+
+
+def read_string_table(data, offsets):
+    data = data.tostring()
+    starts = [0] + list(offsets[:-1])
+    return [data[start:end].decode('utf-8') for start, end in zip(starts, offsets)]
+
+
+def file_sha1(path):
+    data_hash = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), ''):
+            data_hash.update(block)
+    return data_hash.hexdigest()
+
+
+def pickle_signatures(pickle_dir):
+    """
+    Return the size, modification time and sha1 of each pickle in pickle_dir.
+    """
+    signatures = {}
+    for name in pickle_names:
+        path = os.path.join(pickle_dir, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signatures[name] = {
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'sha1': file_sha1(path)
+            }
+    return signatures
+
+
+def write_bundle(path, classifier, dict_vectorizer, keyword_array,
+    pickle_dir=None):
+    """
+    Write a model bundle to path. Only the keyword, case_sensitive, category
+    and linked_keywords fields of the keywords are kept since they are the
+    only ones used for inference. The sha1 of the array data is used as the
+    model version. When the model was loaded from or saved to pickles, their
+    directory should be given so the bundle records which pickles it matches.
+    """
+    coef, intercept = classifier_arrays(classifier)
+    vocabulary_data, vocabulary_offsets = string_table(
+        dict_vectorizer.feature_names_)
+    arrays = collections.OrderedDict([
+        ('coef_by_feature', coef.T),
+        ('intercept', intercept),
+        ('vocabulary.data', vocabulary_data),
+        ('vocabulary.offsets', vocabulary_offsets)
+    ])
+    categories = sorted(set(kw['category'] for kw in keyword_array))
+    category_indices = { category: idx for idx, category in enumerate(categories) }
+    data_hash = hashlib.sha1()
+    array_info = collections.OrderedDict()
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        array_info[name] = {
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'offset': offset
+        }
+        data_hash.update(array.tostring())
+        offset += array.nbytes
+        offset += -offset % ALIGNMENT
+    header = {
+        'formatVersion': FORMAT_VERSION,
+        'modelVersion': data_hash.hexdigest(),
+        'created': datetime.datetime.utcnow().isoformat(),
+        'classes': [unicode(c) for c in classifier.classes_],
+        'multilabel': bool(getattr(classifier, 'multilabel_', False)),
+        'vectorizer': {
+            'dtype': np.dtype(dict_vectorizer.dtype).str,
+            'separator': dict_vectorizer.separator,
+            'sparse': dict_vectorizer.sparse,
+            'sort': dict_vectorizer.sort
+        },
+        'categories': categories,
+        # Each keyword is a row of its keyword, case_sensitive,
+        # category index and linked_keywords fields.
+        'keywords': [[
+            kw['keyword'],
+            kw['case_sensitive'],
+            category_indices[kw['category']],
+            list(kw.get('linked_keywords', []))
+        ] for kw in keyword_array],
+        'arrays': array_info,
+        'pickles': pickle_signatures(pickle_dir) if pickle_dir else {}
+    }
+    header_bytes = json.dumps(header)
+    prefix_length = len(MAGIC) + 4 + 8
+    padding = -(prefix_length + len(header_bytes)) % ALIGNMENT
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<IQ', FORMAT_VERSION, len(header_bytes) + padding))
+        f.write(header_bytes + ' ' * padding)
+        for name, array in arrays.items():
+            f.write(array.tostring())
+            f.write('\0' * (-array.nbytes % ALIGNMENT))
+    return header['modelVersion']
+
+
+ModelBundle = collections.namedtuple('ModelBundle', [
+    'classifier', 'dict_vectorizer', 'keyword_array', 'header'])
+
+
+def read_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a model bundle")
+    format_version, header_length = struct.unpack('<IQ', f.read(12))
+    if format_version != FORMAT_VERSION:
+        raise ValueError("Unsupported model bundle format version: %s" % format_version)
+    header = json.loads(f.read(header_length))
+    return header, len(MAGIC) + 12 + header_length
+
+
+def bundle_is_current(path, pickle_dir):
+    """
+    Return whether the bundle at path was made from the pickles in
+    pickle_dir, or there are no pickles there. Pickles with the recorded size
+    and modification time are assumed to match, otherwise their sha1 is
+    compared, so copies of the same pickles still match.
+    """
+    with open(path, 'rb') as f:
+        header = read_header(f)[0]
+    recorded = header.get('pickles', {})
+    for name in pickle_names:
+        pickle_path = os.path.join(pickle_dir, name)
+        if not os.path.exists(pickle_path):
+            continue
+        if name not in recorded:
+            return False
+        stat = os.stat(pickle_path)
+        if stat.st_size != recorded[name]['size']:
+            return False
+        if (stat.st_mtime != recorded[name]['mtime'] and
+            file_sha1(pickle_path) != recorded[name]['sha1']):
+            return False
+    return True
+
+
+def find_bundle(model_dir):
+    """
+    Return the path of the bundle in model_dir if it should be loaded in
+    place of the pickles, or None if it is missing or stale.
+    """
+    path = os.path.join(model_dir, bundle_name)
+    if os.path.exists(path) and bundle_is_current(path, model_dir):
+        return path
+    return None
+
+
+def load_bundle(path, mmap=True):
+    """
+    Load a model bundle. When mmap is True the arrays are memory mapped
+    read-only, otherwise they are read into memory.
+    """
+    with open(path, 'rb') as f:
+        header, data_offset = read_header(f)
+    arrays = {}
+    for name, info in header['arrays'].items():
+        shape = tuple(info['shape'])
+        if np.prod(shape) == 0:
+            arrays[name] = np.zeros(shape, dtype=info['dtype'])
+            continue
+        array = np.memmap(path, dtype=info['dtype'], mode='r',
+            offset=data_offset + info['offset'], shape=shape)
+        arrays[name] = array if mmap else np.array(array)
+    feature_names = read_string_table(
+        arrays['vocabulary.data'], arrays['vocabulary.offsets'])
+    vectorizer_info = header['vectorizer']
+    dict_vectorizer = DictVectorizer(
+        dtype=np.dtype(str(vectorizer_info['dtype'])).type,
+        separator=vectorizer_info['separator'],
+        sparse=vectorizer_info['sparse'],
+        sort=vectorizer_info['sort'])
+    dict_vectorizer.feature_names_ = feature_names
+    dict_vectorizer.vocabulary_ = {
+        name: idx for idx, name in enumerate(feature_names) }
+    classifier = BundleClassifier(
+        arrays['coef_by_feature'],
+        arrays['intercept'],
+        np.array(header['classes'], dtype=object),
+        header['multilabel'])
+    categories = header['categories']
+    keyword_array = [{
+        'keyword': keyword,
+        'case_sensitive': case_sensitive,
+        'category': categories[category_idx],
+        'linked_keywords': linked_keywords
+    } for keyword, case_sensitive, category_idx, linked_keywords in header['keywords']]
+    return ModelBundle(classifier, dict_vectorizer, keyword_array, header)
+
+
+def load_pickles(pickle_dir):
+    artifacts = []
+    for name in pickle_names:
+        with open(os.path.join(pickle_dir, name), 'rb') as f:
+            artifacts.append(pickle.load(f))
+    return artifacts
+
+
+def load_model(model_dir, mmap=True):
+    """
+    Return the classifier, dict vectorizer and keyword array from the
+    bundle in model_dir, or from the pickles if there is no bundle or it
+    was made from other pickles.
+    """
+    path = find_bundle(model_dir)
+    if path:
+        bundle = load_bundle(path, mmap=mmap)
+        return bundle.classifier, bundle.dict_vectorizer, bundle.keyword_array
+    return tuple(load_pickles(model_dir))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Convert the classifier pickles in a directory into a model bundle.')
+    parser.add_argument('model_dir')
+    args = parser.parse_args()
+    classifier, dict_vectorizer, keyword_array = load_pickles(args.model_dir)
+    path = os.path.join(args.model_dir, bundle_name)
+    print "Wrote", path, "model version", write_bundle(
+        path, classifier, dict_vectorizer, keyword_array,
+        pickle_dir=args.model_dir)
@@ -0,0 +1,211 @@
+"""
+A cache for diagnosis results so documents that are resubmitted don't need
+to be scraped, cleaned, translated and annotated again.
+
+Results are keyed by a hash of the (cleaned) content or url, the arguments
+that change the diagnosis output and the Diagnoser/EpiTator versions,
+so results become unreachable when the diagnoser is updated.
+Several backends are available:
+    lru: An in-process least recently used cache with a size limit and TTL.
+    mongo: A mongo collection with a TTL index.
+    redis: A redis database. Keys are set to expire after the TTL
+           and the size can be limited with a redis maxmemory policy.
+           The size isn't reported in the stats since counting the keys
+           with a prefix requires scanning the whole database.
+"""
+import collections
+import datetime
+import hashlib
+import json
+import time
+
+
+class LRUCacheBackend(object):
+    def __init__(self, max_size=1000, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._store = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._store)
+
+    def get(self, key):
+        if key not in self._store:
+            return None
+        expires, value = self._store.pop(key)
+        if expires is not None and expires < time.time():
+            return None
+        # Reinsert the item so it becomes the most recently used.
+        self._store[key] = (expires, value)
+        return value
+
+    def set(self, key, value):
+        self._store.pop(key, None)
+        expires = time.time() + self.ttl if self.ttl else None
+        self._store[key] = (expires, value)
+        while len(self._store) > self.max_size:
+            self._store.popitem(last=False)
+
+
+class MongoCacheBackend(object):
+    def __init__(self, collection, ttl=None):
+        self.collection = collection
+        self.ttl = ttl
+        self._index_created = False
+
+    def create_index(self):
+        # The index is created when the cache is first used rather than when
+        # the backend is created, so mongo being unavailable doesn't block
+        # importing the modules that create caches.
+        # Mongo removes documents once their expiresAt date has passed.
+        if not self._index_created:
+            self.collection.create_index('expiresAt', expireAfterSeconds=0)
+            self._index_created = True
+
+    def __len__(self):
+        return self.collection.count()
+
+    def get(self, key):
+        self.create_index()
+        doc = self.collection.find_one({ '_id': key })
+        if doc is None:
+            return None
+        # The TTL monitor only runs periodically,
+        # so expired documents might still be present.
+        if doc.get('expiresAt') and doc['expiresAt'] < datetime.datetime.utcnow():
+            return None
+        return json.loads(doc['value'])
+
+    def set(self, key, value):
+        self.create_index()
+        doc = {
+            '_id': key,
+            # Values are stored as JSON strings because diagnosis results
+            # can have keys that are not valid in mongo documents.
+            'value': json.dumps(value)
+        }
+        if self.ttl:
+            doc['expiresAt'] = datetime.datetime.utcnow() +\
+                datetime.timedelta(seconds=self.ttl)
+        self.collection.replace_one({ '_id': key }, doc, upsert=True)
+
+
+class RedisCacheBackend(object):
+    def __init__(self, client, ttl=None, prefix='grits-diagnosis:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+
+
+class DiagnosisCache(object):
+    """
+    Wraps a cache backend to compute keys and count hits and misses.
+    Backend errors are counted and treated as misses so the cache being
+    unavailable never causes a request to fail.
+    """
+    def __init__(self, backend, versions):
+        self.backend = backend
+        self.versions = versions
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def make_key(self, kind, value, extra_args):
+        """
+        Create a key for a document's diagnosis.
+        kind is "content" or "url" depending on what value is.
+        """
+        normalized_args = {
+            k : v.isoformat() if isinstance(v, datetime.datetime) else v
+            for k, v in extra_args.items()
+        }
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return hashlib.sha1(json.dumps([
+            kind,
+            hashlib.sha1(value).hexdigest(),
+            normalized_args,
+            self.versions
+        ], sort_keys=True)).hexdigest()
+
+    def get(self, key):
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            print "Diagnosis cache error:", repr(e)
+            self.errors += 1
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            print "Diagnosis cache error:", repr(e)
+            self.errors += 1
+
+    def stats(self):
+        # Backends that can't be sized cheaply don't define __len__.
+        size = None
+        if hasattr(self.backend, '__len__'):
+            try:
+                size = len(self.backend)
+            except Exception:
+                pass
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'size': size
+        }
+
+
+def cache_from_config(cache_config, versions):
+    """
+    Create a DiagnosisCache from a config dict such as:
+    { 'backend': 'lru', 'max_size': 1000, 'ttl': 60 * 60 * 24 }
+    { 'backend': 'mongo', 'url': 'mongodb://localhost:27017', 'ttl': 60 * 60 * 24 }
+    Mongo operations wait up to server_selection_timeout_ms (default 2000)
+    for the server before failing, so an unavailable server only slows
+    down uncached requests rather than blocking them.
+    { 'backend': 'redis', 'url': 'redis://localhost:6379/0', 'ttl': 60 * 60 * 24 }
+    None is returned if the backend is None.
+    """
+    backend_name = cache_config.get('backend')
+    ttl = cache_config.get('ttl')
+    if backend_name is None:
+        return None
+    elif backend_name == 'lru':
+        backend = LRUCacheBackend(cache_config.get('max_size', 1000), ttl)
+    elif backend_name == 'mongo':
+        from pymongo import MongoClient
+        client = MongoClient(cache_config.get('url', 'localhost'),
+            serverSelectionTimeoutMS=cache_config.get(
+                'server_selection_timeout_ms', 2000))
+        backend = MongoCacheBackend(
+            client[cache_config.get('db', 'grits')][
+                cache_config.get('collection', 'diagnosisCache')],
+            ttl)
+    elif backend_name == 'redis':
+        import redis
+        backend = RedisCacheBackend(
+            redis.StrictRedis.from_url(
+                cache_config.get('url', 'redis://localhost:6379/0')),
+            ttl)
+    else:
+        raise ValueError("Unknown diagnosis cache backend: " + backend_name)
+    return DiagnosisCache(backend, versions)
@@ -1,7 +1,9 @@
 import csv
 import os
+import numpy as np
 
 __table__ = None
+__label_table__ = None
 
 # To update the csv from our google sheet use:
 # wget --no-check-certificate --output-document=disease_label_table.csv 'https://docs.google.com/spreadsheet/ccc?key=1MvkBBsvGP6Ax_bPfQJupjRiPDN803IpG1vB-iFzsr6M&output=csv'
@@ -33,46 +35,130 @@ def get_table():
                 __table__.append(out_row)
     return __table__
 
+class LabelTable(object):
+    """
+    An immutable view of the disease label table with indexes for
+    constant time lookups by label or synonym. The transitive closure of
+    the parent labels is computed when it is created.
+    Use get_label_table() to get the shared instance.
+    """
+    __slots__ = [
+        '_rows', '_rows_by_label', '_labels', '_promed_labels',
+        '_inferred_labels', '_labels_by_name']
+
+    def __init__(self, rows):
+        rows_by_label = {}
+        disease_to_parents = {}
+        labels_by_name = {}
+        for row in rows:
+            label = row['label']
+            # When a label appears in multiple rows the first row is used for
+            # lookups, but the parent label from the last row is used.
+            # This matches the behavior of the original linear scans.
+            rows_by_label.setdefault(label, row)
+            if 'parent_label' in row:
+                disease_to_parents[label] = [row['parent_label']]
+            # The synonym column is a comma separated list.
+            for synonym in row.get('synonym', '').split(','):
+                if synonym.strip():
+                    labels_by_name.setdefault(synonym.strip().lower(), label)
+        for label in rows_by_label:
+            labels_by_name[label.lower()] = label
+        inferred_labels = {}
+        for label in rows_by_label:
+            inferred = []
+            unresolved_labels = list(disease_to_parents.get(label, []))
+            while len(unresolved_labels) > 0:
+                parent = unresolved_labels.pop()
+                if parent in inferred: continue
+                inferred.append(parent)
+                unresolved_labels += disease_to_parents.get(parent, [])
+            inferred_labels[label] = tuple(inferred)
+        object.__setattr__(self, '_rows', tuple(rows))
+        object.__setattr__(self, '_rows_by_label', rows_by_label)
+        object.__setattr__(self, '_labels', tuple(row['label'] for row in rows))
+        object.__setattr__(self, '_promed_labels', tuple(
+            row['label'] for row in rows if row.get('is_promed_label')))
+        object.__setattr__(self, '_inferred_labels', inferred_labels)
+        object.__setattr__(self, '_labels_by_name', labels_by_name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("LabelTable is immutable")
+
+    def __contains__(self, label):
+        return label in self._rows_by_label
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def rows(self):
+        return self._rows
+
+    @property
+    def labels(self):
+        return self._labels
+
+    @property
+    def promed_labels(self):
+        return self._promed_labels
+
+    def get_row(self, label):
+        return self._rows_by_label.get(label)
+
+    def is_in_table(self, label):
+        return label in self._rows_by_label
+
+    def is_not_human_disease(self, label):
+        row = self._rows_by_label.get(label)
+        if row is None:
+            print "WARNING: Unknown disease label:", label
+            return None
+        return row.get('is_not_disease') or row.get('not_human_disease')
+
+    def get_inferred_labels(self, label):
+        return list(self._inferred_labels.get(label, ()))
+
+    def resolve(self, name):
+        """
+        Return the label for a label or synonym (ignoring case),
+        or None if the name is not in the table.
+        """
+        return self._labels_by_name.get(name.strip().lower())
+
+    def get_ancestor_matrix(self, labels):
+        """
+        Return a boolean matrix where entry [i, j] is True when labels[j]
+        is an inferred (ancestor) label of labels[i].
+        """
+        label_indices = { label : idx for idx, label in enumerate(labels) }
+        matrix = np.zeros((len(labels), len(labels)), dtype=bool)
+        for idx, label in enumerate(labels):
+            for ancestor in self._inferred_labels.get(label, ()):
+                if ancestor in label_indices:
+                    matrix[idx, label_indices[ancestor]] = True
+        return matrix
+
+def get_label_table():
+    global __label_table__
+    if __label_table__ is None:
+        __label_table__ = LabelTable(get_table())
+    return __label_table__
+
 def get_promed_labels():
-    labels = []
-    for row in get_table():
-        if row.get('is_promed_label'):
-            labels.append(row['label'])
-    return labels
+    return list(get_label_table().promed_labels)
 
 def get_labels():
-    labels = []
-    for row in get_table():
-        labels.append(row['label'])
-    return labels
+    return list(get_label_table().labels)
 
 def is_in_table(disease):
-    for row in get_table():
-        if row['label'] == disease:
-            return True
-    return False
+    return get_label_table().is_in_table(disease)
 
 def is_not_human_disease(disease):
-    for row in get_table():
-        if row['label'] == disease:
-            return row.get('is_not_disease') or row.get('not_human_disease')
-    print "WARNING: Unknown disease label:", disease
+    return get_label_table().is_not_human_disease(disease)
 
-__disease_to_parents__ = None
 def get_inferred_labels(disease):
-    global __disease_to_parents__
-    if not __disease_to_parents__:
-        __disease_to_parents__ = {}
-        for row in get_table():
-            if 'parent_label' in row:
-                __disease_to_parents__[row['label']] = [row['parent_label']]
-    inferred_labels = []
-    parents = __disease_to_parents__.get(disease, [])
-    unresolved_labels = list(parents)
-    while len(unresolved_labels) > 0:
-        label = unresolved_labels.pop()
-        if label in inferred_labels: continue
-        inferred_labels.append(label)
-        new_parents = list(__disease_to_parents__.get(label, []))
-        unresolved_labels += new_parents
-    return inferred_labels
+    return get_label_table().get_inferred_labels(disease)
+
+def get_ancestor_matrix(labels):
+    return get_label_table().get_ancestor_matrix(labels)
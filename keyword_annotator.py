@@ -33,12 +33,14 @@ class KeywordAnnotator(Annotator):
         'eha/mode of transmission': 'modes'
     }
 
-    def __init__(self, db=None):
-        with open(os.environ.get('KEYWORD_PICKLE_PATH') or 'current_classifier/keyword_array.p', 'rb') as f:
-            args = dict()
-            if six.PY3:
-                args = dict(fix_imports=True)
-            keyword_array = pickle.load(f, **args)
+    def __init__(self, db=None, keyword_array=None):
+        # The Diagnoser passes in the keywords it has already loaded.
+        if keyword_array is None:
+            with open(os.environ.get('KEYWORD_PICKLE_PATH') or 'current_classifier/keyword_array.p', 'rb') as f:
+                args = dict()
+                if six.PY3:
+                    args = dict(fix_imports=True)
+                keyword_array = pickle.load(f, **args)
         self.keywords = defaultdict(dict)
         for keyword in keyword_array:
             if keyword['category'] in self.keyword_type_map:
@@ -0,0 +1,244 @@
+"""
+Metrics collected by the server. Histograms use cumulative buckets like
+Prometheus histograms so they can be exported for scraping.
+
+Metrics recorded by the celery workers are kept in a mongo collection by
+the Mongo* classes so the server can export the totals for all workers.
+"""
+import bisect
+import collections
+import json
+
+# Bucket upper bounds in seconds
+default_buckets = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram(object):
+    """
+    Counts observations into buckets for each combination of label values.
+    """
+    def __init__(self, name, documentation, label_names=(), buckets=default_buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Maps label values to per bucket counts, the sum and the count.
+        # The last bucket count is for observations above every bound.
+        self.values = collections.OrderedDict()
+
+    def check_labels(self, label_values):
+        if len(label_values) != len(self.label_names):
+            raise ValueError("Expected values for labels: %s" % (self.label_names,))
+
+    def observe(self, value, *label_values):
+        self.check_labels(label_values)
+        if label_values not in self.values:
+            self.values[label_values] = {
+                'buckets': [0] * (len(self.buckets) + 1),
+                'sum': 0.0,
+                'count': 0
+            }
+        entry = self.values[label_values]
+        entry['buckets'][bisect.bisect_left(self.buckets, value)] += 1
+        entry['sum'] += value
+        entry['count'] += 1
+
+    def cumulative_buckets(self, label_values):
+        """
+        Return (upper bound, count of observations <= bound) pairs
+        ending with an infinite bound.
+        """
+        entry = self.values[label_values]
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), entry['buckets']):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def summary(self):
+        """
+        Return the count, sum and mean for each combination of label values,
+        keyed by the label values joined with commas.
+        """
+        return {
+            ','.join(label_values): {
+                'count': entry['count'],
+                'sum': entry['sum'],
+                'mean': entry['sum'] / entry['count']
+            }
+            for label_values, entry in self.values.items()
+        }
+
+    def render(self):
+        """
+        Return the lines of the Prometheus text format for the histogram.
+        """
+        lines = header_lines(self, 'histogram')
+        for label_values, entry in self.values.items():
+            for bound, count in self.cumulative_buckets(label_values):
+                lines.append('%s_bucket%s %d' % (
+                    self.name,
+                    format_labels(self.label_names + ('le',),
+                        label_values + (format_value(bound),)),
+                    count))
+            labels = format_labels(self.label_names, label_values)
+            lines.append('%s_sum%s %s' % (
+                self.name, labels, format_value(entry['sum'])))
+            lines.append('%s_count%s %d' % (self.name, labels, entry['count']))
+        return lines
+
+
+class Counter(object):
+    """
+    A count for each combination of label values that only goes up.
+    """
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = collections.OrderedDict()
+
+    def check_labels(self, label_values):
+        if len(label_values) != len(self.label_names):
+            raise ValueError("Expected values for labels: %s" % (self.label_names,))
+
+    def inc(self, *label_values):
+        self.check_labels(label_values)
+        self.values[label_values] = self.values.get(label_values, 0) + 1
+
+    def render(self):
+        lines = header_lines(self, self.metric_type)
+        for label_values, value in self.values.items():
+            lines.append('%s%s %s' % (
+                self.name,
+                format_labels(self.label_names, label_values),
+                format_value(value)))
+        return lines
+
+
+class Gauge(Counter):
+    """
+    A value for each combination of label values that can go up and down.
+    """
+    metric_type = 'gauge'
+
+    def dec(self, *label_values):
+        self.check_labels(label_values)
+        self.values[label_values] = self.values.get(label_values, 0) - 1
+
+    def set(self, value, *label_values):
+        self.check_labels(label_values)
+        self.values[label_values] = value
+
+
+class MongoHistogram(Histogram):
+    """
+    A histogram stored in a mongo collection so the observations made by
+    several processes are combined. Each combination of label values is a
+    document with the bucket counts keyed by bucket index.
+    load() reads the current values from the collection.
+    """
+    def __init__(self, collection, *args, **kwargs):
+        super(MongoHistogram, self).__init__(*args, **kwargs)
+        self.collection = collection
+
+    def observe(self, value, *label_values):
+        self.check_labels(label_values)
+        self.collection.update_one({
+            '_id': document_id(self.name, label_values)
+        }, {
+            '$setOnInsert': {
+                'name': self.name,
+                'labels': list(label_values)
+            },
+            '$inc': {
+                'buckets.%d' % bisect.bisect_left(self.buckets, value): 1,
+                'sum': value,
+                'count': 1
+            }
+        }, upsert=True)
+
+    def load(self):
+        self.values = collections.OrderedDict()
+        for doc in self.collection.find({ 'name': self.name }).sort('_id'):
+            self.values[tuple(doc['labels'])] = {
+                'buckets': [
+                    doc['buckets'].get(str(idx), 0)
+                    for idx in range(len(self.buckets) + 1)],
+                'sum': doc['sum'],
+                'count': doc['count']
+            }
+
+
+class MongoCounter(Counter):
+    """
+    A counter stored in a mongo collection like MongoHistogram.
+    """
+    def __init__(self, collection, *args, **kwargs):
+        super(MongoCounter, self).__init__(*args, **kwargs)
+        self.collection = collection
+
+    def inc(self, *label_values):
+        self.check_labels(label_values)
+        self.collection.update_one({
+            '_id': document_id(self.name, label_values)
+        }, {
+            '$setOnInsert': {
+                'name': self.name,
+                'labels': list(label_values)
+            },
+            '$inc': { 'value': 1 }
+        }, upsert=True)
+
+    def load(self):
+        self.values = collections.OrderedDict(
+            (tuple(doc['labels']), doc['value'])
+            for doc in self.collection.find({ 'name': self.name }).sort('_id'))
+
+
+def document_id(name, label_values):
+    return name + json.dumps(label_values)
+
+
+def header_lines(metric, metric_type):
+    return [
+        '# HELP %s %s' % (metric.name,
+            metric.documentation.replace('\\', r'\\').replace('\n', r'\n')),
+        '# TYPE %s %s' % (metric.name, metric_type)
+    ]
+
+
+def format_labels(label_names, label_values):
+    if len(label_names) == 0:
+        return ''
+    return '{' + ','.join(
+        '%s="%s"' % (name, unicode(value)
+            .replace('\\', r'\\')
+            .replace('"', r'\"')
+            .replace('\n', r'\n'))
+        for name, value in zip(label_names, label_values)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    elif value == float('-inf'):
+        return '-Inf'
+    return repr(float(value))
+
+
+def render(metric_list):
+    """
+    Return the metrics in the Prometheus text exposition format.
+    Metrics with a load method are refreshed before they are rendered.
+    """
+    lines = []
+    for metric in metric_list:
+        if hasattr(metric, 'load'):
+            metric.load()
+        lines.extend(metric.render())
+    return u'\n'.join(lines) + u'\n'
@@ -0,0 +1,153 @@
+"""
+Shared completion tracking for the celery tasks started by the server.
+
+Rather than every request scheduling its own one second poll of the result
+backend, all pending results are registered with a single ResultWatcher.
+The watcher runs one timer on the IOLoop, checks results that are due,
+and calls back the handler as soon as a result is ready. Results are checked
+with a short interval at first that backs off while they remain pending, so
+the fast chains (e.g. diseases_only classifications) are picked up within a
+few tens of milliseconds without hammering the backend for slow ones.
+"""
+import collections
+import tornado.ioloop
+
+
+def percentile(sorted_values, p):
+    """
+    Return the p-th percentile (0-100) of an already sorted list using
+    the nearest rank method.
+    """
+    if len(sorted_values) == 0:
+        return None
+    rank = int(round(p / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[rank]
+
+
+class LatencyStats(object):
+    """
+    Keeps a bounded window of recent durations (in seconds) for each label
+    so percentiles can be reported without unbounded memory growth.
+    """
+    def __init__(self, window=1000):
+        self.window = window
+        self.samples = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.window))
+        self.counts = collections.defaultdict(int)
+
+    def record(self, label, duration):
+        self.samples[label].append(duration)
+        self.counts[label] += 1
+
+    def summary(self):
+        result = {}
+        for label, samples in self.samples.items():
+            sorted_samples = sorted(samples)
+            result[label] = {
+                'count': self.counts[label],
+                'p50': percentile(sorted_samples, 50),
+                'p99': percentile(sorted_samples, 99),
+                'max': sorted_samples[-1] if sorted_samples else None
+            }
+        return result
+
+
+class ResultWatcher(object):
+    """
+    Multiplexes the readiness checks for all pending celery result sets
+    onto a single IOLoop timer.
+    """
+    def __init__(self, min_interval=0.02, max_interval=0.5, io_loop=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._io_loop = io_loop
+        self._pending = {}
+        self._next_id = 0
+        self._timeout = None
+        self._timeout_deadline = None
+        self.queue_to_response = LatencyStats()
+
+    @property
+    def io_loop(self):
+        return self._io_loop or tornado.ioloop.IOLoop.instance()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def watch(self, res_set, on_ready, label='default'):
+        """
+        Call on_ready() once every result in res_set is ready or one of them
+        has failed. The time between the call to watch and on_ready is
+        recorded under the given label.
+        """
+        now = self.io_loop.time()
+        entry = {
+            'res_set': res_set,
+            'on_ready': on_ready,
+            'label': label,
+            'start': now,
+            'interval': self.min_interval,
+            'deadline': now
+        }
+        # Check immediately so eagerly evaluated tasks (i.e. in debug mode)
+        # don't wait for the timer.
+        if self._check_ready(entry):
+            self._complete(entry)
+            return
+        entry['deadline'] = now + entry['interval']
+        self._pending[self._next_id] = entry
+        self._next_id += 1
+        self._schedule()
+
+    def _is_ready(self, entry):
+        res_set = entry['res_set']
+        return res_set.ready() or res_set.failed()
+
+    def _check_ready(self, entry):
+        """
+        An error checking the result backend completes the entry, so its
+        on_ready callback gets the error when it reads the results instead
+        of the request waiting forever.
+        """
+        try:
+            return self._is_ready(entry)
+        except Exception as e:
+            print "Error checking task results:", repr(e)
+            return True
+
+    def _complete(self, entry):
+        self.queue_to_response.record(
+            entry['label'], self.io_loop.time() - entry['start'])
+        entry['on_ready']()
+
+    def _schedule(self):
+        if len(self._pending) == 0:
+            return
+        deadline = min(entry['deadline'] for entry in self._pending.values())
+        if self._timeout is not None:
+            if self._timeout_deadline <= deadline:
+                return
+            self.io_loop.remove_timeout(self._timeout)
+        self._timeout_deadline = deadline
+        self._timeout = self.io_loop.add_timeout(deadline, self._check_pending)
+
+    def _check_pending(self):
+        self._timeout = None
+        self._timeout_deadline = None
+        now = self.io_loop.time()
+        try:
+            for entry_id, entry in self._pending.items():
+                if entry['deadline'] > now:
+                    continue
+                if self._check_ready(entry):
+                    del self._pending[entry_id]
+                    # Each completion runs as its own IOLoop callback so an
+                    # exception raised by one handler doesn't affect the others.
+                    self.io_loop.add_callback(self._complete, entry)
+                else:
+                    entry['interval'] = min(entry['interval'] * 2, self.max_interval)
+                    entry['deadline'] = now + entry['interval']
+        finally:
+            # The timer is always rescheduled so the remaining results
+            # are still checked.
+            self._schedule()
@@ -0,0 +1,149 @@
+"""
+Scrape many urls concurrently using pooled keep-alive connections.
+
+    fetcher.scrape_many(urls)
+
+returns the same result dicts as calling scraper.scrape on each url.
+The openers here use a shared requests session with a connection pool for
+each host, so at most max_connections_per_host requests are sent to a host
+at once and connections are reused between requests.
+"""
+import urllib2
+import urlparse
+import socket
+import cookielib
+import sys
+import requests
+from requests.packages.urllib3.exceptions import ReadTimeoutError, ProtocolError
+from concurrent import futures
+import scraper
+
+# urllib2 gives up after the same number of redirects.
+max_redirects = 10
+
+class PooledResponse(object):
+    """
+    Wraps a streamed requests response with the parts of the urllib2
+    response interface that scraper.open_url uses.
+    The connection is returned to the pool once the body has been read
+    or the response is closed.
+    """
+    def __init__(self, response, redirects):
+        self._response = response
+        self.code = response.status_code
+        self.msg = response.reason
+        self.url = response.url
+        self.headers = response.headers
+        if redirects:
+            self.redirects = redirects
+    def getcode(self):
+        return self.code
+    def info(self):
+        return self.headers
+    def read(self, amt=None):
+        try:
+            return self._response.raw.read(amt, decode_content=True)
+        except ReadTimeoutError as e:
+            raise socket.timeout(str(e))
+        except ProtocolError as e:
+            raise socket.error(str(e))
+    def close(self):
+        self._response.close()
+
+class PooledOpener(object):
+    """
+    An opener that sends requests with a requests session.
+    Redirects are followed here rather than by requests so they can be
+    recorded the same way OpenURLHandler records them,
+    and so the user agent can be left off redirected requests
+    like the BackupOpenURLHandler does.
+    """
+    def __init__(self, session, unredirected_user_agent=False):
+        self.session = session
+        self.unredirected_user_agent = unredirected_user_agent
+    def open(self, url, timeout=60):
+        headers = { 'User-agent' : scraper.user_agent }
+        redirects = []
+        try:
+            for redirect_count in range(max_redirects + 1):
+                response = self.session.get(url,
+                    headers=headers,
+                    timeout=timeout,
+                    allow_redirects=False,
+                    stream=True)
+                if not response.is_redirect:
+                    break
+                response.close()
+                # OpenURLHandler records the most recent redirect first.
+                redirects.insert(0, {
+                    'url' : url,
+                    'code' : response.status_code
+                })
+                url = urlparse.urljoin(url, response.headers['location'])
+                if self.unredirected_user_agent:
+                    headers = {}
+            else:
+                raise urllib2.HTTPError(url, response.status_code,
+                    "Too many redirects", response.headers, None)
+        except requests.exceptions.Timeout as e:
+            raise socket.timeout(str(e))
+        except requests.exceptions.RequestException as e:
+            raise urllib2.URLError(e)
+        if response.status_code >= 400:
+            response.close()
+            raise urllib2.HTTPError(url, response.status_code,
+                response.reason, response.headers, None)
+        return PooledResponse(response, redirects)
+
+class PooledFetcher(object):
+    """
+    A replacement for scraper.default_fetcher that reuses connections.
+    It is safe to use from multiple threads.
+    """
+    def __init__(self, max_connections_per_host=4, max_hosts=100,
+        max_body_bytes=scraper.default_max_body_bytes):
+        self.max_body_bytes = max_body_bytes
+        self.session = requests.Session()
+        # urllib2 doesn't keep cookies, so they are ignored here too
+        # to get the same results.
+        self.session.cookies.set_policy(
+            cookielib.DefaultCookiePolicy(allowed_domains=[]))
+        # Blocking makes requests wait for a connection to the host to become
+        # available rather than opening more than max_connections_per_host.
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=max_hosts,
+            pool_maxsize=max_connections_per_host,
+            pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.primary_opener = PooledOpener(self.session)
+        self.backup_opener = PooledOpener(
+            self.session, unredirected_user_agent=True)
+    def close(self):
+        self.session.close()
+
+def scrape_many(urls, max_workers=10, fetcher=None):
+    """
+    Scrape the given urls with at most max_workers requests in progress
+    at once. A list of results in the same order as the urls is returned.
+    Unexpected errors are returned as unscrapable results so one bad url
+    doesn't prevent the other results from being returned.
+    """
+    close_fetcher = fetcher is None
+    if fetcher is None:
+        fetcher = PooledFetcher()
+    def scrape_one(url):
+        try:
+            return scraper.scrape(url, fetcher)
+        except Exception:
+            return {
+                'sourceUrl' : url,
+                'unscrapable' : True,
+                'exception' : '\n'.join([str(i) for i in sys.exc_info()])
+            }
+    try:
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(scrape_one, urls))
+    finally:
+        if close_fetcher:
+            fetcher.close()
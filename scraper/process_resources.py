@@ -7,65 +7,175 @@ import os, sys, json
 import readability
 import lxml
 import re
+import hashlib
+import collections
+import lxml.html
 __version__ = '0.0.0'
-def extract_clean_content(content):
-    global __version__
-    # I found out about goose and readability here:
-    # http://stackoverflow.com/questions/14164350/identifying-large-bodies-of-text-via-beautifulsoup-or-other-python-based-extract
-    # The poster seems to like goose more.
-    # One difference is that goose cleans up all the html, while readability
-    # usually just remove cruft that isn't related to the article text.
-    # There is a trade off between retaining links and formatting, and
-    # getting cleaner text.
-    # Readability seems to be better at finding the content in some cases
-    # so it is used for initial cleaning, then goose is used since its
-    # plain text output is easier to deal with downstream.
-    method = None
-    cleaned_content = ''
-    ###### Readability code:
-    readability_error = None
-    try:
-        document = readability.readability.Document(content)
-        cleaner_content = document.summary().strip()
-        if len(cleaner_content) > 50:
-            content = cleaner_content
-        else:
-            readability_error = "Readability content too short: " + cleaner_content
-    except readability.readability.Unparseable as e:
-        readability_error = '\n'.join([str(i) for i in sys.exc_info()])
-    except (lxml.etree.XMLSyntaxError,
-            lxml.etree.DocumentInvalid,
-            lxml.etree.ParserError) as e:
-        readability_error = '\n'.join([str(i) for i in sys.exc_info()])
-    except (AttributeError, ValueError, TypeError) as e:
-        # This ought to be handled by readability.
-        readability_error = '\n'.join([str(i) for i in sys.exc_info()])
-    ######
-    
-    if not content.startswith('<html>'):
-        content = '<html><body>' + content + '</body></html>'
-    try:
-        cleaned_content = goose.Goose({
+
+# Tags whose text is treated as a separate paragraph by the fast path.
+paragraph_tags = set([
+    'p', 'div', 'li', 'pre', 'blockquote', 'td', 'th', 'dd', 'dt',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'section', 'article'])
+
+def html_to_paragraphs(html):
+    """
+    Split the text in an html fragment into paragraphs with whitespace
+    collapsed. Also returns the number of characters in link text.
+    """
+    root = lxml.html.fromstring(html)
+    for el in root.iter():
+        if not isinstance(el.tag, basestring):
+            continue
+        if el.tag == 'br':
+            el.tail = '\n\n' + (el.tail or '')
+        elif el.tag in paragraph_tags:
+            el.text = '\n\n' + (el.text or '')
+            el.tail = '\n\n' + (el.tail or '')
+    link_chars = sum(
+        len(' '.join(a.text_content().split())) for a in root.iter('a'))
+    paragraphs = []
+    for paragraph in re.split(r'\n\s*\n', root.text_content()):
+        paragraph = ' '.join(paragraph.split())
+        if paragraph:
+            paragraphs.append(paragraph)
+    return paragraphs, link_chars
+
+class ContentExtractor(object):
+    """
+    Extracts the article text from html documents.
+    Create one per worker so the Goose instance is reused between documents.
+    Results are cached by a hash of the html and the cleaner version.
+
+    When fast_path is True and the readability summary is mostly long
+    paragraphs with little link text, its text is used directly and
+    Goose is skipped.
+    """
+    # Fast path thresholds
+    min_fast_path_chars = 500
+    min_long_paragraph_chars = 80
+    min_long_paragraph_fraction = 0.7
+    max_link_fraction = 0.2
+
+    def __init__(self, cache_size=1000, fast_path=False):
+        self.goose = goose.Goose({
             'parser_class':'soup',
             'enable_image_fetching' : False,
-        }).extract(raw_html=content).cleaned_text
-    except ValueError:
+        })
+        self.cache_size = cache_size
+        self.fast_path = fast_path
+        self._cache = collections.OrderedDict()
+
+    def cache_key(self, content):
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        return __version__ + ':' + hashlib.sha1(content).hexdigest()
+
+    def extract(self, content):
+        key = self.cache_key(content)
+        result = self._cache.pop(key, None)
+        if result is None:
+            result = self.extract_uncached(content)
+        # Reinserting the result makes it the most recently used.
+        self._cache[key] = result
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return dict(result)
+
+    def readability_text(self, summary):
+        """
+        Return the text of a readability summary if it is clean enough
+        to skip Goose, otherwise None.
+        """
+        try:
+            paragraphs, link_chars = html_to_paragraphs(summary)
+        except (lxml.etree.XMLSyntaxError, lxml.etree.ParserError):
+            return None
+        total_chars = sum(len(p) for p in paragraphs)
+        long_paragraph_chars = sum(
+            len(p) for p in paragraphs
+            if len(p) >= self.min_long_paragraph_chars)
+        if total_chars < self.min_fast_path_chars:
+            return None
+        if long_paragraph_chars < self.min_long_paragraph_fraction * total_chars:
+            return None
+        if link_chars > self.max_link_fraction * total_chars:
+            return None
+        return u'\n\n'.join(paragraphs)
+
+    def extract_uncached(self, content):
+        # I found out about goose and readability here:
+        # http://stackoverflow.com/questions/14164350/identifying-large-bodies-of-text-via-beautifulsoup-or-other-python-based-extract
+        # The poster seems to like goose more.
+        # One difference is that goose cleans up all the html, while readability
+        # usually just remove cruft that isn't related to the article text.
+        # There is a trade off between retaining links and formatting, and
+        # getting cleaner text.
+        # Readability seems to be better at finding the content in some cases
+        # so it is used for initial cleaning, then goose is used since its
+        # plain text output is easier to deal with downstream.
+        method = None
         cleaned_content = ''
-    if len(cleaned_content) < 1:
-        # Goose doesn't do well with foreign language content.
-        # If we can't find content with goose try extracting
-        # all the text with Beautiful soup.
-        # Beautiful soup doesn't attempt to extract the article,
-        # it just finds all the text in the html, which seems to be
-        # good enough since we've already used readability on the articles.
-        content = re.sub('\<br\s?\/?\>', '\n', content)
-        cleaned_content = BeautifulSoup(content).text
-    return  {
-        'clearnerVersion' : __version__,
-        'method' : method,
-        'content' : cleaned_content,
-        'readability_error' : readability_error,
-        # Malformed should be true whenever we can detect an issue with the
-        # content that was extracted.
-        'malformed' : len(cleaned_content) < 50
-    }
+        ###### Readability code:
+        readability_error = None
+        try:
+            document = readability.readability.Document(content)
+            cleaner_content = document.summary().strip()
+            if len(cleaner_content) > 50:
+                content = cleaner_content
+                if self.fast_path:
+                    cleaned_content = self.readability_text(cleaner_content)
+                    if cleaned_content:
+                        method = 'readability'
+                    else:
+                        cleaned_content = ''
+            else:
+                readability_error = "Readability content too short: " + cleaner_content
+        except readability.readability.Unparseable as e:
+            readability_error = '\n'.join([str(i) for i in sys.exc_info()])
+        except (lxml.etree.XMLSyntaxError,
+                lxml.etree.DocumentInvalid,
+                lxml.etree.ParserError) as e:
+            readability_error = '\n'.join([str(i) for i in sys.exc_info()])
+        except (AttributeError, ValueError, TypeError) as e:
+            # This ought to be handled by readability.
+            readability_error = '\n'.join([str(i) for i in sys.exc_info()])
+        ######
+    
+        if method is None:
+            if not content.startswith('<html>'):
+                content = '<html><body>' + content + '</body></html>'
+            try:
+                cleaned_content = self.goose.extract(raw_html=content).cleaned_text
+                method = 'goose'
+            except ValueError:
+                cleaned_content = ''
+        if len(cleaned_content) < 1:
+            # Goose doesn't do well with foreign language content.
+            # If we can't find content with goose try extracting
+            # all the text with Beautiful soup.
+            # Beautiful soup doesn't attempt to extract the article,
+            # it just finds all the text in the html, which seems to be
+            # good enough since we've already used readability on the articles.
+            content = re.sub('\<br\s?\/?\>', '\n', content)
+            cleaned_content = BeautifulSoup(content).text
+            method = 'soup'
+        return  {
+            'clearnerVersion' : __version__,
+            'method' : method,
+            'content' : cleaned_content,
+            'readability_error' : readability_error,
+            # Malformed should be true whenever we can detect an issue with the
+            # content that was extracted.
+            'malformed' : len(cleaned_content) < 50
+        }
+
+default_extractor = None
+
+def extract_clean_content(content):
+    """
+    Extract the article text from html with a shared ContentExtractor.
+    """
+    global default_extractor
+    if default_extractor is None:
+        default_extractor = ContentExtractor()
+    return default_extractor.extract(content)
@@ -73,26 +73,87 @@ def getTimeZoneDict():
                 TimeZoneDict[tz_code] = tz_offset
     return TimeZoneDict
 
-def dom_tree_to_formatted_text(el):
-    result = ""
+# The characters matched by \s when the unicode flag is not set.
+ascii_whitespace = u" \t\n\r\f\v"
+
+def format_text_node(el):
+    normed_text = unicode(el).replace(u"\xa0", " ")
+    # Make it so spaces are the only whitespace char and there is never
+    # more than one in a row.
+    return re.sub("\s\s+", " ", re.sub(r"\s", " ", normed_text, re.M))
+
+# The formatter below writes into a list of string pieces rather than
+# concatenating strings so it runs in linear time. The helpers operate on
+# the segment of pieces written by the current element, which starts at the
+# given start index. Empty pieces are never left at the end of the list.
+
+def rstrip_segment(out, start, chars=None):
+    while len(out) > start:
+        piece = out[-1].rstrip(chars)
+        if piece:
+            out[-1] = piece
+            return
+        out.pop()
+
+def lstrip_segment(out, start):
+    for idx in xrange(start, len(out)):
+        piece = out[idx].lstrip()
+        if piece:
+            out[idx] = piece
+            return
+        out[idx] = u""
+    del out[start:]
+
+def remove_trailing_spaces(out, start):
+    """
+    This is equivalent to re.sub("( )+$", "", segment_text). Since $ also
+    matches before a newline at the end of a string, spaces are removed
+    from before a final newline too.
+    """
+    if len(out) <= start:
+        return
+    if out[-1].endswith(u" "):
+        rstrip_segment(out, start, u" ")
+    elif out[-1].endswith(u"\n"):
+        last_piece = out.pop()[:-1]
+        if last_piece:
+            out.append(last_piece)
+        rstrip_segment(out, start, u" ")
+        out.append(u"\n")
+
+def format_dom_tree_into(el, out):
     if not hasattr(el, "children"):
-        normed_text = unicode(el).replace(u"\xa0", " ")
-        # Make it so spaces are the only whitespace char and there is never
-        # more than one in a row.
-        return re.sub("\s\s+", " ", re.sub(r"\s", " ", normed_text, re.M))
+        text = format_text_node(el)
+        if text:
+            out.append(text)
+        return
+    start = len(out)
     for child in el.children:
         if child.name and (re.match(r"h\d|p", child.name)):
-            result = re.sub("( )+$", "", result)
-            result += "\n" + dom_tree_to_formatted_text(child).strip() + "\n\n"
+            remove_trailing_spaces(out, start)
+            out.append(u"\n")
+            # The child has a name so it is an element, and the text of
+            # elements is always stripped.
+            format_dom_tree_into(child, out)
+            out.append(u"\n\n")
         elif str(child.name) == "br":
-            result = re.sub("( )+$", "", result)
-            result += "\n"
+            remove_trailing_spaces(out, start)
+            out.append(u"\n")
         else:
-            if len(result) > 0 and re.match(r"\s", result[-1:]):
-                result += dom_tree_to_formatted_text(child).lstrip()
-            else:
-                result += dom_tree_to_formatted_text(child)
-    return result.strip()
+            child_start = len(out)
+            follows_whitespace = len(out) > start and out[-1][-1] in ascii_whitespace
+            format_dom_tree_into(child, out)
+            if follows_whitespace:
+                lstrip_segment(out, child_start)
+    rstrip_segment(out, start)
+    lstrip_segment(out, start)
+
+def dom_tree_to_formatted_text(el):
+    if not hasattr(el, "children"):
+        return format_text_node(el)
+    out = []
+    format_dom_tree_into(el, out)
+    return u"".join(out)
 
 def promed_html_to_formatted_text(html):
     """
@@ -107,6 +168,63 @@ def promed_html_to_formatted_text(html):
         replace("< ", "&lt; ")
     return dom_tree_to_formatted_text(BeautifulSoup(normed_html))
 
+def simplify_text(s):
+    return s.replace("&", "and").replace(",", "")
+
+def is_word_char(c):
+    # This matches the regex definition of \w when the unicode flag is not set.
+    return c == "_" or (ord(c) < 128 and c.isalnum())
+
+class LabelMatcher(object):
+    """
+    Finds the disease labels mentioned in a text. The label names are
+    compiled into a character trie once so a text can be searched for every
+    label in a single pass. The matches are the same as searching for each
+    name with a case insensitive \\bname\\b regex, including overlapping
+    names like "Avian Influenza" and "Influenza".
+    """
+    def __init__(self, rows):
+        self.labels = [row["label"] for row in rows]
+        self.trie = {}
+        for row_idx, row in enumerate(rows):
+            for name in row.get("synonyms", []) + [row["label"]]:
+                node = self.trie
+                for char in simplify_text(name).lower():
+                    node = node.setdefault(char, {})
+                # None is used as the terminal key since it can't be a char.
+                node.setdefault(None, set()).add(row_idx)
+
+    def find_labels(self, text):
+        """
+        Return the labels that appear in the text, in table order.
+        """
+        text = simplify_text(text).lower()
+        is_word = [is_word_char(c) for c in text] + [False]
+        def is_boundary(idx):
+            return is_word[idx] != (idx > 0 and is_word[idx - 1])
+        matched_rows = set()
+        for start in xrange(len(text)):
+            if not is_boundary(start):
+                continue
+            node = self.trie
+            idx = start
+            while node is not None:
+                if None in node and is_boundary(idx):
+                    matched_rows |= node[None]
+                if idx >= len(text):
+                    break
+                node = node.get(text[idx])
+                idx += 1
+        return [self.labels[row_idx] for row_idx in sorted(matched_rows)]
+
+__label_matcher__ = None
+def get_label_matcher():
+    global __label_matcher__
+    if __label_matcher__ is None:
+        __label_matcher__ = LabelMatcher(
+            disease_label_table.get_label_table().rows)
+    return __label_matcher__
+
 def parse_subject_line(txt):
     subject_re = re.compile(
         r"PRO(/(?P<ns1>\w{1,3}))?(/(?P<ns2>\w{1,3}))?\>" +\
@@ -168,15 +286,8 @@ def parse_subject_line(txt):
     tags.sort()
     result['tags'] = tags
     
-    result['diseaseLabels'] = []
-    def simplify_text(s):
-        return s.replace("&", "and").replace(",", "")
-    for row in disease_label_table.get_table():
-        for syn in row.get("synonyms", []) + [row["label"]]:
-            if re.search(r"\b" + re.escape(simplify_text(syn)) + r"\b",
-                         simplify_text(result["description"]), re.I):
-                result['diseaseLabels'].append(row["label"])
-                break
+    result['diseaseLabels'] = get_label_matcher().find_labels(
+        result["description"])
     return result
 
 def parse_datetime(timestamp_txt):
@@ -462,15 +573,16 @@ def parse_post_text(formatted_content):
     post['articles'] = articles
     return post
 
-def scrape_promed_id(id):
+def scrape_promed_id(id, session=requests):
     """
     Fetch the ProMED post with the given id and parse its content to extract
     metadata such as the disease the post is about, whether the post is an
     update/RFI/Summary/etc., the urls mentioned, and the other posts
     mentioned.
+    A requests session can be passed in to reuse its connections.
     """
     url = "http://www.promedmail.org/ajax/getPost.php?alert_id=%s" % id
-    resp = requests.get(url, headers={"Referer": "http://www.promedmail.org/"})
+    resp = session.get(url, headers={"Referer": "http://www.promedmail.org/"})
     content = resp.json()
     zoomLat = content.get('zoom_lat')
     zoomLon = content.get('zoom_lon')
@@ -493,13 +605,13 @@ def scrape_promed_id(id):
     result.update(parse_post_text(formatted_content))
     return result
 
-def scrape_promed_url(url):
+def scrape_promed_url(url, session=requests):
     """
     Scrape the ProMED article with the given URL
     """
     article_id_regex = re.compile('(id=|\/post\/)(?P<id>\d+\.?\d*)')
     parse = article_id_regex.search(url)
     if parse:
-        return scrape_promed_id(parse.groupdict().get('id'))
+        return scrape_promed_id(parse.groupdict().get('id'), session)
     else:
         raise Exception("Couldn't scrape url: " + url)
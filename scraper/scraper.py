@@ -1,14 +1,21 @@
 __version__ = '0.0.3'
 import urllib2, httplib
-import chardet
+from chardet.universaldetector import UniversalDetector
+import cgi
+import codecs
+import re
 import httplib2
 import scrape_promed
 import sys, exceptions, socket
 import datetime
+import collections
+import requests
+
+user_agent = "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/33.0.1750.154 Safari/537.36"
 
 class OpenURLHandler(urllib2.HTTPRedirectHandler):
     def http_request(self, request):
-        request.add_header("User-agent", "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/33.0.1750.154 Safari/537.36")
+        request.add_header("User-agent", user_agent)
         return request
     def http_error_301(self, req, fp, code, msg, headers):  
         result = urllib2.HTTPRedirectHandler.http_error_301(
@@ -42,41 +49,147 @@ class BackupOpenURLHandler(OpenURLHandler):
     http://stackoverflow.com/questions/23602996/why-does-setting-the-user-agent-in-an-unredirected-header-avoid-403s
     """
     def http_request(self, request):
-        request.add_unredirected_header("User-agent", "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/33.0.1750.154 Safari/537.36")
+        request.add_unredirected_header("User-agent", user_agent)
         return request
 backup_opener = urllib2.build_opener(BackupOpenURLHandler())
 
-def open_url(opener, url):
+# Bodies are read in chunks of this size until max_body_bytes is reached.
+read_chunk_size = 64 * 1024
+default_max_body_bytes = 5 * 1024 * 1024
+# Only this much of the body is used to detect its encoding.
+encoding_detection_bytes = 64 * 1024
+meta_charset_regex = re.compile(
+    r"""<meta[^>]+charset\s*=\s*["']?\s*([-\w.:]+)""", re.I)
+
+class DefaultFetcher(object):
+    """
+    The openers and requests session used for scraping.
+    Each request opens a new connection.
+    See fetcher.PooledFetcher for a version that reuses connections.
+    """
+    primary_opener = primary_opener
+    backup_opener = backup_opener
+    session = requests
+    max_body_bytes = default_max_body_bytes
+default_fetcher = DefaultFetcher()
+
+def read_body(resp, max_bytes):
+    """
+    Read up to max_bytes of the response body.
+    Returns the body and whether it was truncated.
+    """
+    chunks = []
+    total = 0
+    while total <= max_bytes:
+        chunk = resp.read(read_chunk_size)
+        if not chunk:
+            return ''.join(chunks), False
+        chunks.append(chunk)
+        total += len(chunk)
+    return ''.join(chunks)[:max_bytes], True
+
+def normalize_encoding(encoding):
+    """
+    Return the encoding if python has a codec for it, otherwise None.
+    """
+    if not encoding:
+        return None
+    try:
+        codecs.lookup(encoding)
+        return encoding.lower()
+    except LookupError:
+        return None
+
+def detect_encoding(html, content_type=None):
+    """
+    Determine the encoding of an html document using the charset in its
+    Content-Type header, then its meta tags, then the statistical detection
+    in chardet on a prefix of the document.
+    Returns the encoding and which of those methods found it.
+    """
+    if content_type:
+        encoding = normalize_encoding(
+            cgi.parse_header(content_type)[1].get('charset'))
+        if encoding:
+            return encoding, 'header'
+    # Browsers only look for meta charset tags near the start of the document.
+    match = meta_charset_regex.search(html[:4096])
+    if match:
+        encoding = normalize_encoding(match.group(1))
+        if encoding:
+            return encoding, 'meta'
+    detector = UniversalDetector()
+    prefix = html[:encoding_detection_bytes]
+    for idx in range(0, len(prefix), 4096):
+        detector.feed(prefix[idx:idx + 4096])
+        if detector.done:
+            break
+    detector.close()
+    encoding = normalize_encoding(detector.result['encoding'])
+    if encoding:
+        return encoding, 'detected'
+    return 'utf-8', 'default'
+
+# Status codes for which the backup opener might return a different result.
+# Some sites respond to the headers sent by the primary opener with these.
+backup_status_codes = set([400, 403, 406])
+
+def open_url(opener, url, fetch_counts=None, fetcher=default_fetcher):
     url = httplib2.iri2uri(url)
     result = {
         'sourceUrl' : url
     }
     try:
+        if fetch_counts is not None:
+            fetch_counts[url] += 1
         resp = opener.open(url, timeout=60)
         if hasattr(resp, 'redirects'):
-            # The recursive call to scrape_main here is inefficient because two
-            # requests could be sent to the page we are redirected to. Recursive
-            # calls before redirection would require a major refactoring.
-            result = scrape_main(resp.url)
             result['redirects'] = resp.redirects
-            result['sourceUrl'] = url
-            return result
+            # The response is for the page we were redirected to, so its body
+            # is used unless that page needs to be scraped differently
+            # (e.g. it is a ProMED post or a PDF).
+            special_case_result = scrape_special_cases(
+                resp.url, fetch_counts, fetcher)
+            if special_case_result is not None:
+                resp.close()
+                special_case_result['redirects'] = resp.redirects
+                special_case_result['sourceUrl'] = url
+                return special_case_result
         result['code'] = resp.code
         result['msg'] = resp.msg
         result['url'] = resp.url
         if resp.getcode() >= 300:
+            resp.close()
             result['unscrapable'] = True
             return result
         else:
-            html = resp.read()
+            headers = resp.info()
+            content_length = headers.get('content-length', '')
+            if content_length.isdigit() and\
+                int(content_length) > fetcher.max_body_bytes:
+                resp.close()
+                result.update({
+                    'unscrapable' : True,
+                    'oversized' : True,
+                    'contentLength' : int(content_length),
+                    'exception' : "Response is larger than %d bytes" %
+                        fetcher.max_body_bytes
+                })
+                return result
+            # Responses without a Content-Length are read until the limit
+            # is reached and the rest is discarded.
+            html, truncated = read_body(resp, fetcher.max_body_bytes)
+            resp.close()
+            if truncated:
+                result['truncated'] = True
             if not html:
                 result.update({
                     'unscrapable' : True,
                     'exception' : "No html returned"
                 })
                 return result
-            detected_encoding = chardet.detect(html)['encoding']
-            encoding = detected_encoding if detected_encoding else 'utf-8'
+            encoding, result['encodingSource'] = detect_encoding(
+                html, headers.get('content-type'))
             result['htmlContent'] = unicode(
                 html.decode(
                     encoding=encoding,
@@ -86,7 +199,9 @@ def open_url(opener, url):
             result['encoding'] = encoding
             return result
 
-    except (urllib2.HTTPError, urllib2.URLError):
+    except (urllib2.HTTPError, urllib2.URLError) as e:
+        if isinstance(e, urllib2.HTTPError):
+            result['code'] = e.code
         errDescription = '\n'.join([str(i) for i in sys.exc_info()])
         result.update({
             'unscrapable' : True,
@@ -124,7 +239,11 @@ def open_url(opener, url):
         print errDescription
         raise Exception("Unknown error")
 
-def scrape_main(url):
+def scrape_special_cases(url, fetch_counts=None, fetcher=default_fetcher):
+    """
+    Return the result for urls that are not scraped by fetching their html,
+    or None if the url should be fetched normally.
+    """
     parsed_url = None
     try:
         # Can this handle unicode urls?
@@ -147,7 +266,9 @@ def scrape_main(url):
             'unscrapable' : True
         }
     if 'promed' in parsed_url.hostname:
-        return_value = scrape_promed.scrape_promed_url(url)
+        if fetch_counts is not None:
+            fetch_counts[url] += 1
+        return_value = scrape_promed.scrape_promed_url(url, fetcher.session)
         return_value['sourceUrl'] = url
         return return_value
     if 'empres-i.fao.org' in parsed_url.hostname:
@@ -174,7 +295,7 @@ def scrape_main(url):
         if not testparse or not testparse.hostname:
             print url, "has a bad url parameter"
         if source_url:
-            result = scrape_main(source_url)
+            result = scrape_main(source_url, fetch_counts, fetcher)
             result['googleNews'] = True
             return result
         else:
@@ -184,15 +305,26 @@ def scrape_main(url):
                 'unscrapable' : True,
                 'googleNews' : True
             }
-    else:
-        result = open_url(primary_opener, url)
-        if result.get('unscrapable'):
-            result = open_url(backup_opener, url)
-        return result
+    return None
+
+def scrape_main(url, fetch_counts=None, fetcher=default_fetcher):
+    special_case_result = scrape_special_cases(url, fetch_counts, fetcher)
+    if special_case_result is not None:
+        return special_case_result
+    result = open_url(fetcher.primary_opener, url, fetch_counts, fetcher)
+    if result.get('unscrapable') and result.get('code') in backup_status_codes:
+        result = open_url(fetcher.backup_opener, url, fetch_counts, fetcher)
+    return result
 
-def scrape(url):
+def scrape(url, fetcher=default_fetcher):
     scrape_time = datetime.datetime.now()
-    result = scrape_main(url)
+    fetch_counts = collections.Counter()
+    result = scrape_main(url, fetch_counts, fetcher)
+    # The number of requests made for each url is recorded so redundant
+    # fetches can be detected.
+    result['fetchCounts'] = [
+        { 'url' : fetched_url, 'count' : count }
+        for fetched_url, count in fetch_counts.items()]
     result['scrapeDate'] = scrape_time
     result['scraperVersion'] = __version__
     return result
@@ -0,0 +1,100 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import unittest
+import threading
+import time
+import BaseHTTPServer
+import SocketServer
+import scraper
+import fetcher
+
+class LocalHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves pages over keep-alive connections and records the connections
+    used and the most requests that were in progress at once.
+    """
+    protocol_version = 'HTTP/1.1'
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.connections.add(self.client_address)
+            server.in_progress += 1
+            server.max_in_progress = max(server.max_in_progress, server.in_progress)
+        try:
+            if self.path == '/redirect':
+                self.send_response(302)
+                self.send_header('Location', '/redirect_2')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            elif self.path == '/redirect_2':
+                self.send_response(301)
+                self.send_header('Location', '/page/redirected')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            elif self.path == '/forbidden':
+                self.send_response(403)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            elif self.path.startswith('/page'):
+                time.sleep(0.02)
+                body = "<html><body><p>Content of %s</p></body></html>" % self.path
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+        finally:
+            with server.lock:
+                server.in_progress -= 1
+    def log_message(self, *args):
+        pass
+
+class LocalServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class TestFetcher(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalServer(('127.0.0.1', 0), LocalHandler)
+        self.server.lock = threading.Lock()
+        self.server.connections = set()
+        self.server.in_progress = 0
+        self.server.max_in_progress = 0
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_port
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+    def comparable(self, result):
+        result = dict(result)
+        del result['scrapeDate']
+        # Exception descriptions include traceback object addresses.
+        if 'exception' in result:
+            result['exception'] = True
+        return result
+    def test_same_results_as_scrape(self):
+        urls = [self.base_url + path
+            for path in ['/page/1', '/redirect', '/forbidden', '/missing']]
+        results = fetcher.scrape_many(urls, max_workers=4)
+        for url, result in zip(urls, results):
+            self.assertEqual(
+                self.comparable(result),
+                self.comparable(scraper.scrape(url)))
+        self.assertIn('Content of /page/redirected', results[1]['htmlContent'])
+        self.assertEqual(len(results[1]['redirects']), 2)
+    def test_connection_limit(self):
+        urls = [self.base_url + '/page/%d' % i for i in range(20)]
+        my_fetcher = fetcher.PooledFetcher(max_connections_per_host=2)
+        results = fetcher.scrape_many(urls, max_workers=8, fetcher=my_fetcher)
+        my_fetcher.close()
+        self.assertEqual(
+            [result['htmlContent'] for result in results],
+            [u"<html><body><p>Content of /page/%d</p></body></html>" % i
+                for i in range(20)])
+        self.assertLessEqual(self.server.max_in_progress, 2)
+        # Keep-alive connections are reused for multiple requests.
+        self.assertLessEqual(len(self.server.connections), 2)
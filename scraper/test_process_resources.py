@@ -0,0 +1,42 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import unittest
+import codecs
+import process_resources
+
+fixture_dir = os.path.join(os.path.dirname(__file__), "test_data", "articles")
+
+def read_fixture(name):
+    with codecs.open(os.path.join(fixture_dir, name), encoding="utf-8") as f:
+        return f.read()
+
+class TestContentExtractor(unittest.TestCase):
+    def test_cached_result(self):
+        extractor = process_resources.ContentExtractor(cache_size=1)
+        html = read_fixture("article_1.html")
+        result = extractor.extract(html)
+        self.assertEqual(result['method'], 'goose')
+        self.assertTrue(result['content'].startswith(
+            "Health officials confirmed on Tuesday"))
+        self.assertNotIn("Related stories", result['content'])
+        # Modifying a result shouldn't modify the cached copy.
+        result['content'] = ''
+        self.assertEqual(extractor.extract(html)['content'],
+            process_resources.ContentExtractor().extract(html)['content'])
+        self.assertEqual(len(extractor._cache), 1)
+        extractor.extract(read_fixture("article_2.html"))
+        self.assertEqual(len(extractor._cache), 1)
+    def test_fast_path(self):
+        extractor = process_resources.ContentExtractor(fast_path=True)
+        result = extractor.extract(read_fixture("article_1.html"))
+        self.assertEqual(result['method'], 'readability')
+        self.assertIsInstance(result['content'], unicode)
+        self.assertIn(
+            "tested positive for Vibrio cholerae.\n\nTeams from the ministry",
+            result['content'])
+        self.assertNotIn("Related stories", result['content'])
+        result = extractor.extract(read_fixture("article_3.html"))
+        self.assertEqual(result['method'], 'readability')
+        self.assertIn(u"fumigaci\xf3n", result['content'])
+        # Lists of links are not clean enough for the fast path.
+        result = extractor.extract(read_fixture("article_2.html"))
+        self.assertNotEqual(result['method'], 'readability')
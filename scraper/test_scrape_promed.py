@@ -0,0 +1,34 @@
+# coding=utf8
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import unittest
+import codecs
+import scrape_promed
+
+fixture_dir = os.path.join(os.path.dirname(__file__), "test_data", "promed")
+
+class TestScrapePromed(unittest.TestCase):
+    def test_formatted_text_golden_output(self):
+        # The .txt files were generated by the previous string concatenation
+        # based formatter and should not change.
+        for name in ["post_1", "post_2", "post_3"]:
+            with codecs.open(os.path.join(fixture_dir, name + ".html"), encoding="utf-8") as f:
+                html = f.read()
+            with codecs.open(os.path.join(fixture_dir, name + ".txt"), encoding="utf-8") as f:
+                expected = f.read()
+            self.assertEqual(
+                scrape_promed.promed_html_to_formatted_text(html), expected, name)
+
+    def test_formatted_text_whitespace(self):
+        self.assertEqual(
+            scrape_promed.promed_html_to_formatted_text(
+                u"<p>a  \xa0b   <br/>   c</p><span> d </span><br>"),
+            u"a b\nc\n\nd")
+        self.assertEqual(
+            scrape_promed.promed_html_to_formatted_text(u"<br><br>"), u"")
+
+    def test_subject_line_labels(self):
+        subject = scrape_promed.parse_subject_line(
+            "PRO/AH/EDR> Avian influenza H7N9 & Legionnaires' (03): China")
+        self.assertIn("Avian Influenza H7N9", subject["diseaseLabels"])
+        self.assertIn("Avian Influenza", subject["diseaseLabels"])
+        self.assertIn("Influenza", subject["diseaseLabels"])
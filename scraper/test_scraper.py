@@ -1,9 +1,12 @@
 # coding=utf8
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 import unittest
 import scraper
 import process_resources
 import logging
 import translation
+import threading
+import BaseHTTPServer
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('scraper')
 logger.setLevel(logging.INFO)
@@ -43,15 +46,14 @@ class TestScraper(unittest.TestCase):
         self.assertTrue(len(process_resources.extract_clean_content(result['htmlContent'])['content']) > 1)
     def test_english_detection(self):
         from translation import Translator
-        my_translator = Translator(None)
+        my_translator = Translator()
         result = scraper.scrape("http://news.google.com/news/url?sa=t&fd=R&usg=AFQjCNFY1KzEAhaiZchzd5ulmoY4_4P8kA&url=http://vov.vn/Van-hoa/NSND-Thanh-Hoa-xuc-dong-hat-truoc-benh-nhan/228256.vov")
         self.assertFalse(result.get('unscrapable'))
         text_obj = process_resources.extract_clean_content(result['htmlContent'])
         self.assertFalse(my_translator.is_english(text_obj['content']))
     def test_english_translation(self):
-        import config
         from translation import Translator
-        my_translator = Translator(config)
+        my_translator = Translator()
         result = scraper.scrape("http://peninsulardigital.com/municipios/comondu/refuerzan-acciones-contra-el-dengue/155929")
         text_obj = process_resources.extract_clean_content(result['htmlContent'])
         translation_obj = my_translator.translate_to_english(text_obj['content'])
@@ -71,9 +73,115 @@ class TestScraper(unittest.TestCase):
         result = scraper.scrape(
             "http://apps.who.int/iris/bitstream/10665/136645/1/roadmapupdate17Oct14_eng.pdf?ua=1")
     def test_english_detection(self):
-        import config
         from translation import Translator
-        my_translator = Translator(config)
+        my_translator = Translator()
         self.assertFalse(my_translator.is_english("""
         Bệnh viêm não năm nay đã xuất hiện nhiều dấu hiệu bất thường...
-        """))
\ No newline at end of file
+        """))
+class LocalHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves /redirect as a redirect to /page and /forbidden as a 403.
+    Requested paths are recorded on the server.
+    """
+    encoded_pages = {
+        '/latin1_header' : (
+            'text/html; charset=ISO-8859-1',
+            u"<html><body><p>Caf\xe9</p></body></html>".encode('latin-1')),
+        '/cp1251_meta' : (
+            'text/html',
+            u'<html><head><meta charset="windows-1251"></head>'
+            u'<body><p>\u041f\u0440\u0438\u0432\u0435\u0442</p></body></html>'.encode('cp1251')),
+        '/utf8_detected' : (
+            'text/html',
+            (u"<html><body><p>%s</p></body></html>" %
+                (u"\u65b0\u578b\u51a0\u72b6\u75c5\u6bd2" * 50)).encode('utf-8'))
+    }
+    def do_GET(self):
+        self.server.requested_paths.append(self.path)
+        if self.path in self.encoded_pages:
+            content_type, body = self.encoded_pages[self.path]
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == '/large':
+            # No Content-Length is sent, so the body ends when the
+            # connection is closed.
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.end_headers()
+            for i in range(100):
+                self.wfile.write("<p>" + "x" * 1000 + "</p>")
+        elif self.path == '/oversized':
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(10 ** 9))
+            self.end_headers()
+        elif self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/page')
+            self.end_headers()
+        elif self.path == '/forbidden':
+            self.send_response(403)
+            self.end_headers()
+        else:
+            body = "<html><body><p>Page content</p></body></html>"
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    def log_message(self, *args):
+        pass
+
+class TestLocalScraper(unittest.TestCase):
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), LocalHandler)
+        self.server.requested_paths = []
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_port
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+    def test_redirect_fetched_once(self):
+        result = scraper.scrape(self.base_url + '/redirect')
+        self.assertFalse(result.get('unscrapable'))
+        self.assertIn('Page content', result['htmlContent'])
+        self.assertEqual(result['sourceUrl'], self.base_url + '/redirect')
+        self.assertEqual(result['url'], self.base_url + '/page')
+        self.assertEqual(self.server.requested_paths, ['/redirect', '/page'])
+        self.assertEqual(result['fetchCounts'], [
+            { 'url' : self.base_url + '/redirect', 'count' : 1 }])
+    def test_backup_opener_on_forbidden(self):
+        result = scraper.scrape(self.base_url + '/forbidden')
+        self.assertTrue(result.get('unscrapable'))
+        self.assertEqual(result['code'], 403)
+        self.assertEqual(self.server.requested_paths, ['/forbidden'] * 2)
+        self.assertEqual(result['fetchCounts'], [
+            { 'url' : self.base_url + '/forbidden', 'count' : 2 }])
+    def test_detect_encoding(self):
+        for path, encoding, source in [
+            ('/latin1_header', 'iso-8859-1', 'header'),
+            ('/cp1251_meta', 'windows-1251', 'meta'),
+            ('/utf8_detected', 'utf-8', 'detected')]:
+            result = scraper.scrape(self.base_url + path)
+            self.assertEqual(result['encoding'], encoding)
+            self.assertEqual(result['encodingSource'], source)
+            self.assertEqual(
+                result['htmlContent'],
+                LocalHandler.encoded_pages[path][1].decode(encoding))
+    def test_size_limit(self):
+        my_fetcher = scraper.DefaultFetcher()
+        my_fetcher.max_body_bytes = 50000
+        result = scraper.scrape(self.base_url + '/large', my_fetcher)
+        self.assertTrue(result['truncated'])
+        self.assertFalse(result.get('unscrapable'))
+        self.assertEqual(len(result['htmlContent']), 50000)
+        result = scraper.scrape(self.base_url + '/oversized', my_fetcher)
+        self.assertTrue(result['oversized'])
+        self.assertTrue(result['unscrapable'])
+        self.assertNotIn('htmlContent', result)
+        result = scraper.scrape(self.base_url + '/page', my_fetcher)
+        self.assertNotIn('truncated', result)
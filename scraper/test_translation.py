@@ -0,0 +1,118 @@
+import os, sys; sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import unittest
+import codecs
+import json
+import threading
+import BaseHTTPServer
+import SocketServer
+import translation
+from diagnosis_cache import DiagnosisCache, LRUCacheBackend
+
+class MockTranslationHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Responds like the Microsoft translation API by upper casing each text.
+    The request bodies are recorded on the server.
+    """
+    protocol_version = 'HTTP/1.1'
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            self.server.requests.append(request)
+        body = json.dumps([
+            { 'translations' : [{ 'text' : item['Text'].upper(), 'to' : 'en' }] }
+            for item in request])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def log_message(self, *args):
+        pass
+
+class MockServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class TestTranslation(unittest.TestCase):
+    def setUp(self):
+        self.server = MockServer(('127.0.0.1', 0), MockTranslationHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.original_key = os.environ.get('MS_TRANSLATE_KEY')
+        os.environ['MS_TRANSLATE_KEY'] = 'test'
+        self.translator = translation.Translator(
+            cache=DiagnosisCache(LRUCacheBackend(), {}),
+            ms_url='http://127.0.0.1:%d/translate' % self.server.server_port)
+    def tearDown(self):
+        self.translator.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        if self.original_key is None:
+            del os.environ['MS_TRANSLATE_KEY']
+        else:
+            os.environ['MS_TRANSLATE_KEY'] = self.original_key
+    def test_batched_translation(self):
+        content = u"el brote de c\xf3lera en la regi\xf3n " * 1000
+        result = self.translator.translate_to_english(content)
+        self.assertNotIn('error', result)
+        self.assertEqual(result['translationService'], 'MS')
+        self.assertEqual(result['content'], content.upper())
+        # The 34000 characters of content are split into sections of up to
+        # 5000 characters which are sent two at a time.
+        sections = [item['Text'] for request in self.server.requests
+            for item in request]
+        self.assertEqual(len(sections), 7)
+        self.assertEqual(len(self.server.requests), 4)
+        for request in self.server.requests:
+            self.assertLessEqual(sum(len(item['Text']) for item in request),
+                translation.Translator.ms_max_request_chars)
+    def test_cached_translation(self):
+        content = u"el brote de c\xf3lera en la regi\xf3n"
+        first_result = self.translator.translate_to_english(content)
+        second_result = self.translator.translate_to_english(content)
+        third_result = self.translator.translate_to_english(content)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(first_result, second_result)
+        self.assertEqual(first_result, third_result)
+        self.translator.translate_to_english(content + u" norte")
+        self.assertEqual(len(self.server.requests), 2)
+
+class TestLanguageDetection(unittest.TestCase):
+    def test_labeled_sample(self):
+        sample_path = os.path.join(
+            os.path.dirname(__file__), "test_data", "language_sample.ndjson")
+        with codecs.open(sample_path, encoding="utf-8") as f:
+            for line in f:
+                sample = json.loads(line)
+                language, confidence = translation.detect_language(sample['text'])
+                if sample['language'] not in translation.language_common_words and\
+                    sample['language'] not in dict(translation.script_languages):
+                    # Languages the detector doesn't know are only used
+                    # to check that they aren't mistaken for English.
+                    continue
+                self.assertEqual(language, sample['language'], sample['text'])
+                self.assertGreater(confidence, 0.5)
+    def test_labeled_sample_english(self):
+        translator = translation.Translator()
+        sample_path = os.path.join(
+            os.path.dirname(__file__), "test_data", "language_sample.ndjson")
+        with codecs.open(sample_path, encoding="utf-8") as f:
+            for line in f:
+                sample = json.loads(line)
+                self.assertEqual(translator.is_english(sample['text']),
+                    sample['language'] == 'en', sample['text'])
+    def test_undetermined(self):
+        self.assertEqual(translation.detect_language(u""), ('und', 0.0))
+        self.assertEqual(translation.detect_language(u"12345 !!!"), ('und', 0.0))
+    def test_is_english(self):
+        translator = translation.Translator()
+        self.assertTrue(translator.is_english(
+            "The outbreak has sickened 87 people in the district."))
+        self.assertFalse(translator.is_english(
+            u"Las autoridades informaron que se reforzaron las acciones."))
+        # Tagalog shares a few common words with English.
+        self.assertFalse(translator.is_english(
+            u"Ang Kagawaran ng Kalusugan ay nag-ulat ng 120 kaso ng dengue "
+            u"sa Cebu, at may 3 namatay sa mga bata."))
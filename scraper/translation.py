@@ -5,6 +5,8 @@ text to english using a translation service.
 import re
 import os
 import datetime
+import dateutil.parser
+from concurrent import futures
 from googleapiclient.errors import Error as GoogleAPIError
 from googleapiclient.discovery import build
 import requests
@@ -107,30 +109,170 @@ most_common_english_words = [
 'most',
 'us']
 
-common_english_re = re.compile('\\b(' + '|'.join(most_common_english_words) + ')\\b', re.I)
+# Common words in other languages. Words that are shared with other
+# languages are fine to include since every language they belong to is
+# counted, but the most distinctive words decide the language.
+language_common_words = {
+    'en' : [word.lower() for word in most_common_english_words],
+    'es' : u"""
+        de la que el en y a los se del las un por con no una su para es al lo
+        como m\xe1s pero sus le ha me si sin sobre este ya entre cuando todo
+        esta ser son dos tambi\xe9n fue hab\xeda era muy a\xf1os hasta desde
+        est\xe1 porque qu\xe9 han hay vez puede todos as\xed nos ni parte
+        tiene \xe9l uno donde bien tiempo mismo ese ahora cada otro
+        despu\xe9s otros aunque esa eso hace otra durante siempre d\xeda
+        tanto ella tres dijo sido gran pa\xeds seg\xfan menos casos
+        """.split(),
+    'pt' : u"""
+        de a o que e do da em um para \xe9 com n\xe3o uma os no se na por
+        mais as dos como mas foi ao ele das tem \xe0 seu sua ou ser quando
+        muito h\xe1 nos j\xe1 est\xe1 eu tamb\xe9m s\xf3 pelo pela at\xe9
+        isso ela entre era depois sem mesmo aos ter seus quem nas esse eles
+        est\xe3o voc\xea essa num nem suas meu \xe0s minha numa pelos
+        elas havia seja qual ser\xe1 n\xf3s lhe deles essas esses pelas
+        este dele casos
+        """.split(),
+    'fr' : u"""
+        le de un \xeatre et \xe0 il avoir ne je son que se qui ce dans en
+        du elle au pour pas sur on avec tout plus par la les des est une
+        sont ont \xe9t\xe9 aux cette mais ou comme nous vous leur ces ses
+        \xe9tait lui m\xeame o\xf9 sans aussi entre tr\xe8s fait cas
+        """.split(),
+    'de' : u"""
+        der die und in den von zu das mit sich des auf f\xfcr ist im dem
+        nicht ein eine als auch es an werden aus er hat dass sie nach wird
+        bei einer um am sind noch wie einem \xfcber einen so zum war haben
+        nur oder aber vor zur bis mehr durch man sein wurde sei
+        """.split(),
+    'it' : u"""
+        di e il la che \xe8 per un in del non una sono le con si da al dei
+        della lo gli ha nel alla pi\xf9 anche ma come questo delle io ci su
+        ne se dal degli nella loro sia essere stato tra questa cui molto
+        casi
+        """.split(),
+    'id' : u"""
+        yang dan di ini itu dengan untuk tidak dari dalam akan pada juga
+        saya ke karena tersebut bisa ada mereka lebih kami sudah telah oleh
+        atau seperti jika hanya kasus
+        """.split(),
+    'vi' : u"""
+        c\xe1c c\u1ee7a v\xe0 l\xe0 \u0111\u01b0\u1ee3c c\xf3 trong cho
+        kh\xf4ng ng\u01b0\u1eddi nh\u1eefng n\xe0y v\u1edbi m\u1ed9t
+        \u0111\xe3 \u0111\u1ebfn khi c\u0169ng v\u1ec1 nh\u01b0 t\u1eeb
+        th\xec ra sau nhi\u1ec1u n\u0103m nay b\u1ec7nh
+        """.split()
+}
+
+# Maps each common word to the languages it is common in.
+common_word_languages = {}
+for language, words in language_common_words.items():
+    for word in words:
+        common_word_languages.setdefault(word, set()).add(language)
+
+# Languages that can be identified by the script they are written in.
+# Japanese is checked before Chinese since it also uses Chinese characters.
+script_languages = [
+    ('ja', re.compile(u'[\u3040-\u30ff]')),
+    ('zh', re.compile(u'[\u4e00-\u9fff]')),
+    ('ko', re.compile(u'[\uac00-\ud7af]')),
+    ('ru', re.compile(u'[\u0400-\u04ff]')),
+    ('ar', re.compile(u'[\u0600-\u06ff]')),
+    ('he', re.compile(u'[\u0590-\u05ff]')),
+    ('el', re.compile(u'[\u0370-\u03ff]')),
+    ('th', re.compile(u'[\u0e00-\u0e7f]')),
+    ('hi', re.compile(u'[\u0900-\u097f]'))
+]
+non_latin_re = re.compile(
+    u'[' + u''.join(regex.pattern[1:-1] for code, regex in script_languages) + u']')
+word_re = re.compile(r'[^\W\d_]+', re.U)
+
+def common_word_ratio(text, language, max_chars=10000):
+    """
+    Return the fraction of the words in the first max_chars characters of
+    the text that are common words in the given language.
+    """
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    words = word_re.findall(text[:max_chars].lower())
+    if len(words) == 0:
+        return 0.0
+    return float(sum(1 for word in words
+        if language in common_word_languages.get(word, ()))) / len(words)
+
+def detect_language(text, max_chars=10000):
+    """
+    Guess the language of the text from the first max_chars characters.
+    Languages with non-latin scripts are identified by their script,
+    otherwise the language whose common words appear most often is used.
+    Returns an ISO 639-1 code, or "und" if no language could be determined,
+    and a confidence between 0 and 1.
+    """
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    text = text[:max_chars]
+    words = word_re.findall(text.lower())
+    word_chars = sum(len(word) for word in words)
+    non_latin_chars = len(non_latin_re.findall(text))
+    if word_chars > 0 and non_latin_chars > word_chars / 2:
+        # Most words are written in a non-latin script.
+        # Characters in these scripts are counted individually since
+        # some of them don't separate words with spaces.
+        for code, regex in script_languages:
+            script_chars = len(regex.findall(text))
+            if script_chars > non_latin_chars / 10:
+                return code, min(1.0, float(non_latin_chars) / word_chars)
+    language_counts = {}
+    common_words = 0
+    for word in words:
+        languages = common_word_languages.get(word)
+        if languages:
+            common_words += 1
+            for language in languages:
+                language_counts[language] = language_counts.get(language, 0) + 1
+    if common_words == 0:
+        return 'und', 0.0
+    best_language = max(sorted(language_counts), key=language_counts.get)
+    return best_language, float(language_counts[best_language]) / common_words
 
 translate_key = os.environ.get('GOOGLE_TRANSLATE_KEY')
 
+ms_translate_url = "https://api.cognitive.microsofttranslator.com/translate?api-version=3.0&to=en"
+
 class Translator(object):
-    def __init__(self):
+    """
+    Translations can be cached by passing in a diagnosis_cache.DiagnosisCache
+    or any object with the same make_key/get/set methods.
+    """
+    # Limits on the text sent to the Microsoft translation API
+    ms_max_section_chars = 5000
+    ms_max_request_chars = 10000
+    ms_max_request_sections = 100
+
+    def __init__(self, cache=None, ms_url=ms_translate_url, max_workers=4):
         self.consecutive_exceptions = 0
+        self.cache = cache
+        self.ms_url = ms_url
+        self.max_workers = max_workers
+        # Reusing a session keeps the connection to the API open.
+        self.session = requests.Session()
         if translate_key:
             self.t_service = build('translate', 'v2', developerKey=translate_key)
 
+    def detect_language(self, text):
+        return detect_language(text)
+
+    # Languages without common word lists, like Tagalog, can share a few
+    # short words with English, e.g. "at" and "may", so English is only
+    # detected when a substantial fraction of the words are common English
+    # words and few of them are common in other languages.
+    english_min_common_word_ratio = 0.15
+    english_min_confidence = 0.6
+
     def is_english(self, text):
-        unique_matches = set()
-        total_matches = 0
-        required_unique_matches = min(5, len(text) / 100)
-        required_matches = len(text) / 100
-        for match in common_english_re.finditer(text):
-            total_matches += 1
-            if match.group(0) in unique_matches:
-                continue
-            else:
-                unique_matches.add(match.group(0))
-            if len(unique_matches) > required_unique_matches and total_matches > required_matches:
-                return True
-        return False
+        language, confidence = detect_language(text)
+        return (language == 'en' and
+            confidence >= self.english_min_confidence and
+            common_word_ratio(text, 'en') >= self.english_min_common_word_ratio)
 
     def translate_to_english_google(self, content):
         if not translate_key:
@@ -184,19 +326,40 @@ class Translator(object):
                 'error' : 'Translation has been temporarily disabled due to errors when attempting to access the tranlation service.'
             }
         try:
-            full_text = ""
-            url = "https://api.cognitive.microsofttranslator.com/translate?api-version=3.0&to=en"
-            # Break text into 5000 character chunks to stay under api limit
-            for section, noop in re.findall(r"(.{1,5000}(\s|$))", content, re.M | re.DOTALL):
-                response = requests.post(url, headers={
+            # Break text into sections to stay under the api limit,
+            # then send as many sections as the api allows in each request.
+            sections = [section for section, noop in re.findall(
+                r"(.{1,%d}(\s|$))" % self.ms_max_section_chars,
+                content, re.M | re.DOTALL)]
+            batches = []
+            batch_chars = 0
+            for section in sections:
+                if (len(batches) == 0 or
+                    batch_chars + len(section) > self.ms_max_request_chars or
+                    len(batches[-1]) >= self.ms_max_request_sections):
+                    batches.append([])
+                    batch_chars = 0
+                batches[-1].append(section)
+                batch_chars += len(section)
+            def translate_batch(batch):
+                response = self.session.post(self.ms_url, headers={
                     "Ocp-Apim-Subscription-Key": ms_translate_key,
                     "Content-type": "application/json",
                 }, json=[{
                     "Text" : section.encode("utf-8"),
-                }])
-                resp_json = response.json()
-                resp_text = resp_json[0]["translations"][0]["text"]
-                full_text += resp_text
+                } for section in batch])
+                response.raise_for_status()
+                return [item["translations"][0]["text"]
+                    for item in response.json()]
+            if len(batches) > 1:
+                with futures.ThreadPoolExecutor(
+                    max_workers=min(self.max_workers, len(batches))) as executor:
+                    translated_batches = list(
+                        executor.map(translate_batch, batches))
+            else:
+                translated_batches = map(translate_batch, batches)
+            full_text = "".join(
+                text for batch in translated_batches for text in batch)
             self.consecutive_exceptions = 0
             return {
                 'content' : full_text,
@@ -211,5 +374,26 @@ class Translator(object):
                 'consecutive_exceptions' : self.consecutive_exceptions
             }
 
+    def cached_translation(self, service, content, translate):
+        """
+        Return the cached translation of the content by the given service
+        or translate it and cache the result if it is successful.
+        """
+        if self.cache is None:
+            return translate(content)
+        key = self.cache.make_key('translation', content, { 'service' : service })
+        cached = self.cache.get(key)
+        if cached is not None:
+            # A copy is made so the cached entry is not modified.
+            cached = dict(cached)
+            cached['translationDate'] = dateutil.parser.parse(
+                cached['translationDate'])
+            return cached
+        result = translate(content)
+        if 'error' not in result:
+            self.cache.set(key, dict(result,
+                translationDate=result['translationDate'].isoformat()))
+        return result
+
     def translate_to_english(self, content):
-        return self.translate_to_english_ms(content)
+        return self.cached_translation('MS', content, self.translate_to_english_ms)
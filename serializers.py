@@ -0,0 +1,91 @@
+"""
+Celery serializers that are more compact and faster than pickle for the
+task arguments and results, which are mostly JSON compatible documents.
+
+    json-zlib: JSON
+    msgpack-zlib: MessagePack (requires the msgpack package)
+
+Payloads larger than compression_threshold bytes, such as scraped html,
+are compressed with zlib. The first byte of each payload says whether it
+is compressed. Datetimes, which are passed in the diagnose task arguments,
+are encoded as { "__datetime__": "<ISO 8601 date>" } objects.
+"""
+import datetime
+import json
+import zlib
+import dateutil.parser
+from kombu.serialization import registry
+
+compression_threshold = 4096
+compression_level = 1
+
+COMPRESSED = 'z'
+UNCOMPRESSED = 'r'
+
+
+def encode_datetime(obj):
+    if isinstance(obj, datetime.datetime):
+        return { '__datetime__': obj.isoformat() }
+    raise TypeError("%r is not serializable" % (obj,))
+
+
+def decode_datetime(obj):
+    if len(obj) == 1 and '__datetime__' in obj:
+        return dateutil.parser.parse(obj['__datetime__'])
+    return obj
+
+
+def compress(data):
+    if len(data) >= compression_threshold:
+        return COMPRESSED + zlib.compress(data, compression_level)
+    return UNCOMPRESSED + data
+
+
+def decompress(data):
+    if data[:1] == COMPRESSED:
+        return zlib.decompress(data[1:])
+    elif data[:1] == UNCOMPRESSED:
+        return data[1:]
+    raise ValueError("Unknown payload format")
+
+
+def json_dumps(obj):
+    return compress(json.dumps(
+        obj, default=encode_datetime, separators=(',', ':')))
+
+
+def json_loads(data):
+    return json.loads(decompress(data), object_hook=decode_datetime)
+
+
+def msgpack_dumps(obj):
+    import msgpack
+    return compress(msgpack.packb(obj, default=encode_datetime, use_bin_type=True))
+
+
+def msgpack_loads(data):
+    import msgpack
+    return msgpack.unpackb(
+        decompress(data), object_hook=decode_datetime, raw=False)
+
+
+serializers = {
+    'json-zlib': (json_dumps, json_loads, 'application/x-grits-json-zlib'),
+    'msgpack-zlib': (msgpack_dumps, msgpack_loads, 'application/x-grits-msgpack-zlib')
+}
+
+
+def register(name):
+    """
+    Register the named serializer with kombu so celery can use it.
+    The built in serializers, like pickle, don't need to be registered.
+    """
+    if name not in serializers:
+        return name
+    if name == 'msgpack-zlib':
+        # Fail at startup rather than on the first task if msgpack is missing.
+        import msgpack
+    dumps, loads, content_type = serializers[name]
+    registry.register(name, dumps, loads,
+        content_type=content_type, content_encoding='binary')
+    return name
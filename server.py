@@ -5,6 +5,7 @@ import config
 import celery
 import tasks_diagnose
 import tasks_preprocess
+from tasks_preprocess import make_json_compat
 
 import datetime
 
@@ -20,16 +21,103 @@ import time
 import random
 import json
 import dateutil.parser
-from diagnosis.Diagnoser import Diagnoser
+from diagnosis.Diagnoser import Diagnoser, required_tiers
 import epitator
 from epitator.database_interface import DatabaseInterface
+from result_watcher import ResultWatcher
+from diagnosis_cache import cache_from_config
+import metrics
+import celery_metrics
 
 
 epitator_db_interface = DatabaseInterface()
 
 API_VERSION = "1.2.0"
 
-def on_task_complete(task, callback):
+result_watcher = ResultWatcher()
+
+# The in-process LRU cache is used unless a different backend is configured.
+diagnosis_cache = cache_from_config(
+    getattr(config, 'diagnosis_cache', { 'backend': 'lru' }),
+    {
+        'Diagnoser': Diagnoser.__version__,
+        'EpiTator': epitator.__version__
+    })
+
+# The diagnose task returns the duration of each stage of the diagnosis.
+diagnosis_stage_seconds = metrics.Histogram(
+    'grits_diagnosis_stage_seconds',
+    'Time spent in each stage of Diagnoser.diagnose',
+    ['stage'])
+
+request_seconds = metrics.Histogram(
+    'grits_http_request_seconds',
+    'Time to respond to HTTP requests by route and status code',
+    ['route', 'method', 'status'])
+
+requests_in_flight = metrics.Gauge(
+    'grits_http_requests_in_flight',
+    'HTTP requests that have been received but not finished',
+    ['route'])
+
+pending_tasks = metrics.Gauge(
+    'grits_pending_tasks',
+    'Celery tasks the server is waiting for')
+
+ready_diagnoser_processes = metrics.Gauge(
+    'grits_ready_diagnoser_processes',
+    'Worker processes that have loaded and warmed up the diagnoser')
+
+class DiagnoserReadiness(object):
+    """
+    Caches the records of the worker processes that have loaded the
+    diagnoser so the collection is read at most once per max_age seconds.
+    """
+    def __init__(self, max_age=5):
+        self.max_age = max_age
+        self.updated = 0
+        self.processes = []
+    def ready_processes(self):
+        if time.time() - self.updated > self.max_age:
+            try:
+                self.processes = celery_metrics.ready_processes()
+            except Exception as e:
+                print "Could not read diagnoser readiness:", e
+            self.updated = time.time()
+        return self.processes
+
+diagnoser_readiness = DiagnoserReadiness()
+
+def parse_features(features):
+    """
+    Parse the features parameter, which is a comma separated string
+    or a list of feature names. None is returned if it is empty.
+    A ValueError is raised for unknown features.
+    """
+    if not features:
+        return None
+    if isinstance(features, basestring):
+        features = features.split(',')
+    # The features are sorted so equivalent requests have the same cache key.
+    features = sorted(set(feature.strip() for feature in features))
+    required_tiers(features)
+    return features
+
+def parse_bool(val):
+    """
+    Parse a boolean parameter that may be a boolean or a true/false string.
+    A ValueError is raised for other values.
+    """
+    if isinstance(val, bool):
+        return val
+    if isinstance(val, basestring):
+        if val.lower() == "true":
+            return True
+        elif val.lower() == "false":
+            return False
+    raise ValueError("Could not parse boolean: %r" % (val,))
+
+def on_task_complete(task, callback, label='default'):
     # if the task is a celery group with subtasks add them to the result set
     if hasattr(task, 'subtasks'):
         res_set = celery.result.ResultSet(task.subtasks)
@@ -42,26 +130,39 @@ def on_task_complete(task, callback):
             task_ptr = task_ptr.parent
             res_set.add(task_ptr)
 
-    def check_celery_task():
-        if res_set.ready() or res_set.failed():
-            try:
-                resp = task.get()
-            except Exception as e:
-                # When the debug parameter is passed in raise exceptions
-                # instead of returning the error message.
-                if 'args' in globals() and args.debug:
-                    raise e
-                # There is a bug in celery where exceptions are not properly marshaled
-                # so the message is always "exceptions must be old-style classes or derived from BaseException, not dict"
-                return callback(e, None)
-            return callback(None, resp)
-        else:
-            tornado.ioloop.IOLoop.instance().add_timeout(
-                datetime.timedelta(0,1), check_celery_task
-            )
-    check_celery_task()
+    def on_ready():
+        try:
+            resp = task.get()
+        except Exception as e:
+            # When the debug parameter is passed in raise exceptions
+            # instead of returning the error message.
+            if 'args' in globals() and args.debug:
+                raise e
+            # There is a bug in celery where exceptions are not properly marshaled
+            # so the message is always "exceptions must be old-style classes or derived from BaseException, not dict"
+            return callback(e, None)
+        return callback(None, resp)
+    result_watcher.watch(res_set, on_ready, label)
+
+class InstrumentedHandler(tornado.web.RequestHandler):
+    """
+    Records the latency and the number of in-flight requests for the route
+    the handler is registered under.
+    """
+    _in_flight = False
+    @property
+    def route(self):
+        return route_patterns.get(type(self), 'unknown')
+    def prepare(self):
+        self._in_flight = True
+        requests_in_flight.inc(self.route)
+    def on_finish(self):
+        if self._in_flight:
+            requests_in_flight.dec(self.route)
+        request_seconds.observe(self.request.request_time(),
+            self.route, self.request.method, str(self.get_status()))
 
-class DiagnoseHandler(tornado.web.RequestHandler):
+class DiagnoseHandler(InstrumentedHandler):
     public = False
     @tornado.web.asynchronous
     def get(self):
@@ -72,16 +173,7 @@ class DiagnoseHandler(tornado.web.RequestHandler):
         except ValueError as e:
             params = {}
         def get_bool_arg(key, default=False):
-            val = self.get_argument(key, params.get(key, default))
-            if isinstance(val, basestring):
-                if val.lower() == "true":
-                    return True
-                elif val.lower() == "false":
-                    return False
-                else:
-                    raise ValueError("Could not parse ", val)
-            else:
-                return val
+            return parse_bool(self.get_argument(key, params.get(key, default)))
         # If the byte offsets from the response are used for things like
         # highlights, the default get_argument behavior of stripping the content
         # will cause misalignment.
@@ -100,8 +192,65 @@ class DiagnoseHandler(tornado.web.RequestHandler):
                 self.finish()
                 return
         is_priority = get_bool_arg('priority', True)
+        if (getattr(config, 'require_ready_diagnoser', False) and
+            len(diagnoser_readiness.ready_processes()) == 0):
+            # Tasks sent while every worker is loading would wait in the
+            # queue and could expire, so the client is asked to retry.
+            self.set_status(503)
+            self.set_header("Retry-After", "30")
+            self.set_header("Content-Type", "application/json")
+            self.write({
+                'error' : "No diagnoser workers are ready."
+            })
+            self.finish()
+            return
         extra_args['use_infection_annotator'] = get_bool_arg('use_infection_annotator', True)
         extra_args['include_incidents'] = get_bool_arg('include_incidents', False)
+        try:
+            features = parse_features(
+                self.get_argument('features', params.get('features')))
+        except ValueError as e:
+            self.set_status(400)
+            self.write({
+                'error' : str(e)
+            })
+            self.set_header("Content-Type", "application/json")
+            self.finish()
+            return
+        if features:
+            # Only the tiers needed for these features are annotated.
+            extra_args['features'] = features
+        # The scraped html is only passed through the chain and returned with
+        # the source content when the server is run with the -debug flag.
+        return_html = (get_bool_arg('returnSourceContent') and
+            'args' in globals() and args.debug)
+        def write_response(resp, source_clean_content=None, timings=None,
+            scraped_data=None):
+            # A copy is made so cached results are not modified.
+            resp = dict(resp)
+            if source_clean_content and get_bool_arg('returnSourceContent'):
+                resp['source'] = {
+                    'cleanContent': source_clean_content
+                }
+                if scraped_data and return_html:
+                    resp['source']['scrapedData'] = scraped_data
+            if timings and get_bool_arg('timings'):
+                resp['timings'] = timings
+            self.set_header("Content-Type", "application/json")
+            self.write(resp)
+            self.finish()
+        cache_key = None
+        if diagnosis_cache:
+            if content:
+                # Submitted content is not cleaned, so it can be used as the
+                # cleaned content for the cache key.
+                cache_key = diagnosis_cache.make_key('content', content, extra_args)
+            elif url:
+                cache_key = diagnosis_cache.make_key('url', url, extra_args)
+            cached = diagnosis_cache.get(cache_key) if cache_key else None
+            if cached:
+                write_response(cached['result'], cached['source'])
+                return
         if content:
             task = celery.chain(
                 tasks_preprocess.process_text.s({
@@ -131,7 +280,8 @@ class DiagnoseHandler(tornado.web.RequestHandler):
 
             task = celery.chain(
                 tasks_preprocess.scrape.s(url).set(queue='priority' if is_priority else 'process'),
-                tasks_preprocess.process_text.s().set(queue='priority' if is_priority else 'process'),
+                tasks_preprocess.process_text.s(keep_html=return_html).set(
+                    queue='priority' if is_priority else 'process'),
                 tasks_diagnose.diagnose.s(extra_args).set(
                     queue='priority' if is_priority else 'diagnose',
                     expires=70))()
@@ -145,25 +295,37 @@ class DiagnoseHandler(tornado.web.RequestHandler):
 
         def callback(err, resp):
             if err:
-                resp = {
+                return write_response({
                     'error': repr(err)
-                }
+                })
+            # Timings are recorded for every diagnosis but only returned
+            # when they are requested, and they are not cached.
+            timings = resp.pop('timings', None)
+            if timings:
+                for stage, seconds in timings.items():
+                    diagnosis_stage_seconds.observe(seconds, stage)
+            # The parent task returns the processed text.
+            source = task.parent.get()
+            if source.get('englishTranslation', {}).get('content'):
+                source_clean_content = source['englishTranslation']
             else:
-                if get_bool_arg('returnSourceContent'):
-                    # The parent task returns the processed text.
-                    source = task.parent.get()
-                    if source.get('englishTranslation', {}).get('content'):
-                        resp['source'] = {
-                            'cleanContent': source['englishTranslation']
-                        }
-                    else:
-                        resp['source'] = {
-                            'cleanContent': source['cleanContent']
-                        }
-            self.set_header("Content-Type", "application/json")
-            self.write(resp)
-            self.finish()
-        on_task_complete(task, callback)
+                source_clean_content = source.get('cleanContent')
+            if diagnosis_cache and 'error' not in resp:
+                cached = {
+                    'result': resp,
+                    'source': source_clean_content
+                }
+                diagnosis_cache.set(cache_key, cached)
+                if url and source_clean_content:
+                    # Cache the result by its cleaned content as well so the
+                    # same article submitted as text or from another url
+                    # is a hit.
+                    diagnosis_cache.set(diagnosis_cache.make_key(
+                        'content', source['cleanContent']['content'], extra_args
+                    ), cached)
+            write_response(resp, source_clean_content, timings,
+                source.get('scrapedData'))
+        on_task_complete(task, callback, 'public_diagnose' if self.public else 'diagnose')
 
     @tornado.web.asynchronous
     def post(self):
@@ -182,7 +344,90 @@ class PublicDiagnoseHandler(DiagnoseHandler):
     def post(self):
         return self.get()
 
-class VersionHandler(tornado.web.RequestHandler):
+class DiagnoseBatchHandler(InstrumentedHandler):
+    """
+    Diagnose several documents with a group of batch tasks that each
+    classify up to tasks_diagnose.batch_chunk_size documents together.
+    The request body is a JSON object with a documents array, e.g.
+    { "documents": [{ "content": "..." }, ...], "diseases_only": true }
+    """
+    MAX_DOCUMENTS = 200
+    @tornado.web.asynchronous
+    def post(self):
+        self.set_header("Content-Type", "application/json")
+        try:
+            params = json.loads(self.request.body)
+        except ValueError:
+            params = None
+        documents = params.get('documents') if isinstance(params, dict) else None
+        if not (isinstance(documents, list) and
+            all(isinstance(document, dict) for document in documents)):
+            self.set_status(400)
+            self.write({
+                'error' : "Please provide a JSON body with a documents array of objects."
+            })
+            self.finish()
+            return
+        if len(documents) > self.MAX_DOCUMENTS:
+            self.set_status(400)
+            self.write({
+                'error' : "At most %s documents can be diagnosed per request." % self.MAX_DOCUMENTS
+            })
+            self.finish()
+            return
+        try:
+            extra_args = {
+                'diseases_only': parse_bool(params.get('diseases_only', False)),
+                'use_infection_annotator': parse_bool(params.get('use_infection_annotator', True)),
+                'include_incidents': parse_bool(params.get('include_incidents', False)),
+            }
+            is_priority = parse_bool(params.get('priority', True))
+        except ValueError as e:
+            self.set_status(400)
+            self.write({
+                'error' : str(e)
+            })
+            self.finish()
+            return
+        try:
+            features = parse_features(params.get('features'))
+        except ValueError as e:
+            self.set_status(400)
+            self.write({
+                'error' : str(e)
+            })
+            self.finish()
+            return
+        if features:
+            extra_args['features'] = features
+        if params.get('content_date'):
+            try:
+                extra_args['content_date'] = dateutil.parser.parse(params['content_date'])
+            except ValueError:
+                self.set_status(400)
+                self.write({
+                    'error' : "Could not parse content date"
+                })
+                self.finish()
+                return
+        task = tasks_diagnose.diagnose_batch_group(
+            [{ 'content': document.get('content') or '' }
+                for document in documents], extra_args,
+            queue='priority' if is_priority else 'diagnose')()
+        def callback(err, resp):
+            if err:
+                resp = {
+                    'error': repr(err)
+                }
+            else:
+                resp = {
+                    'results': tasks_diagnose.combine_batch_results(resp)
+                }
+            self.write(resp)
+            self.finish()
+        on_task_complete(task, callback, 'diagnose_batch')
+
+class VersionHandler(InstrumentedHandler):
     def get(self):
         self.write("\n".join([
             "API:" + API_VERSION,
@@ -192,7 +437,46 @@ class VersionHandler(tornado.web.RequestHandler):
     def post(self):
         return self.get()
 
-class BSVEHandler(tornado.web.RequestHandler):
+class StatsHandler(InstrumentedHandler):
+    def get(self):
+        self.set_header("Content-Type", "application/json")
+        self.write({
+            'pendingTasks': len(result_watcher),
+            'queueToResponse': result_watcher.queue_to_response.summary(),
+            'diagnosisCache': diagnosis_cache.stats() if diagnosis_cache else None,
+            'diagnosisStages': diagnosis_stage_seconds.summary(),
+            'readyDiagnoserProcesses': [
+                make_json_compat(process)
+                for process in diagnoser_readiness.ready_processes()]
+        })
+        self.finish()
+    def post(self):
+        return self.get()
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """
+    Metrics in the Prometheus text format.
+    The celery task metrics are read from the collection the workers
+    record them in.
+    """
+    def get(self):
+        pending_tasks.set(len(result_watcher))
+        ready_diagnoser_processes.set(len(diagnoser_readiness.ready_processes()))
+        output = metrics.render([
+            request_seconds,
+            requests_in_flight,
+            pending_tasks,
+            ready_diagnoser_processes,
+            diagnosis_stage_seconds])
+        try:
+            output += metrics.render(celery_metrics.all_metrics)
+        except Exception as e:
+            print "Could not read celery metrics:", e
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(output)
+        self.finish()
+
+class BSVEHandler(InstrumentedHandler):
     def get(self):
         return self.post()
     @tornado.web.asynchronous
@@ -279,28 +563,26 @@ class BSVEHandler(tornado.web.RequestHandler):
                     else:
                         # Attach a diagnosis to each of the search results
                         # that one was computed for.
-                        for result, diagnosis in zip(search_resp['results'], diagnoses):
+                        for result, diagnosis in zip(search_resp['results'],
+                            tasks_diagnose.combine_batch_results(diagnoses)):
                             result['diagnosis'] = diagnosis
                         self.write(search_resp)
                         self.finish()
-                # Run a task chain that processes then diagnoses a search result
-                # for each result in parallel.
-                task = celery.group(celery.chain(
-                    tasks_preprocess.process_text.s({
+                # Process and diagnose the search results with batch tasks
+                # that run in parallel.
+                task = tasks_diagnose.diagnose_batch_group([{
                         # The article title and content are classified.
                         # Unfortunately, the content returned in most search results in truncated
                         # to only a few sentences long. Links are included as well,
                         # however scraping the original sources would take several minutes.
                         'content': item['data']['Title'] + '\n' + item['data']['Content']
-                    }).set(queue='priority'),
-                    tasks_diagnose.diagnose.s(
-                        # The diseases_only flag tells the diagnoser to only do classification
-                        # (skipping location/date/case-count feature extraction) for speed.
-                        # Classifications only take a fraction of a second.
-                        dict(diseases_only=True)
-                    ).set(queue='priority', expires=70)
-                ) for item in search_resp['results'][0:MAX_DIAGNOSES])()
-                on_task_complete(task, task_finished)
+                    } for item in search_resp['results'][0:MAX_DIAGNOSES]],
+                    # The diseases_only flag tells the diagnoser to only do classification
+                    # (skipping location/date/case-count feature extraction) for speed.
+                    # Classifications only take a fraction of a second.
+                    dict(diseases_only=True),
+                    queue='priority', expires=70)()
+                on_task_complete(task, task_finished, 'search_and_diagnose')
             bsve_search(search_finished)
         elif bsve_path == "/feeds":
             def feeds_cb(resp):
@@ -325,7 +607,7 @@ class BSVEHandler(tornado.web.RequestHandler):
             self.write('Error:\nBad Path')
             self.finish()
 
-class DiseaseOntologyHandler(tornado.web.RequestHandler):
+class DiseaseOntologyHandler(InstrumentedHandler):
     def get(self):
         return self.post()
     def post(self):
@@ -352,13 +634,21 @@ class DiseaseOntologyHandler(tornado.web.RequestHandler):
             self.write('Error:\nBad Path')
             self.finish()
 
-application = tornado.web.Application([
+routes = [
     (r"/version", VersionHandler),
+    (r"/stats", StatsHandler),
+    (r"/metrics", MetricsHandler),
     (r"/diagnose", DiagnoseHandler),
     (r"/public_diagnose", PublicDiagnoseHandler),
+    (r"/diagnose_batch", DiagnoseBatchHandler),
     (r"/bsve/.*", BSVEHandler),
     (r"/disease_ontology/.*", DiseaseOntologyHandler)
-])
+]
+# Requests are labeled by their route pattern rather than their path
+# so the number of label values stays bounded.
+route_patterns = { handler: pattern for pattern, handler in routes }
+
+application = tornado.web.Application(routes)
 
 if __name__ == "__main__":
     print "Starting grits-api server..."
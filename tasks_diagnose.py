@@ -13,44 +13,186 @@ from tasks_preprocess import make_json_compat
 from celery.exceptions import SoftTimeLimitExceeded
 
 from diagnosis.Diagnoser import Diagnoser
+from diagnosis import model_bundle
+
+import os
+import time
+import collections
+import celery.signals
+import config
+import celery_metrics
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# The queues with tasks that use the diagnoser.
+diagnoser_queues = set(['priority', 'diagnose'])
+
+def load_diagnoser(model_dir='current_classifier'):
+    """
+    Load the model bundle, or the classifier pickles if there is no bundle
+    or it was made from other pickles, and create a warmed up Diagnoser.
+    Returns the diagnoser and the seconds taken to load each artifact.
+    """
+    load_seconds = collections.OrderedDict()
+    artifacts = {}
+    bundle_path = model_bundle.find_bundle(model_dir)
+    if bundle_path is None and os.path.exists(
+        os.path.join(model_dir, model_bundle.bundle_name)):
+        logger.warning('%s was not made from the pickles in %s, loading the '
+            'pickles instead. Run python -m diagnosis.model_bundle %s to '
+            'update it.' % (model_bundle.bundle_name, model_dir, model_dir))
+    if bundle_path:
+        start = time.time()
+        bundle = model_bundle.load_bundle(bundle_path)
+        artifacts['classifier'] = bundle.classifier
+        artifacts['dict_vectorizer'] = bundle.dict_vectorizer
+        artifacts['keyword_array'] = bundle.keyword_array
+        load_seconds['model_bundle'] = time.time() - start
+        logger.info('Loaded %s (model version %s) in %.3fs' % (
+            model_bundle.bundle_name, bundle.header['modelVersion'],
+            load_seconds['model_bundle']))
+    else:
+        for name in ['classifier', 'dict_vectorizer', 'keyword_array']:
+            start = time.time()
+            with open(os.path.join(model_dir, name + '.p')) as f:
+                artifacts[name] = pickle.load(f)
+            load_seconds[name] = time.time() - start
+            logger.info('Loaded %s.p in %.3fs' % (name, load_seconds[name]))
+    start = time.time()
+    diagnoser = Diagnoser(
+        artifacts['classifier'],
+        artifacts['dict_vectorizer'],
+        keyword_array=artifacts['keyword_array'],
+        cutoff_ratio=.7
+    )
+    load_seconds['annotators'] = time.time() - start
+    logger.info('Created annotators in %.3fs' % load_seconds['annotators'])
+    # The annotators are reused by every task, so loading their
+    # resources up front keeps the first diagnosis from being slow.
+    start = time.time()
+    diagnoser.warm_up()
+    load_seconds['warm_up'] = time.time() - start
+    logger.info('Warmed up the diagnoser in %.3fs' % load_seconds['warm_up'])
+    # Processes forked after this only replace the connections found here.
+    diagnoser.find_database_connections()
+    return diagnoser, load_seconds
+
 class DiagnoserTask(celery.Task):
     """
     This abstract base class is used so the diagnoser is only loaded
-    when the tasks start running.
+    when the tasks start running, or when a worker that consumes
+    from the diagnoser queues starts.
     There are cases where this file may be imported when the the diagnoser
-    cannot be loaded (because of missing pickles).
+    cannot be loaded (because of a missing model bundle or pickles).
     """
     abstract = True
     _diagnoser = None
+    _load_seconds = None
     @property
     def diagnoser(self):
-        if self._diagnoser is None:
-            with open('current_classifier/classifier.p') as f:
-                my_classifier = pickle.load(f)
-            with open('current_classifier/dict_vectorizer.p') as f:
-                my_dict_vectorizer = pickle.load(f)
-            with open('current_classifier/keyword_array.p') as f:
-                keyword_array = pickle.load(f)
-            self._diagnoser = Diagnoser(
-                my_classifier,
-                my_dict_vectorizer,
-                keyword_array=keyword_array,
-                cutoff_ratio=.7
-            )
-        return self._diagnoser
+        if DiagnoserTask._diagnoser is None:
+            DiagnoserTask.load()
+        return DiagnoserTask._diagnoser
+    @staticmethod
+    def load():
+        """
+        Load the diagnoser shared by all the tasks in this process.
+        Returns the seconds taken to load each artifact.
+        """
+        DiagnoserTask._diagnoser, DiagnoserTask._load_seconds = load_diagnoser()
+        return DiagnoserTask._load_seconds
 
-import logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+def consumes_diagnoser_queues():
+    consume_from = celery_tasks.amqp.queues.consume_from
+    # All queues are consumed when none are selected.
+    return not consume_from or bool(diagnoser_queues & set(consume_from))
+
+worker_hostname = None
+
+@celery.signals.celeryd_init.connect
+def configure_worker(sender=None, **kwargs):
+    global worker_hostname
+    worker_hostname = sender
+    # Pool processes that don't start within PROC_ALIVE_TIMEOUT are
+    # restarted, so it needs to allow for loading the diagnoser.
+    from celery.concurrency import asynpool
+    asynpool.PROC_ALIVE_TIMEOUT = max(asynpool.PROC_ALIVE_TIMEOUT,
+        getattr(config, 'diagnoser_load_timeout', 300))
+    # Records left by processes that were killed before they could
+    # remove them are removed when the worker restarts.
+    celery_metrics.remove_ready_processes(sender)
+
+def preload_mode():
+    """
+    Return where the diagnoser is preloaded: "parent" to load it in the
+    worker's main process before the pool processes are forked, "process"
+    to load it in each pool process, or None to load it on the first task.
+    """
+    mode = getattr(config, 'preload_diagnoser', 'parent')
+    if mode is True:
+        return 'process'
+    return mode or None
+
+@celery.signals.worker_init.connect
+def preload_diagnoser_before_fork(**kwargs):
+    """
+    Load the diagnoser in the worker's main process so the pool processes
+    inherit it when they are forked. Their memory pages are shared
+    copy-on-write, so the memory mapped model bundle and the large NumPy
+    arrays in the annotators' models are only in memory once.
+    Pages of python objects are copied as their reference counts change,
+    so some of the keyword and vocabulary structures become private.
+    """
+    if preload_mode() != 'parent' or not consumes_diagnoser_queues():
+        return
+    start = time.time()
+    DiagnoserTask.load()
+    logger.info('Diagnoser loaded before forking after %.3fs' % (time.time() - start))
+
+@celery.signals.worker_process_init.connect
+def preload_diagnoser(**kwargs):
+    """
+    Make sure the diagnoser is loaded when a pool process starts. The pool
+    doesn't send tasks to a process until this returns, so tasks aren't
+    given to processes that are still loading. Once loaded, the process is
+    recorded as ready so the server can tell whether any warm processes
+    are available.
+    """
+    mode = preload_mode()
+    if mode is None or not consumes_diagnoser_queues():
+        return
+    if DiagnoserTask._diagnoser is not None:
+        # The diagnoser was inherited from the main process.
+        DiagnoserTask._diagnoser.reopen_database_connections()
+    else:
+        start = time.time()
+        DiagnoserTask.load()
+        logger.info('Diagnoser ready after %.3fs' % (time.time() - start))
+    celery_metrics.set_process_ready(
+        worker_hostname, os.getpid(), DiagnoserTask._load_seconds)
+
+@celery.signals.worker_process_shutdown.connect
+def remove_ready_process(**kwargs):
+    if DiagnoserTask._diagnoser is not None:
+        celery_metrics.remove_ready_processes(worker_hostname, os.getpid())
+
+def get_clean_english_content(text_obj):
+    english_translation = text_obj.get('englishTranslation', {}).get('content')
+    if english_translation:
+        return english_translation
+    else:
+        return text_obj.get('cleanContent', {}).get('content')
 
 @celery_tasks.task(base=DiagnoserTask, name='tasks.diagnose')
 def diagnose(text_obj, extra_args):
+    """
+    The extra_args are passed to Diagnoser.diagnose. They may include a
+    features list to limit the annotation to the tiers those features need.
+    """
     try:
-        english_translation = text_obj.get('englishTranslation', {}).get('content')
-        if english_translation:
-            clean_english_content = english_translation
-        else:
-            clean_english_content = text_obj.get('cleanContent', {}).get('content')
+        clean_english_content = get_clean_english_content(text_obj)
         if clean_english_content:
             logger.info('Diagnosing text:\n' + clean_english_content)
             return make_json_compat(diagnose.diagnoser.diagnose(
@@ -59,3 +201,65 @@ def diagnose(text_obj, extra_args):
             return { 'error' : 'No content available to diagnose.' }
     except SoftTimeLimitExceeded:
         return { 'error' : 'Timelimit exceeded.' }
+
+# The number of documents diagnose_batch processes and classifies at once,
+# and the most documents diagnose_batch_group gives each task.
+batch_chunk_size = 20
+
+def diagnose_batch_group(text_objs, extra_args, **options):
+    """
+    Return a group of diagnose_batch tasks with up to batch_chunk_size
+    documents each, so large batches are processed by several worker
+    processes in parallel and each task finishes within the time limit.
+    The options, e.g. queue and expires, are set on each task.
+    The group's result is a list of results for each task, which
+    combine_batch_results joins into a result for each document.
+    """
+    return celery.group(
+        diagnose_batch.s(text_objs[start:start + batch_chunk_size],
+            extra_args).set(**options)
+        for start in range(0, len(text_objs), batch_chunk_size))
+
+def combine_batch_results(task_results):
+    return [result for results in task_results for result in results]
+
+@celery_tasks.task(base=DiagnoserTask, name='tasks.diagnose_batch')
+def diagnose_batch(text_objs, extra_args):
+    """
+    Process and diagnose a list of documents in a single task so only one
+    broker round trip is needed. The documents are processed and classified
+    in chunks of batch_chunk_size, each over one feature matrix, so the
+    results of the chunks finished before the time limit are kept.
+    The documents are in the format accepted by process_text.
+    A result is returned for each document in the same order.
+    """
+    results = [None] * len(text_objs)
+    try:
+        for chunk_start in range(0, len(text_objs), batch_chunk_size):
+            contents = []
+            content_indices = []
+            for idx in range(chunk_start,
+                min(chunk_start + batch_chunk_size, len(text_objs))):
+                processed = tasks_preprocess.process_text(text_objs[idx])
+                if processed.get('error'):
+                    results[idx] = { 'error' : processed['error'] }
+                    continue
+                clean_english_content = get_clean_english_content(processed)
+                if clean_english_content:
+                    contents.append(clean_english_content)
+                    content_indices.append(idx)
+                else:
+                    results[idx] = { 'error' : 'No content available to diagnose.' }
+            logger.info('Diagnosing batch of %s documents' % len(contents))
+            # Diagnoser.diagnose_batch yields each document's result when its
+            # annotation is done, after the chunk is classified.
+            for idx, result in zip(content_indices,
+                diagnose_batch.diagnoser.diagnose_batch(contents, **extra_args)):
+                results[idx] = make_json_compat(result)
+    except SoftTimeLimitExceeded:
+        # The documents without results when the time limit is reached
+        # get a time limit error.
+        pass
+    return [
+        result if result is not None else { 'error' : 'Timelimit exceeded.' }
+        for result in results]
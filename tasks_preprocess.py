@@ -10,12 +10,20 @@ from distutils.version import StrictVersion
 import config
 import logging
 import datetime
-from scraper.process_resources import extract_clean_content
+from scraper.process_resources import ContentExtractor
 from scraper import scraper
 from scraper.translation import Translator
+from diagnosis_cache import cache_from_config
+# Imported to connect the signal handlers that record task metrics.
+import celery_metrics
+import serializers
 import os
 
-my_translator = Translator()
+my_translator = Translator(cache=cache_from_config(
+    getattr(config, 'translation_cache', { 'backend': 'lru' }), {}))
+# Each worker process reuses one extractor, which caches cleaned content.
+content_extractor = ContentExtractor(
+    fast_path=getattr(config, 'fast_content_extraction', False))
 
 processor_version = '0.1.0'
 
@@ -44,10 +52,14 @@ logger = logging.getLogger(__name__)
 
 celery_tasks = Celery('tasks', broker=os.environ.get('BROKER_URL') or config.BROKER_URL)
 
+# The serializer must be the same on the server and all the workers.
+# See serializers.py for the options other than pickle.
+serializer = serializers.register(getattr(config, 'celery_serializer', 'pickle'))
+
 celery_tasks.conf.update(
-    CELERY_TASK_SERIALIZER='pickle',
-    CELERY_ACCEPT_CONTENT=['pickle'],  # Ignore other content
-    CELERY_RESULT_SERIALIZER='pickle',
+    CELERY_TASK_SERIALIZER=serializer,
+    CELERY_ACCEPT_CONTENT=[serializer],  # Ignore other content
+    CELERY_RESULT_SERIALIZER=serializer,
     CELERY_RESULT_BACKEND=os.environ.get('BROKER_URL') or config.BROKER_URL,
     CELERYD_TASK_SOFT_TIME_LIMIT=60,
     CELERYD_TASK_TIME_LIMIT=65,
@@ -64,18 +76,32 @@ def scrape(url):
     """
     return make_json_compat(scraper.scrape(url))
 
+def without_html(scraped_data):
+    """
+    Return a copy of the scraper output without the html content.
+    """
+    return { key: value for key, value in scraped_data.items()
+        if key != 'htmlContent' }
+
 @celery_tasks.task(name='tasks.process_text')
-def process_text(text_obj):
+def process_text(text_obj, keep_html=False):
+    """
+    Extract the clean content from scraper output and translate it to English.
+    The scraped html is left out of the scrapedData in the result unless
+    keep_html is True, since the result is passed on to the diagnose task
+    and stored in the result backend but only the clean content is used.
+    """
     result = {}
     # These first conditions are for handling scraper output. They are currently
     # unnecessairy since we don't allow users to submit URLs.
+    scraped_data = text_obj if keep_html else without_html(text_obj)
     if text_obj.get('unscrapable'):
-        result['scrapedData'] = text_obj
+        result['scrapedData'] = scraped_data
         result['error'] = text_obj.get('error', text_obj.get('exception'))
         return make_json_compat(result)
     if 'htmlContent' in text_obj:
-        result['scrapedData'] = text_obj
-        clean_content = extract_clean_content(text_obj['htmlContent'])
+        result['scrapedData'] = scraped_data
+        clean_content = content_extractor.extract(text_obj['htmlContent'])
     else:
         clean_content = text_obj
     if my_translator.is_english(clean_content['content']):
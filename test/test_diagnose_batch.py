@@ -0,0 +1,51 @@
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import unittest
+import tasks_diagnose
+
+class FakeDiagnoser(object):
+    """
+    Records the size of each batch it diagnoses.
+    """
+    def __init__(self):
+        self.batch_sizes = []
+    def diagnose_batch(self, contents, **kwargs):
+        self.batch_sizes.append(len(contents))
+        for content in contents:
+            yield { 'diseases': [{ 'name': content }] }
+
+class TestDiagnoseBatch(unittest.TestCase):
+    def setUp(self):
+        self.original_diagnoser = tasks_diagnose.DiagnoserTask._diagnoser
+        self.diagnoser = tasks_diagnose.DiagnoserTask._diagnoser = FakeDiagnoser()
+        tasks_diagnose.celery_tasks.conf.CELERY_ALWAYS_EAGER = True
+
+    def tearDown(self):
+        tasks_diagnose.DiagnoserTask._diagnoser = self.original_diagnoser
+        tasks_diagnose.celery_tasks.conf.CELERY_ALWAYS_EAGER = False
+
+    def test_full_batch(self):
+        text_objs = [{ 'content': 'document %d' % idx } for idx in range(200)]
+        group = tasks_diagnose.diagnose_batch_group(
+            text_objs, { 'diseases_only': True }, queue='priority')
+        self.assertEqual(len(group.tasks), 200 / tasks_diagnose.batch_chunk_size)
+        for task in group.tasks:
+            self.assertLessEqual(len(task.args[0]), tasks_diagnose.batch_chunk_size)
+            self.assertEqual(task.options['queue'], 'priority')
+        results = tasks_diagnose.combine_batch_results(group().get())
+        self.assertEqual(
+            [result['diseases'][0]['name'] for result in results],
+            [text_obj['content'] for text_obj in text_objs])
+        self.assertEqual(self.diagnoser.batch_sizes,
+            [tasks_diagnose.batch_chunk_size] * 10)
+
+    def test_errors(self):
+        results = tasks_diagnose.combine_batch_results(
+            tasks_diagnose.diagnose_batch_group([
+                { 'content': 'document' },
+                { 'content': '' },
+                { 'unscrapable': True, 'exception': 'Not found' }
+            ], {})().get())
+        self.assertEqual(results, [
+            { 'diseases': [{ 'name': 'document' }] },
+            { 'error': 'No content available to diagnose.' },
+            { 'error': 'Not found' }])
@@ -0,0 +1,103 @@
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import unittest
+import json
+import multiprocessing
+import shutil
+import tempfile
+import diagnose_corpus
+
+def word_count(item):
+    doc_id, text_obj = item
+    return { 'id': doc_id, 'words': len(text_obj['content'].split()) }
+
+class TestDiagnoseCorpus(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.directory, 'corpus.ndjson')
+        self.output_path = os.path.join(self.directory, 'results.ndjson')
+        self.checkpoint_path = os.path.join(self.directory, 'results.checkpoint')
+        with open(self.input_path, 'w') as f:
+            for idx in range(10):
+                f.write(json.dumps({ '_id': 'doc%d' % idx, 'content': 'word ' * idx }) + '\n')
+            f.write('\n')
+            f.write(json.dumps({ 'body': { 'text': 'a b' } }) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_output(self):
+        with open(self.output_path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_read_ndjson(self):
+        items = list(diagnose_corpus.read_ndjson(self.input_path))
+        self.assertEqual(len(items), 11)
+        self.assertEqual(items[2], ('doc2', { 'content': 'word word ' }))
+        # Documents without ids are identified by their line number.
+        self.assertEqual(items[10], (11, { 'content': '' }))
+        items = list(diagnose_corpus.read_ndjson(self.input_path, skip=10,
+            content_field='body.text'))
+        self.assertEqual(items, [(11, { 'content': 'a b' })])
+
+    def test_bounded_imap(self):
+        pool = multiprocessing.Pool(2)
+        try:
+            results = list(diagnose_corpus.bounded_imap(pool, word_count,
+                diagnose_corpus.read_ndjson(self.input_path), max_pending=3))
+        finally:
+            pool.terminate()
+        self.assertEqual([result['words'] for result in results], range(10) + [0])
+
+    def test_resume(self):
+        checkpoint = diagnose_corpus.Checkpoint(self.checkpoint_path)
+        items = diagnose_corpus.read_ndjson(self.input_path)
+        results = (word_count(items.next()) for i in range(5))
+        diagnose_corpus.write_results(results, self.output_path, checkpoint,
+            checkpoint_every=2)
+        # A partial result written after the checkpoint is discarded.
+        with open(self.output_path, 'a') as f:
+            f.write('{"id": "doc5", "wor')
+        checkpoint = diagnose_corpus.Checkpoint(self.checkpoint_path)
+        self.assertEqual(checkpoint.documents, 5)
+        items = diagnose_corpus.read_ndjson(self.input_path, checkpoint.documents)
+        self.assertEqual(diagnose_corpus.write_results(
+            map(word_count, items), self.output_path, checkpoint), 11)
+        self.assertEqual([result['id'] for result in self.read_output()],
+            ['doc%d' % idx for idx in range(10)] + [11])
+
+    def test_missing_output(self):
+        diagnose_corpus.Checkpoint(self.checkpoint_path).save(5, 100)
+        checkpoint = diagnose_corpus.Checkpoint(self.checkpoint_path, self.output_path)
+        self.assertEqual(checkpoint.documents, 0)
+        items = diagnose_corpus.read_ndjson(self.input_path, checkpoint.documents)
+        self.assertEqual(diagnose_corpus.write_results(
+            map(word_count, items), self.output_path, checkpoint), 11)
+        self.assertEqual(len(self.read_output()), 11)
+
+    def test_text_object(self):
+        document = { 'content': ('not', 'text'), 'body': { 'text': bytearray('x') } }
+        self.assertEqual(diagnose_corpus.text_object(document), { 'content': '' })
+        self.assertEqual(diagnose_corpus.text_object(document, 'body.text'),
+            { 'content': '' })
+        self.assertEqual(diagnose_corpus.text_object(document, 'body.missing.text'),
+            { 'content': '' })
+
+    def test_diagnose_document(self):
+        class FakeDiagnoser(object):
+            def reopen_database_connections(self):
+                return []
+            def diagnose(self, content, **kwargs):
+                return { 'args': kwargs, 'timings': { 'tier.geonames': 0.1 } }
+        diagnose_corpus.diagnoser = FakeDiagnoser()
+        try:
+            diagnose_corpus.init_process('current_classifier',
+                { 'include_incidents': True })
+            result = diagnose_corpus.diagnose_document(
+                ('doc0', { 'content': 'An outbreak of cholera in Nairobi.' }))
+        finally:
+            diagnose_corpus.diagnoser = None
+        # The infection annotator is used by default like the server does.
+        self.assertEqual(result, { 'id': 'doc0', 'diagnosis': { 'args': {
+            'include_incidents': True,
+            'use_infection_annotator': True
+        } } })
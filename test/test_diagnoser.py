@@ -82,6 +82,106 @@ class TestDiagnoser(unittest.TestCase):
                 timedelta(seconds=30)
             )
 
+    def test_stage_timings(self):
+        diagnosis = self.my_diagnoser.diagnose(
+            "An outbreak of cholera in the district on March 3rd sickened 87 people.")
+        timings = diagnosis['timings']
+        for stage in ['keyword_extraction', 'vectorization', 'classification',
+                      'tier.keywords', 'tier.geonames', 'span_filtering',
+                      'output_assembly', 'total']:
+            self.assertIn(stage, timings)
+        self.assertLessEqual(
+            sum(v for k, v in timings.items() if k != 'total'),
+            timings['total'])
+
+    def test_feature_selection(self):
+        diagnosis = self.my_diagnoser.diagnose(
+            "An outbreak of cholera in Nairobi on March 3rd sickened 87 people.",
+            features=['geonames'])
+        self.assertTrue(len(diagnosis['diseases']) > 0)
+        self.assertSetEqual(
+            set(feature['type'] for feature in diagnosis['features']),
+            set(['location']))
+        self.assertNotIn('structuredIncidents', diagnosis)
+        self.assertIn('tier.geonames', diagnosis['timings'])
+        self.assertNotIn('tier.counts', diagnosis['timings'])
+        self.assertNotIn('tier.structured_incidents', diagnosis['timings'])
+
+    def test_counts_feature_selection(self):
+        content = ("As of March 3rd there were 87 cases of cholera and 12 deaths "
+            "in Nairobi, up from 40 cases the week before.")
+        def counts(diagnosis):
+            return sorted(
+                (feature['textOffsets'], feature['type'], feature['text'])
+                for feature in diagnosis['features']
+                if feature['type'] in ['count', 'caseCount'])
+        full_counts = counts(self.my_diagnoser.diagnose(content))
+        self.assertTrue(len(full_counts) > 0)
+        self.assertEqual(
+            counts(self.my_diagnoser.diagnose(content, features=['counts'])),
+            full_counts)
+
+    def test_reopen_database_connections_after_fork(self):
+        import json, sqlite3
+        content = "An outbreak of cholera in Nairobi sickened 87 people."
+        # Connections created when the annotators are first used are made
+        # before forking, as they are when the diagnoser is warmed up.
+        expected = self.my_diagnoser.diagnose(content, features=['geonames'])
+        # The original connections are kept referenced so their ids
+        # can't be reused by the new connections.
+        originals = [value for annotator in vars(self.my_diagnoser).values()
+            if hasattr(annotator, '__dict__')
+            for value in vars(annotator).values()
+            if isinstance(value, sqlite3.Connection)]
+        original_ids = set(map(id, originals))
+        self.assertTrue(len(original_ids) > 0)
+        locations = self.my_diagnoser.find_database_connections()
+        self.assertGreaterEqual(len(locations), len(original_ids))
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                reopened = self.my_diagnoser.reopen_database_connections()
+                diagnosis = self.my_diagnoser.diagnose(content, features=['geonames'])
+                os.write(write_fd, json.dumps({
+                    'reopened': len(reopened),
+                    'sharedConnections': len(original_ids & set(map(id, reopened))),
+                    'geonames': [feature['name'] for feature in diagnosis['features']]
+                }))
+            finally:
+                os._exit(0)
+        os.close(write_fd)
+        output = os.read(read_fd, 100000)
+        os.waitpid(pid, 0)
+        child = json.loads(output)
+        self.assertGreaterEqual(child['reopened'], len(original_ids))
+        self.assertEqual(child['sharedConnections'], 0)
+        self.assertEqual(child['geonames'],
+            [feature['name'] for feature in expected['features']])
+        self.assertTrue(len(child['geonames']) > 0)
+        # The parent's connections still work.
+        self.assertEqual(
+            self.my_diagnoser.diagnose(content, features=['geonames'])['features'],
+            expected['features'])
+
+    def test_warm_up(self):
+        annotator = self.my_diagnoser.incident_annotator
+        for timings in self.my_diagnoser.warm_up():
+            self.assertIn('tier.structured_incidents', timings)
+            self.assertIn('tier.incidents', timings)
+        self.my_diagnoser.diagnose("87 cases of cholera", include_incidents=True)
+        self.assertIs(annotator, self.my_diagnoser.incident_annotator)
+
+    def test_required_tiers(self):
+        from diagnosis.Diagnoser import required_tiers
+        self.assertEqual(required_tiers(['geonames']), ['geonames'])
+        self.assertEqual(required_tiers(['diseases']), [])
+        self.assertEqual(
+            required_tiers(['structuredIncidents']),
+            ['resolved_keywords', 'dates', 'counts', 'geonames',
+             'structured_incidents'])
+        self.assertRaises(ValueError, required_tiers, ['unknown'])
+
     def test_inference(self):
         import disease_label_table
         self.assertSetEqual(set(['Avian Influenza', 'Influenza']),
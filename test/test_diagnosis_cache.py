@@ -0,0 +1,78 @@
+# coding=utf8
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import unittest
+import datetime
+import time
+from diagnosis_cache import DiagnosisCache, LRUCacheBackend, RedisCacheBackend,\
+    cache_from_config
+
+class TestDiagnosisCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = DiagnosisCache(
+            LRUCacheBackend(max_size=2, ttl=60), { 'Diagnoser': '0.4.4' })
+
+    def test_keys(self):
+        key = self.cache.make_key('content', u'Ébola', { 'include_incidents': False })
+        self.assertEqual(key, self.cache.make_key(
+            'content', u'Ébola', { 'include_incidents': False }))
+        self.assertNotEqual(key, self.cache.make_key(
+            'content', u'Ébola', { 'include_incidents': True }))
+        self.assertNotEqual(key, self.cache.make_key(
+            'url', u'Ébola', { 'include_incidents': False }))
+        self.assertNotEqual(key, DiagnosisCache(None, { 'Diagnoser': '0.4.5' })\
+            .make_key('content', u'Ébola', { 'include_incidents': False }))
+        self.assertNotEqual(
+            self.cache.make_key('content', 'a', {
+                'content_date': datetime.datetime(2017, 1, 1) }),
+            self.cache.make_key('content', 'a', {
+                'content_date': datetime.datetime(2017, 1, 2) }))
+
+    def test_lru_eviction_and_stats(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.cache.set('c', 3)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('c'), 3)
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['size'], 2)
+
+    def test_redis_stats(self):
+        class FakeRedis(dict):
+            def set(self, key, value, ex=None):
+                self[key] = value
+            def keys(self, pattern):
+                # The keys command blocks redis while it scans every key.
+                self.scanned = True
+                return dict.keys(self)
+        client = FakeRedis()
+        cache = DiagnosisCache(RedisCacheBackend(client), {})
+        cache.set('a', { 'diseases': [] })
+        self.assertEqual(cache.get('a'), { 'diseases': [] })
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertIsNone(stats['size'])
+        self.assertEqual(stats['errors'], 0)
+        self.assertFalse(hasattr(client, 'scanned'))
+
+    def test_unavailable_mongo(self):
+        # Creating the cache doesn't wait for the server.
+        start = time.time()
+        cache = cache_from_config({
+            'backend': 'mongo',
+            'url': 'mongodb://localhost:1',
+            'server_selection_timeout_ms': 100
+        }, {})
+        self.assertLess(time.time() - start, 1)
+        # Errors are counted and treated as misses.
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1)
+        self.assertEqual(cache.stats()['errors'], 2)
+        self.assertFalse(cache.backend._index_created)
+
+    def test_ttl(self):
+        backend = LRUCacheBackend(ttl=-1)
+        backend.set('a', 1)
+        self.assertIsNone(backend.get('a'))
@@ -0,0 +1,36 @@
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import unittest
+import disease_label_table
+
+class TestLabelTable(unittest.TestCase):
+    def setUp(self):
+        self.label_table = disease_label_table.get_label_table()
+
+    def test_shared_instance(self):
+        self.assertIs(self.label_table, disease_label_table.get_label_table())
+
+    def test_immutable(self):
+        with self.assertRaises(AttributeError):
+            self.label_table.labels = []
+
+    def test_lookups(self):
+        self.assertTrue(self.label_table.is_in_table('Avian Influenza H7N9'))
+        self.assertFalse(self.label_table.is_in_table('Not a disease label'))
+        self.assertTrue(self.label_table.is_not_human_disease('African Horse Sickness'))
+        self.assertEqual(self.label_table.resolve('crimean-congo hemorrhagic fever'),
+            self.label_table.resolve('CCHF'))
+        self.assertIsNone(self.label_table.resolve('Not a disease label'))
+
+    def test_inference(self):
+        self.assertEqual(
+            disease_label_table.get_inferred_labels('Avian Influenza H7N9'),
+            ['Avian Influenza', 'Influenza'])
+        self.assertEqual(disease_label_table.get_inferred_labels('Influenza'), [])
+
+    def test_ancestor_matrix(self):
+        labels = ['Influenza', 'Avian Influenza', 'Avian Influenza H7N9']
+        matrix = self.label_table.get_ancestor_matrix(labels)
+        self.assertEqual(matrix.tolist(), [
+            [False, False, False],
+            [True, False, False],
+            [True, True, False]])
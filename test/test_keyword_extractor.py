@@ -0,0 +1,57 @@
+# coding=utf8
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import unittest
+from sklearn.feature_extraction.text import CountVectorizer
+from diagnosis.KeywordExtractor import KeywordExtractor
+
+keyword_array = [
+    { 'keyword': 'Hepatitis A', 'case_sensitive': False },
+    { 'keyword': 'hepatitis', 'case_sensitive': False },
+    { 'keyword': 'Foot and Mouth', 'case_sensitive': False },
+    { 'keyword': 'Hand, Foot and Mouth', 'case_sensitive': False },
+    { 'keyword': 'one two three four five six', 'case_sensitive': False },
+    { 'keyword': 'MERS', 'case_sensitive': True },
+    { 'keyword': 'SARS CoV', 'case_sensitive': True },
+]
+
+def reference_transform(texts):
+    """
+    The original CountVectorizer based extraction.
+    """
+    token_pattern = r'(?u)\b(?:(?:http\S+)|\w+)\b'
+    extractor = KeywordExtractor(keyword_array)
+    def vocab(case_sensitive, analyser):
+        return set(
+            ' '.join(analyser(kw['keyword']))
+            for kw in keyword_array if kw['case_sensitive'] == case_sensitive)
+    vectorizers = [
+        CountVectorizer(
+            vocabulary=vocab(False, extractor.case_insensitive_analyser),
+            token_pattern=token_pattern,
+            ngram_range=(1, 5)),
+        CountVectorizer(
+            vocabulary=vocab(True, extractor.case_sensitive_analyser),
+            token_pattern=token_pattern,
+            ngram_range=(1, 1),
+            lowercase=False)]
+    out_dicts = [{} for text in texts]
+    for vectorizer in vectorizers:
+        mat = vectorizer.fit_transform(texts)
+        vocab = vectorizer.get_feature_names()
+        for r, out_dict in enumerate(out_dicts):
+            for c in mat[r].nonzero()[1]:
+                out_dict[vocab[c]] = mat[r,c]
+    return out_dicts
+
+class TestKeywordExtractor(unittest.TestCase):
+    def test_matches_count_vectorizer(self):
+        texts = [
+            u"Hepatitis A and hepatitis a cases. Hand, foot and mouth disease.",
+            u"MERS and mers. SARS CoV is not matched case sensitively.",
+            u"one two three four five six http://example.com/hepatitis",
+            u"",
+            u"Foot and Mouth foot AND mouth Hepatitis"
+        ]
+        self.assertEqual(
+            KeywordExtractor(keyword_array).transform(texts),
+            reference_transform(texts))
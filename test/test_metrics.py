@@ -0,0 +1,93 @@
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import unittest
+import metrics
+
+class TestHistogram(unittest.TestCase):
+    def test_buckets(self):
+        histogram = metrics.Histogram(
+            'test_seconds', 'Test durations', ['stage'], buckets=[0.1, 1.0])
+        for value in [0.05, 0.1, 0.5, 2.0]:
+            histogram.observe(value, 'a')
+        histogram.observe(0.2, 'b')
+        self.assertEqual(histogram.cumulative_buckets(('a',)), [
+            (0.1, 2), (1.0, 3), (float('inf'), 4)])
+        summary = histogram.summary()
+        self.assertEqual(summary['a']['count'], 4)
+        self.assertAlmostEqual(summary['a']['sum'], 2.65)
+        self.assertEqual(summary['b']['count'], 1)
+    def test_label_values_required(self):
+        histogram = metrics.Histogram('test_seconds', 'Test durations', ['stage'])
+        self.assertRaises(ValueError, histogram.observe, 1.0)
+
+class TestRender(unittest.TestCase):
+    def test_text_format(self):
+        histogram = metrics.Histogram(
+            'test_seconds', 'Test durations', ['route'], buckets=[0.1])
+        histogram.observe(0.05, '/diagnose')
+        counter = metrics.Counter('test_total', 'Test counts', ['outcome'])
+        counter.inc('success')
+        counter.inc('success')
+        gauge = metrics.Gauge('test_in_flight', 'Test gauge', ['route'])
+        gauge.inc('/a"b')
+        gauge.inc('/a"b')
+        gauge.dec('/a"b')
+        self.assertEqual(metrics.render([histogram, counter, gauge]).split('\n'), [
+            '# HELP test_seconds Test durations',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{route="/diagnose",le="0.1"} 1',
+            'test_seconds_bucket{route="/diagnose",le="+Inf"} 1',
+            'test_seconds_sum{route="/diagnose"} 0.05',
+            'test_seconds_count{route="/diagnose"} 1',
+            '# HELP test_total Test counts',
+            '# TYPE test_total counter',
+            'test_total{outcome="success"} 2.0',
+            '# HELP test_in_flight Test gauge',
+            '# TYPE test_in_flight gauge',
+            'test_in_flight{route="/a\\"b"} 1.0',
+            ''])
+
+class FakeCursor(list):
+    def sort(self, key):
+        return FakeCursor(sorted(self, key=lambda doc: doc[key]))
+
+class FakeCollection(object):
+    """
+    Supports the upserts and queries used by the Mongo metrics.
+    """
+    def __init__(self):
+        self.docs = {}
+    def update_one(self, query, update, upsert=False):
+        doc = self.docs.get(query['_id'])
+        if doc is None:
+            doc = dict(query, **update.get('$setOnInsert', {}))
+            self.docs[query['_id']] = doc
+        for path, amount in update['$inc'].items():
+            target = doc
+            keys = path.split('.')
+            for key in keys[:-1]:
+                target = target.setdefault(key, {})
+            target[keys[-1]] = target.get(keys[-1], 0) + amount
+    def find(self, query):
+        return FakeCursor(doc for doc in self.docs.values()
+            if all(doc.get(k) == v for k, v in query.items()))
+
+class TestMongoMetrics(unittest.TestCase):
+    def test_shared_values(self):
+        collection = FakeCollection()
+        # Separate instances stand in for separate worker processes.
+        for value in [0.05, 2.0]:
+            metrics.MongoHistogram(
+                collection, 'test_wait_seconds', 'Test waits', ['queue'],
+                buckets=[0.1, 1.0]).observe(value, 'priority')
+            metrics.MongoCounter(
+                collection, 'test_total', 'Test counts', ['outcome']).inc('success')
+        histogram = metrics.MongoHistogram(
+            collection, 'test_wait_seconds', 'Test waits', ['queue'],
+            buckets=[0.1, 1.0])
+        counter = metrics.MongoCounter(
+            collection, 'test_total', 'Test counts', ['outcome'])
+        text = metrics.render([histogram, counter])
+        self.assertEqual(histogram.cumulative_buckets(('priority',)), [
+            (0.1, 1), (1.0, 1), (float('inf'), 2)])
+        self.assertEqual(counter.values, { ('success',): 2 })
+        self.assertIn('test_total{outcome="success"} 2.0', text)
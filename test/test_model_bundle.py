@@ -0,0 +1,111 @@
+# coding=utf8
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import unittest
+import shutil
+import tempfile
+import numpy as np
+from sklearn.feature_extraction import DictVectorizer
+from sklearn.multiclass import OneVsRestClassifier
+from sklearn.linear_model import LogisticRegression
+from diagnosis import model_bundle
+
+keyword_array = [
+    { 'keyword': u'cholera', 'case_sensitive': False, 'category': 'doid/diseases',
+      'linked_keywords': [u'diarrhea'], 'synset_object': { 'unused': True } },
+    { 'keyword': u'diarrhea', 'case_sensitive': False, 'category': 'eha/symptom',
+      'linked_keywords': [] },
+    { 'keyword': u'MERS', 'case_sensitive': True, 'category': 'eha/disease',
+      'linked_keywords': [] },
+    { 'keyword': u'fièvre', 'case_sensitive': False, 'category': 'eha/symptom',
+      'linked_keywords': [] },
+]
+
+feature_dicts = [
+    { u'cholera': 1, u'diarrhea': 1 },
+    { u'MERS': 1 },
+    { u'fièvre': 1, u'MERS': 1 },
+    { u'diarrhea': 1 },
+    { u'cholera': 1 },
+    { u'fièvre': 1 },
+]
+labels = ['Cholera', 'MERS', 'MERS', 'Cholera', 'Cholera', 'Dengue']
+
+class TestModelBundle(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, model_bundle.bundle_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_bundle(self, sparse, mmap):
+        dict_vectorizer = DictVectorizer(sparse=sparse).fit(feature_dicts)
+        X = dict_vectorizer.transform(feature_dicts)
+        classifier = OneVsRestClassifier(LogisticRegression()).fit(X, labels)
+        model_bundle.write_bundle(
+            self.path, classifier, dict_vectorizer, keyword_array)
+        bundle = model_bundle.load_bundle(self.path, mmap=mmap)
+        self.assertEqual(bundle.dict_vectorizer.get_feature_names(),
+            dict_vectorizer.get_feature_names())
+        bundle_X = bundle.dict_vectorizer.transform(feature_dicts)
+        self.assertEqual(bundle_X.shape, X.shape)
+        self.assertEqual(list(bundle.classifier.classes_), list(classifier.classes_))
+        np.testing.assert_allclose(
+            bundle.classifier.predict_proba(bundle_X),
+            classifier.predict_proba(X))
+        self.assertIsInstance(bundle.classifier.coef_by_feature,
+            np.memmap if mmap else np.ndarray)
+        np.testing.assert_allclose(
+            bundle.classifier.coef_[1],
+            classifier.estimators_[1].coef_[0])
+        self.assertEqual(bundle.keyword_array[0], {
+            'keyword': u'cholera',
+            'case_sensitive': False,
+            'category': 'doid/diseases',
+            'linked_keywords': [u'diarrhea']
+        })
+        self.assertEqual(bundle.keyword_array[3]['keyword'], u'fièvre')
+
+    def test_dense(self):
+        self.check_bundle(sparse=False, mmap=True)
+
+    def test_sparse(self):
+        self.check_bundle(sparse=True, mmap=True)
+
+    def test_without_mmap(self):
+        self.check_bundle(sparse=True, mmap=False)
+
+    def test_format_version(self):
+        with open(self.path, 'wb') as f:
+            f.write('not a bundle')
+        self.assertRaises(ValueError, model_bundle.load_bundle, self.path)
+
+    def test_stale_bundle(self):
+        import pickle
+        dict_vectorizer = DictVectorizer().fit(feature_dicts)
+        classifier = OneVsRestClassifier(LogisticRegression()).fit(
+            dict_vectorizer.transform(feature_dicts), labels)
+        def write_pickles(keywords):
+            for name, artifact in zip(model_bundle.pickle_names,
+                [classifier, dict_vectorizer, keywords]):
+                with open(os.path.join(self.directory, name), 'wb') as f:
+                    pickle.dump(artifact, f)
+        # A bundle is used when there are no pickles next to it.
+        model_bundle.write_bundle(
+            self.path, classifier, dict_vectorizer, keyword_array)
+        self.assertEqual(model_bundle.find_bundle(self.directory), self.path)
+        # It isn't used when it doesn't record the pickles next to it.
+        write_pickles(keyword_array)
+        self.assertIsNone(model_bundle.find_bundle(self.directory))
+        model_bundle.write_bundle(
+            self.path, classifier, dict_vectorizer, keyword_array,
+            pickle_dir=self.directory)
+        self.assertEqual(model_bundle.find_bundle(self.directory), self.path)
+        # Copies of the same pickles with new modification times still match.
+        for name in model_bundle.pickle_names:
+            os.utime(os.path.join(self.directory, name), (0, 0))
+        self.assertEqual(model_bundle.find_bundle(self.directory), self.path)
+        # New pickles, like the ones synced from s3, make the bundle stale.
+        write_pickles(keyword_array[:2])
+        self.assertIsNone(model_bundle.find_bundle(self.directory))
+        self.assertEqual(len(model_bundle.load_model(self.directory)[2]), 2)
@@ -0,0 +1,43 @@
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import unittest
+import codecs
+import tasks_preprocess
+
+article_path = os.path.join(os.path.dirname(__file__),
+    "..", "scraper", "test_data", "articles", "article_1.html")
+
+class TestProcessText(unittest.TestCase):
+    def setUp(self):
+        with codecs.open(article_path, encoding='utf-8') as f:
+            self.scraped = {
+                'url': 'http://example.com/article',
+                'code': 200,
+                'htmlContent': f.read()
+            }
+
+    def test_without_html(self):
+        self.assertEqual(tasks_preprocess.without_html(self.scraped), {
+            'url': 'http://example.com/article',
+            'code': 200
+        })
+        self.assertIn('htmlContent', self.scraped)
+
+    def test_html_removed(self):
+        result = tasks_preprocess.process_text(self.scraped)
+        self.assertNotIn('htmlContent', result['scrapedData'])
+        self.assertEqual(result['scrapedData']['url'], self.scraped['url'])
+        self.assertTrue(len(result['cleanContent']['content']) > 0)
+
+    def test_keep_html(self):
+        result = tasks_preprocess.process_text(self.scraped, keep_html=True)
+        self.assertEqual(result['scrapedData']['htmlContent'],
+            self.scraped['htmlContent'])
+
+    def test_unscrapable(self):
+        result = tasks_preprocess.process_text({
+            'unscrapable': True,
+            'exception': 'Not found',
+            'htmlContent': '<html></html>'
+        })
+        self.assertEqual(result['error'], 'Not found')
+        self.assertNotIn('htmlContent', result['scrapedData'])
@@ -0,0 +1,77 @@
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import unittest
+import tornado.ioloop
+from result_watcher import ResultWatcher, percentile
+
+class FakeResultSet(object):
+    def __init__(self, checks_until_ready):
+        self.checks_until_ready = checks_until_ready
+        self.checks = 0
+    def ready(self):
+        self.checks += 1
+        return self.checks > self.checks_until_ready
+    def failed(self):
+        return False
+
+class TestResultWatcher(unittest.TestCase):
+    def setUp(self):
+        self.io_loop = tornado.ioloop.IOLoop()
+        self.watcher = ResultWatcher(
+            min_interval=0.001, max_interval=0.004, io_loop=self.io_loop)
+
+    def tearDown(self):
+        self.io_loop.close()
+
+    def test_ready_immediately(self):
+        completed = []
+        self.watcher.watch(FakeResultSet(0), lambda: completed.append(1))
+        self.assertEqual(completed, [1])
+        self.assertEqual(len(self.watcher), 0)
+
+    def test_multiplexed_results(self):
+        completed = []
+        res_sets = [FakeResultSet(n) for n in [1, 3, 6]]
+        for idx, res_set in enumerate(res_sets):
+            self.watcher.watch(
+                res_set, lambda idx=idx: completed.append(idx), 'test')
+        def stop_when_done():
+            if len(completed) == len(res_sets):
+                self.io_loop.stop()
+        tornado.ioloop.PeriodicCallback(
+            stop_when_done, 1, io_loop=self.io_loop).start()
+        self.io_loop.call_later(5, self.io_loop.stop)
+        self.io_loop.start()
+        self.assertEqual(completed, [0, 1, 2])
+        self.assertEqual(len(self.watcher), 0)
+        summary = self.watcher.queue_to_response.summary()
+        self.assertEqual(summary['test']['count'], 3)
+        self.assertLessEqual(summary['test']['p50'], summary['test']['p99'])
+
+    def test_backend_error(self):
+        class FailingResultSet(FakeResultSet):
+            def ready(self):
+                FakeResultSet.ready(self)
+                if self.checks == 2:
+                    raise IOError("Result backend unavailable")
+                return False
+        completed = []
+        self.watcher.watch(FailingResultSet(0), lambda: completed.append('failing'))
+        self.watcher.watch(FakeResultSet(4), lambda: completed.append('ok'))
+        def stop_when_done():
+            if len(completed) == 2:
+                self.io_loop.stop()
+        tornado.ioloop.PeriodicCallback(
+            stop_when_done, 1, io_loop=self.io_loop).start()
+        self.io_loop.call_later(5, self.io_loop.stop)
+        self.io_loop.start()
+        # The failing entry's callback is called so it can report the
+        # error and the watcher keeps checking the other results.
+        self.assertEqual(completed, ['failing', 'ok'])
+        self.assertEqual(len(self.watcher), 0)
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 50), 51)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertIsNone(percentile([], 50))
@@ -0,0 +1,49 @@
+# coding=utf8
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import unittest
+import datetime
+import dateutil.tz
+from kombu.serialization import dumps, loads
+import serializers
+
+document = {
+    'scrapedData': {
+        'htmlContent': u'<p>Cas de fièvre à Conakry</p>' * 1000,
+        'code': 200
+    },
+    'cleanContent': { 'content': u'Cas de fièvre à Conakry' },
+    'keywords': [{ 'name': u'fever', 'score': 0.5 }],
+    'diseases': [],
+    'content_date': datetime.datetime(2016, 3, 1, 12, 30),
+    'utc_date': datetime.datetime(2016, 3, 1, 12, 30, tzinfo=dateutil.tz.tzutc())
+}
+
+class TestSerializers(unittest.TestCase):
+    def check_round_trip(self, name):
+        serializers.register(name)
+        content_type, content_encoding, data = dumps(document, serializer=name)
+        self.assertEqual(content_type, serializers.serializers[name][2])
+        self.assertEqual(loads(data, content_type, content_encoding,
+            accept=[content_type]), document)
+        small_document = { 'url': u'http://example.com/fièvre' }
+        content_type, content_encoding, data = dumps(small_document, serializer=name)
+        self.assertEqual(data[0], serializers.UNCOMPRESSED)
+        self.assertEqual(loads(data, content_type, content_encoding,
+            accept=[content_type]), small_document)
+
+    def test_json(self):
+        self.check_round_trip('json-zlib')
+
+    def test_msgpack(self):
+        self.check_round_trip('msgpack-zlib')
+
+    def test_compression(self):
+        data = serializers.json_dumps(document)
+        self.assertEqual(data[0], serializers.COMPRESSED)
+        self.assertLess(len(data), len(document['scrapedData']['htmlContent']) / 10)
+
+    def test_pickle(self):
+        self.assertEqual(serializers.register('pickle'), 'pickle')
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, serializers.json_loads, '{}')
@@ -7,6 +7,7 @@ import config
 import diagnosis
 from diagnosis.KeywordExtractor import *
 from diagnosis.Diagnoser import Diagnoser
+from diagnosis import model_bundle
 import numpy as np
 import re
 import sklearn
@@ -19,12 +20,8 @@ import warnings
 from DataSet import fetch_datasets
 
 def run_tests(pickle_dir="classifier_conf"):
-    with open(os.path.join(pickle_dir, 'classifier.p')) as f:
-        my_classifier = pickle.load(f)
-    with open(os.path.join(pickle_dir, 'dict_vectorizer.p')) as f:
-        my_dict_vectorizer = pickle.load(f)
-    with open(os.path.join(pickle_dir, 'keyword_array.p')) as f:
-        keyword_array = pickle.load(f)
+    my_classifier, my_dict_vectorizer, keyword_array = model_bundle.load_model(
+        pickle_dir)
     
     # Keyword Extraction
     feature_extractor = Pipeline([
@@ -46,6 +43,7 @@ def run_tests(pickle_dir="classifier_conf"):
     time_offset_test_set.remove_zero_feature_vectors()
     mixed_test_set.remove_zero_feature_vectors()
     training_set.remove_zero_feature_vectors()
+    print "Feature vectors:", "sparse" if my_dict_vectorizer.sparse else "dense"
     
     my_diagnoser = Diagnoser(
         my_classifier,
@@ -71,12 +69,15 @@ def run_tests(pickle_dir="classifier_conf"):
             ]
             print "Labels we have no training data for:", len(not_in_train),'/', len(validation_label_set)
             print set(not_in_train)
+            guesses = my_diagnoser.best_guess_batch(
+                my_diagnoser.classifier.predict_proba(
+                    data_set.get_feature_vectors()))
             predictions = [
                 tuple([
                     my_diagnoser.classifier.classes_[i]
-                    for i, p in my_diagnoser.best_guess(X)
+                    for i, p in row_guesses
                 ])
-                for X in data_set.get_feature_vectors()
+                for row_guesses in guesses
             ]
             # I've noticed that the macro f-score is not the harmonic mean of 
             # the percision and recall. Perhaps this could be a result of the 
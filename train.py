@@ -7,6 +7,7 @@ import config
 import diagnosis
 from diagnosis.KeywordExtractor import *
 from diagnosis.Diagnoser import Diagnoser
+from diagnosis import model_bundle
 import numpy as np
 import re
 import sklearn
@@ -53,7 +54,7 @@ def get_pickle(filename):
         print filename, "loaded"
         return result
 
-def train(debug, pickle_dir):
+def train(debug, pickle_dir, sparse=False):
     latestPickle = list(ontology_file_helpers.get_ontology_files())[-1].name
     keywords = get_pickle(latestPickle)
     
@@ -124,9 +125,10 @@ def train(debug, pickle_dir):
     mixed_test_set.feature_extractor =\
     training_set.feature_extractor = feature_extractor
     
-    #If we get sparse rows working with the classifier this might yeild some
-    #performance improvments.
-    my_dict_vectorizer = DictVectorizer(sparse=False).fit(training_set.get_feature_dicts())
+    # In sparse mode the feature vectors are CSR matrices all the way through
+    # training and diagnosis, which uses much less memory with large keyword
+    # vocabularies. See benchmarks/sparse_features.py for a comparison.
+    my_dict_vectorizer = DictVectorizer(sparse=sparse).fit(training_set.get_feature_dicts())
     print 'Found keywords:', len(my_dict_vectorizer.vocabulary_)
     print "Keywords in the validation set that aren't in the training set:"
     print  (
@@ -170,7 +172,7 @@ def train(debug, pickle_dir):
     # This may be due to the parent classification having such a
     # high confidence that the child labels are pushed below the cutoff.
     my_classifier.fit(
-        np.array(training_set.get_feature_vectors()),
+        training_set.get_feature_vectors(),
         np.array(training_set.get_labels()))
     
     # Pickle everything that will be needed for classification:
@@ -180,6 +182,11 @@ def train(debug, pickle_dir):
         pickle.dump(my_dict_vectorizer, f)
     with open(os.path.join(pickle_dir, 'keyword_array.p'), 'wb') as f:
         pickle.dump(keyword_array, f)
+    # The bundle is loaded by the workers in place of the pickles.
+    model_bundle.write_bundle(
+        os.path.join(pickle_dir, model_bundle.bundle_name),
+        my_classifier, my_dict_vectorizer, keyword_array,
+        pickle_dir=pickle_dir)
     
     test_classifier.run_tests(pickle_dir=pickle_dir)
 
@@ -191,5 +198,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-debug', action='store_true')
     parser.add_argument('-pickle_dir', default='')
+    parser.add_argument('-sparse', action='store_true',
+        help='Use sparse (CSR) feature vectors')
     args = parser.parse_args()
-    train(args.debug, args.pickle_dir)
+    train(args.debug, args.pickle_dir, args.sparse)